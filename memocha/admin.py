@@ -1,8 +1,9 @@
 from django.contrib import admin
-from .models import Doctor, Patient, Prescription, Video
+from .models import Doctor, Job, Patient, Prescription, Video
 
 
 admin.site.register(Doctor)
 admin.site.register(Patient)
 admin.site.register(Prescription)
-admin.site.register(Video)
\ No newline at end of file
+admin.site.register(Video)
+admin.site.register(Job)
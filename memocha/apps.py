@@ -2,4 +2,8 @@ from django.apps import AppConfig
 
 
 class RecorderConfig(AppConfig):
-    name = 'memocha'
\ No newline at end of file
+    name = 'memocha'
+
+    def ready(self):
+        # Connect the signal handlers
+        from memocha import signals  # noqa: F401
@@ -0,0 +1,189 @@
+"""
+Benchmarks of the views and model methods, run by the benchmark command.
+
+Each benchmark is a function registered with @benchmark that gets the
+Subject to run against (the doctor and patient it acts as) and returns a
+callable doing one iteration. run() times the iterations and counts their
+queries, then runs them again under tracemalloc for their peak memory,
+since tracing slows everything down. The results are plain dicts so they
+can be saved as JSON and compared between runs with compare().
+"""
+import gc
+import time
+import tracemalloc
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+
+BENCHMARKS = {}
+
+# The percentiles reported for the latency of each benchmark
+PERCENTILES = [50, 90, 99]
+
+Subject = namedtuple('Subject', ['doctor', 'patient'])
+
+
+def benchmark(name):
+    """Registers the decorated function as the benchmark called name."""
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def client_for(user):
+    client = Client()
+    # Skip hashing the password, which would only slow the setup down
+    client.force_login(user)
+    return client
+
+
+def get(user, path):
+    """Makes an iteration that fetches path as user."""
+    client = client_for(user)
+
+    def iteration():
+        response = client.get(path)
+        if response.status_code != 200:
+            raise RuntimeError('GET {0} answered {1}'.format(path, response.status_code))
+    return iteration
+
+
+@benchmark('patient_dashboard')
+def patient_dashboard(subject):
+    return get(subject.patient.user, '/memocha/patient/')
+
+
+@benchmark('patient_details')
+def patient_details(subject):
+    return get(subject.doctor.user, '/memocha/doctor/{0}/'.format(subject.patient.pk))
+
+
+@benchmark('patient_calendar')
+def patient_calendar(subject):
+    return get(subject.doctor.user, '/memocha/doctor/{0}/calendar/'.format(subject.patient.pk))
+
+
+@benchmark('doctor_dashboard')
+def doctor_dashboard(subject):
+    return get(subject.doctor.user, '/memocha/doctor/')
+
+
+@benchmark('review_queue_items')
+def review_queue_items(subject):
+    return get(subject.doctor.user, '/memocha/doctor/queue/items/')
+
+
+@benchmark('record_video')
+def record_video(subject):
+    client = client_for(subject.patient.user)
+    medication = subject.patient.prescriptions.values_list('medication', flat=True).first()
+
+    def iteration():
+        # Roll the new video back so every iteration starts from the same data
+        with transaction.atomic():
+            response = client.post('/memocha/patient/record', {
+                'medication': medication,
+                'data': SimpleUploadedFile('benchmark.webm', b'benchmark video contents'),
+            })
+            transaction.set_rollback(True)
+        if response.status_code != 200:
+            raise RuntimeError('POST /memocha/patient/record answered {0}'.format(response.status_code))
+    return iteration
+
+
+@benchmark('Patient.next_medication')
+def next_medication(subject):
+    return subject.patient.next_medication
+
+
+@benchmark('Patient.recordable_medications')
+def recordable_medications(subject):
+    return subject.patient.recordable_medications
+
+
+@benchmark('Doctor.patient_summaries')
+def patient_summaries(subject):
+    return lambda: list(subject.doctor.patient_summaries(7))
+
+
+def percentile(values, percent):
+    """The nearest-rank percentile of the sorted list values."""
+    index = max(int(round(percent / 100.0 * len(values))) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def run(name, subject, iterations, warmup=1, cold=False):
+    """Runs the benchmark called name.
+
+    :param iterations: How many times to time it.
+    :param warmup: How many times to run it before timing it.
+    :param cold: Whether to clear the cache before every iteration.
+    :return: A dict of the latency percentiles and maximum in milliseconds,
+        the median and maximum query count, and the peak memory in bytes.
+    """
+    iteration = BENCHMARKS[name](subject)
+    for _ in range(warmup):
+        if cold:
+            cache.clear()
+        iteration()
+
+    latencies = []
+    queries = []
+    for _ in range(iterations):
+        if cold:
+            cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            iteration()
+            latencies.append((time.perf_counter() - start) * 1000)
+        queries.append(len(context))
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        if cold:
+            cache.clear()
+        iteration()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    latencies.sort()
+    queries.sort()
+    result = {'p{0}_ms'.format(percent): percentile(latencies, percent) for percent in PERCENTILES}
+    result.update({
+        'max_ms': latencies[-1],
+        'queries': percentile(queries, 50),
+        'max_queries': queries[-1],
+        'peak_memory': peak_memory,
+    })
+    return result
+
+
+def compare(baseline, results, threshold):
+    """Finds the regressions of results against a baseline.
+
+    :param baseline: The results of an earlier run, by benchmark name.
+    :param results: The results of this run, by benchmark name.
+    :param threshold: How much slower or bigger, as a fraction, a benchmark
+        may get before it counts as a regression. Any extra query counts.
+    :return: (benchmark name, measure, baseline value, new value) tuples.
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        before = baseline[name]
+        for measure in ['p{0}_ms'.format(percent) for percent in PERCENTILES] + ['peak_memory']:
+            if measure in before and result[measure] > before[measure] * (1 + threshold):
+                regressions.append((name, measure, before[measure], result[measure]))
+        for measure in ('queries', 'max_queries'):
+            if measure in before and result[measure] > before[measure]:
+                regressions.append((name, measure, before[measure], result[measure]))
+    return regressions
@@ -0,0 +1,59 @@
+"""
+Versioned cache keys.
+
+Cached data is stored under a key that includes a version number for the
+object it was computed from, e.g. a doctor or a patient. Bumping the
+version makes every key built from the old one unreachable, so all the
+data cached for an object can be invalidated at once without knowing
+which keys exist. With a shared cache a bump reaches every process, but
+with the local-memory cache it only reaches the process that made it, so
+the data cached there should not be kept for long (see is_shared).
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+# The cache backends that keep a separate cache in every process
+PER_PROCESS_BACKENDS = ['django.core.cache.backends.locmem.LocMemCache']
+
+
+def _version_key(namespace, pk):
+    return 'memocha:{0}:{1}:version'.format(namespace, pk)
+
+
+def _new_version():
+    # Versions start from the clock rather than from 1, so a version that
+    # was evicted from the cache can't come back and revive stale data
+    return int(time.time() * 1000)
+
+
+def get_version(namespace, pk):
+    """Gets the current version of the object pk in namespace."""
+    key = _version_key(namespace, pk)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump(namespace, pks):
+    """Invalidates everything cached for the objects pks in namespace."""
+    for pk in set(pks):
+        key = _version_key(namespace, pk)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_version(), None)
+
+
+def make_key(namespace, pk, name):
+    """Builds the cache key for name under the current version of pk."""
+    return 'memocha:{0}:{1}:{2}:{3}'.format(namespace, pk, get_version(namespace, pk), name)
+
+
+def is_shared():
+    """Whether the default cache is shared by all the processes."""
+    return settings.CACHES['default']['BACKEND'] not in PER_PROCESS_BACKENDS
@@ -0,0 +1,30 @@
+from functools import wraps
+
+from django.contrib.auth.decorators import login_required
+from django.http import Http404
+from django.shortcuts import redirect
+
+
+def role_required(role, redirect_to_login=True):
+    """Restricts a view to logged in users with the given role.
+
+    The role is resolved by memocha.middleware.RoleMiddleware, which also
+    sets request.patient or request.doctor for the view to use.
+
+    :param role: 'patient' or 'doctor'.
+    :param redirect_to_login: Whether anonymous users and users with
+        another role are sent to the login page, as for pages, or answered
+        with a 404, as for the endpoints the pages fetch data from.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.role != role:
+                if redirect_to_login:
+                    return redirect('/accounts/login?next={0}'.format(request.path))
+                raise Http404
+            return view(request, *args, **kwargs)
+        if redirect_to_login:
+            return login_required(wrapper)
+        return wrapper
+    return decorator
@@ -0,0 +1,91 @@
+"""
+Background work on uploaded videos.
+
+Each handler takes a Video and is run by the process_jobs command for the
+Job rows that Video.save creates, so none of this work happens on the
+request path. A handler signals failure by raising, in which case the job
+is retried later.
+"""
+import os
+import subprocess
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+
+from memocha.models import Video, touch_patients
+
+
+HANDLERS = {}
+
+# The height of the review renditions doctors watch when approving videos.
+# Smaller videos are left at their own size.
+# Units: pixels
+REVIEW_HEIGHT = 360
+
+
+def handler(kind):
+    """Registers the decorated function as the handler for jobs of kind."""
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+    return register
+
+
+@handler('probe')
+def probe(video):
+    """Records the length of the video."""
+    output = subprocess.check_output([
+        settings.FFPROBE_BINARY,
+        '-v', 'error',
+        '-show_entries', 'format=duration',
+        '-of', 'default=noprint_wrappers=1:nokey=1',
+        video.upload.path,
+    ], universal_newlines=True).strip()
+    # Recordings straight from MediaRecorder don't always
+    # have their duration written into the container
+    duration = float(output) if output and output != 'N/A' else None
+    Video.objects.filter(pk=video.pk).update(duration=duration)
+
+
+@handler('rendition')
+def rendition(video):
+    """Makes the small review copy of the video and its poster frame.
+
+    The review copy is H.264/AAC with the moov atom at the front of the
+    file, so the browser can start playing it before it has been fully
+    downloaded.
+    """
+    scale = 'scale=-2:min({0}\\,ih)'.format(REVIEW_HEIGHT)
+    name = os.path.splitext(os.path.basename(video.upload.name))[0]
+    with tempfile.TemporaryDirectory() as directory:
+        rendition_path = os.path.join(directory, 'review.mp4')
+        subprocess.check_call([
+            settings.FFMPEG_BINARY,
+            '-y', '-v', 'error',
+            '-i', video.upload.path,
+            '-vf', scale,
+            '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '28',
+            '-c:a', 'aac', '-b:a', '64k',
+            '-movflags', '+faststart',
+            rendition_path,
+        ])
+        poster_path = os.path.join(directory, 'poster.jpg')
+        subprocess.check_call([
+            settings.FFMPEG_BINARY,
+            '-y', '-v', 'error',
+            '-i', rendition_path,
+            '-vf', 'thumbnail',
+            '-frames:v', '1',
+            poster_path,
+        ])
+        with open(rendition_path, 'rb') as rendition_file, open(poster_path, 'rb') as poster_file:
+            video.rendition.save(name + '.mp4', File(rendition_file), save=False)
+            video.poster.save(name + '.jpg', File(poster_file), save=False)
+    # Update the row directly so the video isn't saved (and its jobs queued) again
+    Video.objects.filter(pk=video.pk).update(
+        rendition=video.rendition.name,
+        poster=video.poster.name,
+    )
+    # The video's URL changed
+    touch_patients([video.person_id])
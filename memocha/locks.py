@@ -0,0 +1,34 @@
+"""
+Postgres advisory locks, for the commands that must not run concurrently.
+
+The cron entries in .ebextensions run on every instance of the
+environment, so a command that rewrites shared rows takes a lock first
+and lets the other instances skip their run.
+"""
+import zlib
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+def lock_id(name):
+    """The 32 bit key of the advisory lock called name."""
+    return zlib.crc32(name.encode('utf-8'))
+
+
+@contextmanager
+def advisory_lock(name):
+    """Tries to take the session level advisory lock called name.
+
+    :return: A context manager giving whether the lock was taken. It is
+        released when the block exits.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s)', [lock_id(name)])
+        acquired = cursor.fetchone()[0]
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s)', [lock_id(name)])
@@ -0,0 +1,85 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from memocha.benchmark import BENCHMARKS, PERCENTILES, Subject, compare, run
+from memocha.models import Doctor
+
+
+class Command(BaseCommand):
+    help = ('Times the views and model methods listed in memocha.benchmark '
+            'against the data in the database, e.g. made by generate_load_data. '
+            'Reports the latency percentiles, query counts and peak memory of '
+            'each, and can save them as JSON and compare them with an earlier run.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--only', action='append', choices=sorted(BENCHMARKS),
+            help='Only run this benchmark. Can be given more than once.'
+        )
+        parser.add_argument(
+            '--doctor',
+            help='The username of the doctor to act as. Defaults to the doctor with the most patients.'
+        )
+        parser.add_argument('--iterations', type=int, default=50, help='How many times to time each benchmark.')
+        parser.add_argument('--warmup', type=int, default=3, help='How many untimed runs come first.')
+        parser.add_argument(
+            '--cold', action='store_true',
+            help='Clear the cache before every run, to time the uncached paths.'
+        )
+        parser.add_argument('--output', help='Save the results to this JSON file.')
+        parser.add_argument('--compare', help='Compare the results with the ones saved in this JSON file.')
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='How much slower or bigger a benchmark may get before it counts as a regression.'
+        )
+
+    def handle(self, *args, **options):
+        doctors = Doctor.objects.select_related('user')
+        if options['doctor']:
+            doctor = doctors.filter(user__username=options['doctor']).first()
+        else:
+            doctor = doctors.annotate(patients=Count('patient')).order_by('-patients').first()
+        if doctor is None:
+            raise CommandError('There is no doctor to act as, run generate_load_data first')
+        # The patient with the most videos makes the heaviest pages
+        patient = doctor.patient_set.select_related('user').annotate(
+            videos=Count('video')
+        ).order_by('-videos').first()
+        if patient is None:
+            raise CommandError('{0} has no patients'.format(doctor.user.username))
+        subject = Subject(doctor, patient)
+
+        results = {}
+        columns = ['p{0}_ms'.format(percent) for percent in PERCENTILES]
+        columns += ['max_ms', 'queries', 'max_queries', 'peak_memory']
+        self.stdout.write('{0:<34}'.format('benchmark') + ''.join('{0:>13}'.format(column) for column in columns))
+        for name in options['only'] or sorted(BENCHMARKS):
+            result = run(name, subject, options['iterations'], options['warmup'], options['cold'])
+            results[name] = result
+            self.stdout.write('{0:<34}'.format(name) + ''.join(
+                '{0:>13.2f}'.format(result[column]) if column.endswith('_ms') else '{0:>13}'.format(result[column])
+                for column in columns
+            ))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'doctor': doctor.user.username,
+                    'patient': patient.user.username,
+                    'iterations': options['iterations'],
+                    'cold': options['cold'],
+                    'results': results,
+                }, f, indent=2, sort_keys=True)
+            self.stdout.write('Saved the results to {0}.'.format(options['output']))
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)['results']
+            regressions = compare(baseline, results, options['threshold'])
+            for name, measure, before, after in regressions:
+                self.stdout.write('REGRESSION {0} {1}: {2:.2f} -> {3:.2f}'.format(name, measure, before, after))
+            if regressions:
+                raise CommandError('{0} regression(s) against {1}'.format(len(regressions), options['compare']))
+            self.stdout.write('No regressions against {0}.'.format(options['compare']))
@@ -0,0 +1,100 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+
+from memocha.models import Prescription, Video
+
+
+class Command(BaseCommand):
+    help = ('Deletes prescriptions no patient has any more and media files '
+            'no video refers to any more, a batch at a time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='How many prescriptions or files to look at at a time.'
+        )
+        parser.add_argument(
+            '--grace', type=int, default=3600,
+            help=('Seconds a file has to be unreferenced for before it is deleted. '
+                  'Files are stored before the video referring to them is saved.')
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report what would be deleted without deleting anything.'
+        )
+
+    def handle(self, *args, **options):
+        self.collect_prescriptions(options['batch_size'], options['dry_run'])
+        self.collect_files(options['batch_size'], options['grace'], options['dry_run'])
+
+    def collect_prescriptions(self, batch_size, dry_run):
+        orphans = Prescription.objects.filter(patient=None).order_by('pk').values_list('pk', flat=True)
+        deleted = 0
+        last_pk = 0
+        while True:
+            batch = list(orphans.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1]
+            if dry_run:
+                deleted += len(batch)
+            else:
+                with transaction.atomic():
+                    # A prescription may have been given to a patient since
+                    # the batch was read, so check again while deleting
+                    _, counts = Prescription.objects.filter(pk__in=batch, patient=None).delete()
+                deleted += counts.get(Prescription._meta.label, 0)
+            self.stdout.write('Deleted {0} orphaned prescription(s) so far...'.format(deleted))
+        self.stdout.write('Deleted {0} orphaned prescription(s).'.format(deleted))
+
+    def collect_files(self, batch_size, grace, dry_run):
+        fields = [field for field in Video._meta.get_fields() if isinstance(field, models.FileField)]
+        cutoff = time.time() - grace
+        deleted = 0
+        for field in fields:
+            batch = []
+            for name in self.stored_files(field):
+                batch.append(name)
+                if len(batch) == batch_size:
+                    deleted += self.collect_batch(field.storage, fields, batch, cutoff, dry_run)
+                    batch = []
+                    self.stdout.write('Deleted {0} unreferenced file(s) so far...'.format(deleted))
+            deleted += self.collect_batch(field.storage, fields, batch, cutoff, dry_run)
+        self.stdout.write('Deleted {0} unreferenced file(s).'.format(deleted))
+
+    def stored_files(self, field):
+        """Yields the names of the files stored under field's upload_to."""
+        root = field.storage.path(field.upload_to)
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                yield os.path.relpath(path, field.storage.location).replace(os.sep, '/')
+
+    def collect_batch(self, storage, fields, names, cutoff, dry_run):
+        if not names:
+            return 0
+        query = models.Q()
+        for field in fields:
+            query |= models.Q(**{field.name + '__in': names})
+        referenced = set()
+        for row in Video.objects.filter(query).values_list(*[field.name for field in fields]):
+            referenced.update(row)
+
+        deleted = 0
+        for name in names:
+            if name in referenced:
+                continue
+            try:
+                # Storing identical contents again touches the file, so a
+                # recent time means a new video may be about to refer to it
+                if os.path.getmtime(storage.path(name)) > cutoff:
+                    continue
+                if not dry_run:
+                    storage.delete(name)
+            except OSError:
+                continue
+            deleted += 1
+        return deleted
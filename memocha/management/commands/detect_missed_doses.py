@@ -0,0 +1,53 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from memocha.locks import advisory_lock
+from memocha.models import MissedDose
+
+
+class Command(BaseCommand):
+    help = ('Records the prescribed doses whose window has closed without a '
+            'video, for the doctor views. Run it regularly with the default '
+            'range to pick up the windows that closed since the last run.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            help='The first day to check, as YYYY-MM-DD or "today". Defaults to yesterday.'
+        )
+        parser.add_argument(
+            '--until',
+            help='The last day to check, as YYYY-MM-DD or "today". Defaults to today.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='How many patients to check at a time.'
+        )
+
+    def parse_day(self, value, default, option):
+        if value is None:
+            return default
+        if value == 'today':
+            return timezone.localtime().date()
+        day = parse_date(value)
+        if day is None:
+            raise CommandError('{0} must be a date formatted as YYYY-MM-DD'.format(option))
+        return day
+
+    def handle(self, *args, **options):
+        today = timezone.localtime().date()
+        since = self.parse_day(options['since'], today - timedelta(days=1), '--since')
+        until = self.parse_day(options['until'], today, '--until')
+        if since > until:
+            raise CommandError('--since must not be after --until')
+        # The cron entry runs on every instance, and concurrent runs would
+        # rewrite the same rows
+        with advisory_lock('memocha.detect_missed_doses') as acquired:
+            if not acquired:
+                self.stdout.write('Another detection is running, skipping this one.')
+                return
+            found = MissedDose.detect(since, until, batch_size=options['batch_size'])
+        self.stdout.write('Found {0} missed dose(s) from {1} to {2}.'.format(found, since, until))
@@ -0,0 +1,65 @@
+import select
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from memocha.reminders import SCHEDULE_CHANNEL, ScheduleWheel, get_backend
+
+
+class Command(BaseCommand):
+    help = ('Sends a reminder through REMINDER_BACKEND as each prescribed '
+            'dose\'s window opens. Runs until interrupted, see memocha.reminders.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reload-interval', type=float, default=3600,
+            help='Seconds between reloads of every patient\'s doses, which catch changes made without signals.'
+        )
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        # Listen before loading, so no change made while loading is missed.
+        # Django's connections are in autocommit mode, so the notifications
+        # arrive as soon as their transactions commit.
+        with connection.cursor() as cursor:
+            cursor.execute('LISTEN {0}'.format(SCHEDULE_CHANNEL))
+        listener = connection.connection
+        wheel = ScheduleWheel()
+        wheel.load()
+        loaded = time.monotonic()
+        self.stdout.write('Loaded {0} dose(s).'.format(len(wheel)))
+        wheel.advance(timezone.now())
+
+        try:
+            while True:
+                # Wake up at the start of the next minute, or on a notification.
+                # Don't wait if notifications arrived during the last reload.
+                timeout = 0 if listener.notifies else 60 - time.time() % 60
+                readable, _, _ = select.select([listener], [], [], timeout)
+                changed = set()
+                reload_all = time.monotonic() - loaded >= options['reload_interval']
+                if readable:
+                    listener.poll()
+                # Notifications also arrive while the wheel's own queries
+                # run, so they can be waiting without the socket being readable
+                while listener.notifies:
+                    payload = listener.notifies.pop(0).payload
+                    if payload:
+                        changed.update(int(pk) for pk in payload.split(','))
+                    else:
+                        reload_all = True
+                if reload_all:
+                    wheel.load()
+                    loaded = time.monotonic()
+                elif changed:
+                    wheel.load(changed)
+
+                for day, doses in wheel.advance(timezone.now()):
+                    backend.send(day, doses)
+                    self.stdout.write('Sent {0} reminder(s) for {1}.'.format(len(doses), day))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connection.close()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from memocha.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = 'Deletes chunked upload sessions that have been abandoned.'
+
+    def handle(self, *args, **options):
+        count = 0
+        for session in UploadSession.expired().iterator():
+            session.discard()
+            count += 1
+        self.stdout.write('Expired {0} upload session(s).'.format(count))
@@ -0,0 +1,190 @@
+import random
+from datetime import datetime, time, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.core.files.base import ContentFile
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+import memocha.cache
+from memocha.models import (
+    Adherence, Doctor, Job, MissedDose, Patient, Prescription, UploadSession, Video, role_cache_key
+)
+from memocha.reminders import notify_schedules_changed
+
+
+class Command(BaseCommand):
+    help = ('Fills the database with synthetic doctors, patients, prescriptions '
+            'and videos to benchmark against. All the generated users share a '
+            'password and their usernames start with --prefix, which --clear '
+            'uses to delete them again.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctors', type=int, default=10, help='How many doctors to make.')
+        parser.add_argument('--patients', type=int, default=100, help='How many patients each doctor has.')
+        parser.add_argument('--prescriptions', type=int, default=2, help='How many prescriptions each patient has.')
+        parser.add_argument('--days', type=int, default=365, help='How many days of videos each patient has.')
+        parser.add_argument(
+            '--adherence', type=float, default=0.8,
+            help='The share of the prescribed doses that have a video.'
+        )
+        parser.add_argument(
+            '--pending-days', type=int, default=3,
+            help='How many of the most recent days of videos are left unreviewed.'
+        )
+        parser.add_argument('--prefix', default='load', help='What the generated usernames start with.')
+        parser.add_argument('--password', default='loadpassword', help='The password of the generated users.')
+        parser.add_argument('--seed', type=int, default=0, help='The seed of the random choices.')
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Delete the users generated with --prefix before making new ones.'
+        )
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        prefix = options['prefix']
+        if options['clear']:
+            deleted = self.clear(prefix)
+            self.stdout.write('Deleted {0} row(s) from the last run.'.format(deleted))
+
+        doctor_group, _ = Group.objects.get_or_create(name='Doctors')
+        patient_group, _ = Group.objects.get_or_create(name='Patients')
+        password = make_password(options['password'])
+        joined = timezone.now() - timedelta(days=options['days'])
+        # Every video refers to the same file, which the content addressed
+        # storage keeps a single copy of
+        upload_field = Video._meta.get_field('upload')
+        upload = upload_field.storage.save(
+            upload_field.upload_to + 'load.webm', ContentFile(b'synthetic video contents')
+        )
+
+        for number in range(options['doctors']):
+            with transaction.atomic():
+                user = User.objects.create(
+                    username='{0}_doctor_{1}'.format(prefix, number),
+                    first_name='Doctor',
+                    last_name=str(number),
+                    password=password,
+                    date_joined=joined,
+                )
+                user.groups.add(doctor_group)
+                doctor = Doctor.objects.create(user=user)
+                patients, prescriptions = self.make_patients(doctor, number, patient_group, password, joined, options)
+                videos = self.make_videos(patients, prescriptions, upload, options)
+            Adherence.rebuild(Patient.objects.filter(doctor=doctor))
+            memocha.cache.bump('patient', [patient.pk for patient in patients])
+            self.stdout.write('Made doctor {0} of {1} with {2} patient(s) and {3} video(s).'.format(
+                number + 1, options['doctors'], len(patients), videos
+            ))
+
+    def clear(self, prefix):
+        """Deletes the users generated with prefix along with their data.
+
+        The patients' rows are deleted with plain DELETE statements, since
+        cascading from the users would load every video and send its signals.
+
+        :return: The number of rows deleted.
+        """
+        users = list(User.objects.filter(username__startswith=prefix + '_').values_list('pk', flat=True))
+        patients = list(Patient.objects.filter(user__in=users).values_list('pk', flat=True))
+        links = Patient.prescriptions.through
+        prescriptions = list(links.objects.filter(patient__in=patients).values_list('prescription_id', flat=True))
+        statements = [
+            (Job, 'video_id IN (SELECT id FROM {0} WHERE person_id = ANY(%s))'.format(Video._meta.db_table), patients),
+            (Video, 'person_id = ANY(%s)', patients),
+            (Adherence, 'patient_id = ANY(%s)', patients),
+            (MissedDose, 'patient_id = ANY(%s)', patients),
+            (UploadSession, 'person_id = ANY(%s)', patients),
+            (links, 'patient_id = ANY(%s)', patients),
+            # Only the prescriptions no other patient has been given since
+            (Prescription, 'id = ANY(%s) AND NOT EXISTS (SELECT 1 FROM {0} WHERE prescription_id = {1}.id)'.format(
+                links._meta.db_table, Prescription._meta.db_table
+            ), prescriptions),
+            (Patient, 'id = ANY(%s)', patients),
+        ]
+        deleted = 0
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for model, condition, pks in statements:
+                    cursor.execute('DELETE FROM {0} WHERE {1}'.format(model._meta.db_table, condition), [pks])
+                    deleted += cursor.rowcount
+            # Only the doctors and the users' groups are left to cascade to
+            deleted += User.objects.filter(pk__in=users).delete()[0]
+            notify_schedules_changed(patients)
+        cache.delete_many([role_cache_key(pk) for pk in users])
+        return deleted
+
+    def make_patients(self, doctor, doctor_number, group, password, joined, options):
+        users = User.objects.bulk_create([
+            User(
+                username='{0}_patient_{1}_{2}'.format(options['prefix'], doctor_number, number),
+                first_name='Patient',
+                last_name='{0}-{1}'.format(doctor_number, number),
+                password=password,
+                date_joined=joined,
+            )
+            for number in range(options['patients'])
+        ])
+        User.groups.through.objects.bulk_create([
+            User.groups.through(user_id=user.pk, group_id=group.pk) for user in users
+        ])
+        patients = Patient.objects.bulk_create([
+            Patient(
+                user=user,
+                doctor=doctor,
+                date_of_birth=joined.date() - timedelta(days=self.random.randint(20 * 365, 90 * 365)),
+            )
+            for user in users
+        ])
+
+        owners = []
+        prescriptions = []
+        for patient in patients:
+            for number in range(options['prescriptions']):
+                hours = sorted(self.random.sample(range(6, 23), self.random.randint(1, 3)))
+                owners.append(patient)
+                prescriptions.append(Prescription(
+                    medication='medication {0}'.format(number),
+                    dosage=str(self.random.randint(1, 4)),
+                    dosage_times=[time(hour=hour) for hour in hours],
+                ))
+        prescriptions = Prescription.objects.bulk_create(prescriptions)
+        Patient.prescriptions.through.objects.bulk_create([
+            Patient.prescriptions.through(patient_id=patient.pk, prescription_id=prescription.pk)
+            for patient, prescription in zip(owners, prescriptions)
+        ])
+        prescriptions_of = {}
+        for patient, prescription in zip(owners, prescriptions):
+            prescriptions_of.setdefault(patient.pk, []).append(prescription)
+        return patients, prescriptions_of
+
+    def make_videos(self, patients, prescriptions, upload, options):
+        """Makes the patients' videos, bypassing Video.save and its jobs."""
+        today = timezone.localtime().date()
+        pending_since = today - timedelta(days=options['pending_days'])
+        videos = []
+        for patient in patients:
+            for days_ago in range(options['days'], 0, -1):
+                day = today - timedelta(days=days_ago)
+                for prescription in prescriptions.get(patient.pk, []):
+                    for dosage_time in prescription.dosage_times:
+                        if self.random.random() >= options['adherence']:
+                            continue
+                        # Recorded somewhere in the window around the dose
+                        record_date = timezone.make_aware(datetime.combine(day, dosage_time)) + timedelta(
+                            minutes=self.random.randint(-25, 25)
+                        )
+                        videos.append(Video(
+                            person=patient,
+                            record_date=record_date,
+                            prescription=prescription,
+                            upload=upload,
+                            approved=None if day > pending_since else self.random.random() < 0.95,
+                            dosage_date=day,
+                            dosage_time=dosage_time,
+                        ))
+        Video.objects.bulk_create(videos, batch_size=2000)
+        return len(videos)
@@ -0,0 +1,218 @@
+import csv
+import json
+import multiprocessing
+import os
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.utils import timezone
+
+from memocha.forms import PatientCreationForm, PrescriptionForm
+from memocha.models import Adherence, Doctor, Patient, Prescription, invalidate_dashboards, patient_username
+
+
+class Command(BaseCommand):
+    help = ('Creates patient accounts from a CSV or NDJSON file, as if their '
+            'doctor had added each of them with the add patient form.\n\n'
+            'CSV files have a header row with first_name, last_name, email, '
+            'date_of_birth, secure_code, medication, dosage and dosage_times '
+            '(comma separated) columns, and an optional doctor column. A patient '
+            'with several prescriptions has a row for each of them. NDJSON files '
+            'have one object per patient with the same keys, except that the '
+            'prescriptions are a list of objects under "prescriptions".')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='The file to import.')
+        parser.add_argument(
+            '--format', choices=['csv', 'ndjson'],
+            help='The format of the file. Defaults to the one its extension implies.'
+        )
+        parser.add_argument(
+            '--doctor',
+            help='The username of the doctor of patients that have no doctor column.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='How many patients to write in each transaction.'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='How many processes to hash the secure codes with.'
+        )
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if file_format == 'jsonl':
+            file_format = 'ndjson'
+        if file_format not in ('csv', 'ndjson'):
+            raise CommandError('Could not tell the format of {0}, use --format'.format(options['path']))
+
+        self.group = Group.objects.get(name='Patients')
+        self.doctors = {}
+        self.default_doctor = None
+        if options['doctor']:
+            self.default_doctor = self.get_doctor(options['doctor'])
+            if self.default_doctor is None:
+                raise CommandError('There is no doctor called {0}'.format(options['doctor']))
+
+        # The forked workers would otherwise share this process'
+        # database connection
+        connections.close_all()
+        pool = multiprocessing.Pool(options['workers']) if options['workers'] > 1 else None
+        imported = skipped = 0
+        try:
+            with open(options['path'], newline='') as f:
+                records = self.read_csv(f) if file_format == 'csv' else self.read_ndjson(f)
+                while True:
+                    batch = list(islice(records, options['batch_size']))
+                    if not batch:
+                        break
+                    written, rejected = self.import_batch(batch, pool)
+                    imported += written
+                    skipped += rejected
+                    self.stdout.write('Imported {0} patient(s) so far...'.format(imported))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self.stdout.write('Imported {0} patient(s), skipped {1}.'.format(imported, skipped))
+
+    def read_csv(self, f):
+        """Yields (line, record) pairs, merging the rows of each patient."""
+        record = None
+        reader = csv.DictReader(f)
+        for row in reader:
+            line = reader.line_num
+            # Values past the header's columns
+            row.pop(None, None)
+            prescription = {key: row.pop(key, '') for key in ('medication', 'dosage', 'dosage_times')}
+            key = (row.get('first_name'), row.get('last_name'), row.get('date_of_birth'))
+            if record is None or key != record_key:
+                if record is not None:
+                    yield record_line, record
+                record, record_key, record_line = dict(row, prescriptions=[]), key, line
+            if any(prescription.values()):
+                record['prescriptions'].append(prescription)
+        if record is not None:
+            yield record_line, record
+
+    def read_ndjson(self, f):
+        """Yields (line, record) pairs."""
+        for line, text in enumerate(f, 1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError:
+                record = None
+            yield line, record
+
+    def get_doctor(self, username):
+        if username not in self.doctors:
+            self.doctors[username] = Doctor.objects.filter(user__username=username).first()
+        return self.doctors[username]
+
+    def clean(self, line, record):
+        """Validates a record with the forms the add_patient view uses.
+
+        :return: A (patient data, list of prescription data, doctor) tuple,
+            or None if the record is invalid.
+        """
+        if not isinstance(record, dict):
+            return self.reject(line, 'not a JSON object')
+        doctor = self.get_doctor(record['doctor']) if record.get('doctor') else self.default_doctor
+        if doctor is None:
+            return self.reject(line, 'unknown doctor {0}'.format(record.get('doctor')))
+        form = PatientCreationForm(record)
+        if not form.is_valid():
+            return self.reject(line, form.errors.as_text())
+        prescriptions = []
+        for prescription in record.get('prescriptions') or []:
+            times = prescription.get('dosage_times')
+            if isinstance(times, list):
+                prescription = dict(prescription, dosage_times=','.join(times))
+            prescription_form = PrescriptionForm(prescription)
+            if not prescription_form.is_valid():
+                return self.reject(line, prescription_form.errors.as_text())
+            prescriptions.append(prescription_form.cleaned_data)
+        return form.cleaned_data, prescriptions, doctor
+
+    def reject(self, line, reason):
+        self.stderr.write('Skipping the patient on line {0}: {1}'.format(line, reason))
+        return None
+
+    def import_batch(self, records, pool):
+        """Writes a batch of patients and their prescriptions.
+
+        :param records: (line, record) pairs.
+        :param pool: The pool to hash the secure codes with, or None to hash
+            them in this process.
+        :return: How many patients were written and how many were skipped.
+        """
+        cleaned = []
+        for line, record in records:
+            result = self.clean(line, record)
+            if result is not None:
+                cleaned.append((line, result))
+
+        # Patients that already have an account, e.g. from an earlier run
+        # of the same file, are left alone
+        usernames = [
+            patient_username(data['first_name'], data['last_name'], data['date_of_birth'])
+            for _, (data, _, _) in cleaned
+        ]
+        existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        accepted = []
+        for username, (line, result) in zip(usernames, cleaned):
+            if username in existing:
+                self.reject(line, 'an account called {0} already exists'.format(username))
+                continue
+            # The same patient may be in the file more than once
+            existing.add(username)
+            accepted.append((username, result))
+
+        codes = [data['secure_code'] for _, (data, _, _) in accepted]
+        passwords = pool.map(make_password, codes, chunksize=16) if pool is not None else map(make_password, codes)
+
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(
+                    username=username,
+                    password=password,
+                    first_name=data['first_name'],
+                    last_name=data['last_name'],
+                    email=data['email'],
+                )
+                for (username, (data, _, _)), password in zip(accepted, passwords)
+            ])
+            User.groups.through.objects.bulk_create([
+                User.groups.through(user_id=user.pk, group_id=self.group.pk) for user in users
+            ])
+            patients = Patient.objects.bulk_create([
+                Patient(user=user, doctor=doctor, date_of_birth=data['date_of_birth'])
+                for user, (_, (data, _, doctor)) in zip(users, accepted)
+            ])
+            owners = []
+            prescriptions = []
+            for patient, (_, (_, patient_prescriptions, _)) in zip(patients, accepted):
+                for data in patient_prescriptions:
+                    owners.append(patient)
+                    prescriptions.append(Prescription(**data))
+            prescriptions = Prescription.objects.bulk_create(prescriptions)
+            Patient.prescriptions.through.objects.bulk_create([
+                Patient.prescriptions.through(patient_id=patient.pk, prescription_id=prescription.pk)
+                for patient, prescription in zip(owners, prescriptions)
+            ])
+
+        # Bulk inserts skip the signal handlers that would otherwise start
+        # the patients' adherence counts and update their doctors' dashboards
+        if patients:
+            Adherence.rebuild(
+                Patient.objects.filter(pk__in=[patient.pk for patient in patients]),
+                since=timezone.localtime().date()
+            )
+            invalidate_dashboards(patient.doctor_id for patient in patients)
+        return len(patients), len(records) - len(patients)
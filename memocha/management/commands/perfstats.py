@@ -0,0 +1,78 @@
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+import memocha.perf
+
+
+class Command(BaseCommand):
+    help = ('Reports the per-view statistics PerfStatsMiddleware has written '
+            'to PERF_STATS_DIR: the request count, latency percentiles, '
+            'queries, SQL and render time of each view, and the queries it '
+            'repeated within a request.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='Read the statistics from here instead of PERF_STATS_DIR.')
+        parser.add_argument(
+            '--hours', type=float,
+            help='Only report the statistics of the last HOURS hours, rounded out to whole windows.'
+        )
+        parser.add_argument(
+            '--sort', default='total', choices=['total', 'requests', 'queries', 'sql'],
+            help='What to order the views by, highest first.'
+        )
+        parser.add_argument('--json', action='store_true', help='Print the merged statistics as JSON.')
+        parser.add_argument('--reset', action='store_true', help='Delete the statistics after reporting them.')
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or settings.PERF_STATS_DIR
+        if not directory:
+            raise CommandError('Set PERF_STATS_DIR or pass --dir')
+        since = time.time() - options['hours'] * 3600 if options['hours'] else None
+        views = memocha.perf.load(directory, since)
+
+        if options['json']:
+            self.stdout.write(json.dumps(views, indent=2, sort_keys=True))
+        elif not views:
+            self.stdout.write('No statistics in {0}.'.format(directory))
+        else:
+            self.report(views, options['sort'])
+
+        if options['reset'] and os.path.isdir(directory):
+            for filename in os.listdir(directory):
+                if filename.startswith('perf-') and filename.endswith('.json'):
+                    os.remove(os.path.join(directory, filename))
+
+    def report(self, views, sort):
+        key = {
+            'total': lambda stats: stats['total_ms'],
+            'requests': lambda stats: stats['requests'],
+            'queries': lambda stats: stats['queries'] / stats['requests'],
+            'sql': lambda stats: stats['sql_ms'],
+        }[sort]
+        columns = ['requests', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms', 'queries', 'max_queries', 'sql_ms', 'render_ms']
+        self.stdout.write('{0:<34}'.format('view') + ''.join('{0:>12}'.format(column) for column in columns))
+        for view, stats in sorted(views.items(), key=lambda item: key(item[1]), reverse=True):
+            requests = stats['requests']
+            # The percentiles are the upper bounds of their histogram buckets
+            percentiles = [memocha.perf.percentile(stats['histogram'], percent) for percent in (50, 90, 99)]
+            values = [
+                '{0:>12}'.format(requests),
+            ] + [
+                '{0:>12}'.format('<={0}'.format(bound) if bound is not None else '>{0}'.format(
+                    memocha.perf.LATENCY_BUCKETS[-1]
+                ))
+                for bound in percentiles
+            ] + [
+                '{0:>12.1f}'.format(stats['max_ms']),
+                '{0:>12.1f}'.format(stats['queries'] / requests),
+                '{0:>12}'.format(stats['max_queries']),
+                '{0:>12.1f}'.format(stats['sql_ms'] / requests),
+                '{0:>12.1f}'.format(stats['render_ms'] / requests),
+            ]
+            self.stdout.write('{0:<34}'.format(view) + ''.join(values))
+            for sql, count in sorted(stats['repeated'].items(), key=lambda item: item[1], reverse=True)[:5]:
+                self.stdout.write('    {0}x {1}'.format(count, sql[:200]))
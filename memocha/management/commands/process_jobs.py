@@ -0,0 +1,74 @@
+import multiprocessing
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from memocha.models import Job, JOB_VISIBILITY_TIMEOUT
+
+
+class Command(BaseCommand):
+    help = 'Runs the background jobs for uploaded videos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='How many worker processes to run.'
+        )
+        parser.add_argument(
+            '--batch', type=int, default=1,
+            help='How many jobs a worker claims at a time.'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=5,
+            help='Seconds to wait before looking again when there are no jobs.'
+        )
+        parser.add_argument(
+            '--visibility-timeout', type=int, default=JOB_VISIBILITY_TIMEOUT,
+            help='Seconds a worker has to finish a job before it is handed to another worker.'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once there are no jobs left instead of waiting for more.'
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] <= 1:
+            self.work(options)
+            return
+
+        # The workers need their own database connections
+        connections.close_all()
+        workers = [
+            multiprocessing.Process(target=self.work, args=(options,))
+            for _ in range(options['workers'])
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
+                worker.join()
+
+    def work(self, options):
+        try:
+            while True:
+                jobs = Job.claim(options['batch'], options['visibility_timeout'])
+                if not jobs:
+                    if options['once']:
+                        return
+                    time.sleep(options['poll_interval'])
+                    continue
+                for job in jobs:
+                    succeeded = job.run()
+                    self.stdout.write('[{0}] {1}: {2}'.format(
+                        os.getpid(), job, 'ok' if succeeded else job.last_error.strip().splitlines()[-1]
+                    ))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connections.close_all()
@@ -0,0 +1,82 @@
+import os
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+import memocha.profiling
+
+
+class Command(BaseCommand):
+    help = ('Lists the request profiles ProfilingMiddleware has saved to '
+            'PROFILE_DIR and sums up the time spent in each function across '
+            'them, to find the hot functions.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='Read the profiles from here instead of PROFILE_DIR.')
+        parser.add_argument('--view', help='Only include the profiles of this view, e.g. memocha:patient_details.')
+        parser.add_argument('--kind', choices=['sampled', 'cprofile'], help='Only include this kind of profile.')
+        parser.add_argument('--hours', type=float, help='Only include the profiles of the last HOURS hours.')
+        parser.add_argument(
+            '--sort', default='self', choices=['self', 'inclusive'],
+            help='Rank the functions by the time spent in them alone, or including what they call.'
+        )
+        parser.add_argument('--top', type=int, default=20, help='How many functions to show.')
+        parser.add_argument('--list', action='store_true', help='Also list the matching profiles.')
+        parser.add_argument('--delete', action='store_true', help='Delete the matching profiles afterwards.')
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or settings.PROFILE_DIR
+        if not directory:
+            raise CommandError('Set PROFILE_DIR or pass --dir')
+        since = time.time() - options['hours'] * 3600 if options['hours'] else None
+        profiles = [
+            profile for profile in memocha.profiling.load(directory, since)
+            if (options['view'] is None or profile['view'] == options['view'])
+            and (options['kind'] is None or profile['kind'] == options['kind'])
+        ]
+        if not profiles:
+            self.stdout.write('No matching profiles in {0}.'.format(directory))
+            return
+
+        if options['list']:
+            for profile in profiles:
+                self.stdout.write('{0} {1:<8} {2:>9.1f}ms {3} {4:<7} {5} {6} {7}'.format(
+                    datetime.fromtimestamp(profile['time']).strftime('%Y-%m-%d %H:%M:%S'),
+                    profile['kind'],
+                    profile['total_ms'],
+                    profile['status'],
+                    profile['role'] or '-',
+                    profile['method'],
+                    profile['url'],
+                    profile['file'],
+                ))
+            self.stdout.write('')
+
+        # Sum the functions over the profiles, counting how many each shows up in
+        functions = {}
+        for profile in profiles:
+            for label, times in profile['functions'].items():
+                total = functions.setdefault(label, {'self': 0.0, 'inclusive': 0.0, 'profiles': 0})
+                total['self'] += times['self']
+                total['inclusive'] += times['inclusive']
+                total['profiles'] += 1
+        request_time = sum(profile['total_ms'] for profile in profiles) / 1000
+
+        self.stdout.write('{0} profile(s) of {1:.2f}s of requests.'.format(len(profiles), request_time))
+        self.stdout.write('{0:>10}{1:>8}{2:>12}{3:>10}  function'.format('self_s', 'self%', 'inclusive_s', 'profiles'))
+        ranked = sorted(functions.items(), key=lambda item: item[1][options['sort']], reverse=True)
+        for label, total in ranked[:options['top']]:
+            self.stdout.write('{0:>10.3f}{1:>7.1f}%{2:>12.3f}{3:>10}  {4}'.format(
+                total['self'],
+                100 * total['self'] / request_time if request_time else 0,
+                total['inclusive'],
+                total['profiles'],
+                label,
+            ))
+
+        if options['delete']:
+            for profile in profiles:
+                os.remove(os.path.join(directory, profile['file']))
+            self.stdout.write('Deleted {0} profile(s).'.format(len(profiles)))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from memocha.locks import advisory_lock
+from memocha.models import Adherence, Patient
+
+
+class Command(BaseCommand):
+    help = ('Recomputes the daily adherence counts from the recorded videos. '
+            'Running it daily with --since today also adds the rows for days '
+            'on which nothing has been recorded yet.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            help='The first day to rebuild, as YYYY-MM-DD or "today". Defaults to all history.'
+        )
+        parser.add_argument(
+            '--patient', type=int, action='append', dest='patients',
+            help='Only rebuild this patient. Can be given more than once.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='How many patients to rebuild at a time.'
+        )
+
+    def handle(self, *args, **options):
+        since = options['since']
+        if since == 'today':
+            since = timezone.localtime().date()
+        elif since is not None:
+            since = parse_date(since)
+            if since is None:
+                raise CommandError('--since must be a date formatted as YYYY-MM-DD')
+
+        patients = Patient.objects.all()
+        if options['patients']:
+            patients = patients.filter(pk__in=options['patients'])
+        # The cron entry runs on every instance, and concurrent rebuilds of
+        # the same rows would conflict
+        with advisory_lock('memocha.rebuild_adherence') as acquired:
+            if not acquired:
+                self.stdout.write('Another rebuild is running, skipping this one.')
+                return
+            written = Adherence.rebuild(patients, since=since, batch_size=options['batch_size'])
+        self.stdout.write('Wrote {0} adherence row(s).'.format(written))
@@ -0,0 +1,139 @@
+"""
+Serving of uploaded media files.
+
+Files are served with byte range support so the video players can seek
+without downloading the whole recording, and with ETag/Last-Modified
+validators so unchanged files are answered with a 304. When
+MEDIA_SENDFILE_HEADER is set, the transfer itself is handed off to the
+web server in front of Django (X-Sendfile for Apache's mod_xsendfile,
+X-Accel-Redirect for nginx).
+"""
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# How much of a file is read into memory at a time while streaming it
+BLOCK_SIZE = 64 * 1024
+
+
+def parse_range(header, size):
+    """Parses a Range header for a file of the given size.
+
+    Only a single byte range is supported. Anything else is ignored and
+    the whole file is served, as RFC 7233 allows.
+
+    :return: The (start, end) of the range, inclusive, None if the whole
+        file should be served, or False if the range can't be satisfied.
+    """
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # A suffix range, i.e. the last N bytes
+        length = int(end)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = int(end) if end else size - 1
+    if start > end or start >= size:
+        return False
+    return start, min(end, size - 1)
+
+
+def file_iterator(path, start, length):
+    """Yields length bytes of the file at path, starting at start."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(BLOCK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def serve(request, name):
+    """Serves the media file called name, which is relative to MEDIA_ROOT.
+
+    The caller is responsible for checking that the user may see the file.
+    """
+    try:
+        path = safe_join(settings.MEDIA_ROOT, name)
+        stat = os.stat(path)
+    except (OSError, ValueError):
+        raise Http404
+    size = stat.st_size
+    etag = quote_etag('{0:x}-{1:x}'.format(size, int(stat.st_mtime * 1000000)))
+    last_modified = int(stat.st_mtime)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Accept-Ranges': 'bytes',
+    }
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    content_type, encoding = mimetypes.guess_type(path)
+    content_type = content_type or 'application/octet-stream'
+
+    sendfile_header = getattr(settings, 'MEDIA_SENDFILE_HEADER', None)
+    if sendfile_header:
+        # The web server handles ranges itself when it sends the file
+        response = HttpResponse(content_type=content_type)
+        if sendfile_header == 'X-Accel-Redirect':
+            response[sendfile_header] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + name
+        else:
+            response[sendfile_header] = path
+    else:
+        byte_range = None
+        if 'HTTP_RANGE' in request.META and _if_range_passes(request, etag, last_modified):
+            byte_range = parse_range(request.META['HTTP_RANGE'], size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{0}'.format(size)
+            return response
+        if byte_range is None:
+            start, end = 0, size - 1
+            response = StreamingHttpResponse(content_type=content_type)
+        else:
+            start, end = byte_range
+            response = StreamingHttpResponse(content_type=content_type, status=206)
+            response['Content-Range'] = 'bytes {0}-{1}/{2}'.format(start, end, size)
+        length = end - start + 1
+        if request.method != 'HEAD':
+            response.streaming_content = file_iterator(path, start, length)
+        response['Content-Length'] = str(length)
+
+    if encoding:
+        response['Content-Encoding'] = encoding
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def _if_range_passes(request, etag, last_modified):
+    """Checks that the range is still wanted when the file has changed."""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        # Weak validators are not allowed for If-Range
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
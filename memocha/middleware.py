@@ -0,0 +1,208 @@
+import cProfile
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connections
+
+import memocha.perf
+import memocha.profiling
+from memocha.models import ROLE_CACHE_TIMEOUT, Doctor, Patient, role_cache_key
+
+
+perf_logger = logging.getLogger('memocha.perf')
+
+
+def get_role(user):
+    """Resolves whether user is a patient or a doctor, and their profile.
+
+    The groups and the profile are fetched in a single query and cached
+    per user for ROLE_CACHE_TIMEOUT. The signal handlers in memocha.signals
+    invalidate the cache when the user's groups or profile change.
+
+    :return: A tuple of the role, 'patient' or 'doctor', and the user's
+        Patient or Doctor. Both are None for users without a profile
+        matching their groups, e.g. admins.
+    """
+    key = role_cache_key(user.pk)
+    resolved = cache.get(key)
+    if resolved is None:
+        rows = User.objects.filter(pk=user.pk).values_list(
+            'groups__name', 'patient__id', 'patient__doctor_id', 'patient__date_of_birth', 'doctor__id'
+        )
+        groups = set()
+        profile = None
+        for group, patient_id, doctor_id, date_of_birth, own_doctor_id in rows:
+            groups.add(group)
+            if patient_id is not None:
+                profile = ('patient', patient_id, doctor_id, date_of_birth)
+            elif own_doctor_id is not None:
+                profile = ('doctor', own_doctor_id)
+        if 'Patients' in groups:
+            role = 'patient'
+        elif 'Doctors' in groups:
+            role = 'doctor'
+        else:
+            role = None
+        # A role is only of use along with its profile
+        if profile is None or profile[0] != role:
+            role, profile = None, None
+        resolved = (role, profile)
+        cache.set(key, resolved, ROLE_CACHE_TIMEOUT)
+
+    role, profile = resolved
+    if role is None:
+        return None, None
+    if role == 'patient':
+        instance = Patient.from_db(
+            Patient.objects.db, ['id', 'user_id', 'doctor_id', 'date_of_birth'], [profile[1], user.pk] + list(profile[2:])
+        )
+    else:
+        instance = Doctor.from_db(Doctor.objects.db, ['id', 'user_id'], [profile[1], user.pk])
+    # Save the views fetching the user again
+    instance.user = user
+    return role, instance
+
+
+class RoleMiddleware(object):
+    """Sets request.role to 'patient', 'doctor' or None, and request.patient
+    and request.doctor to the logged in user's profile, or None.
+
+    Must come after AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.role, profile = None, None
+        if request.user.is_authenticated:
+            request.role, profile = get_role(request.user)
+        request.patient = profile if request.role == 'patient' else None
+        request.doctor = profile if request.role == 'doctor' else None
+        return self.get_response(request)
+
+
+class PerfStatsMiddleware(object):
+    """Records the view name, query count, SQL time, repeated queries and
+    template render time of every request. Each request is logged as a
+    JSON line to the memocha.perf logger and added to the per-view
+    statistics in memocha.perf, which the perfstats command reports.
+
+    Must come first, so the time of the other middleware is included.
+    Only enabled when PERF_STATS_DIR is set, see mysite.settings.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        memocha.perf.instrument_templates()
+
+    def __call__(self, request):
+        # Have the connections log their queries even when DEBUG is off
+        logged = {}
+        for connection in connections.all():
+            logged[connection.alias] = (connection.force_debug_cursor, len(connection.queries_log))
+            connection.force_debug_cursor = True
+        render_start = memocha.perf.template_render_time()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            total = time.perf_counter() - start
+            queries = []
+            for connection in connections.all():
+                force_debug_cursor, offset = logged.get(connection.alias, (False, 0))
+                connection.force_debug_cursor = force_debug_cursor
+                queries.extend(list(connection.queries_log)[offset:])
+        render = memocha.perf.template_render_time() - render_start
+
+        fingerprints = Counter(memocha.perf.fingerprint(query['sql']) for query in queries)
+        match = request.resolver_match
+        view = match.view_name if match is not None else 'unresolved'
+        record = {
+            'total_ms': total * 1000,
+            'queries': len(queries),
+            'sql_ms': sum(float(query['time']) for query in queries) * 1000,
+            'render_ms': render * 1000,
+            'repeated': {
+                sql: count for sql, count in fingerprints.items()
+                if count >= memocha.perf.REPEATED_QUERY_THRESHOLD
+            },
+        }
+        memocha.perf.get_recorder().record(view, record)
+        perf_logger.info(json.dumps(dict(
+            record,
+            view=view,
+            method=request.method,
+            path=request.path,
+            status=response.status_code,
+        ), sort_keys=True))
+        return response
+
+
+class ProfilingMiddleware(object):
+    """Saves profiles of the requests slower than PROFILE_THRESHOLD among
+    a PROFILE_STACK_SAMPLE_RATE fraction of them, and of a
+    PROFILE_SAMPLE_RATE fraction of all requests, see memocha.profiling.
+
+    Must come first, so the time of the other middleware is included.
+    Only enabled when PROFILE_DIR is set, see mysite.settings.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profiler = None
+        if random.random() < settings.PROFILE_SAMPLE_RATE:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is running on this thread
+                profiler = None
+        sampler = memocha.profiling.get_sampler()
+        ident = threading.get_ident()
+        sampled = profiler is None and random.random() < settings.PROFILE_STACK_SAMPLE_RATE
+        if sampled:
+            sampler.start(ident)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            total = time.perf_counter() - start
+            if sampled:
+                stacks = sampler.stop(ident)
+            elif profiler is not None:
+                profiler.disable()
+
+        total_ms = total * 1000
+        if profiler is None and (not sampled or total_ms < settings.PROFILE_THRESHOLD):
+            return response
+        match = request.resolver_match
+        profile = {
+            'time': time.time(),
+            'method': request.method,
+            'url': request.get_full_path(),
+            'view': match.view_name if match is not None else 'unresolved',
+            'role': getattr(request, 'role', None),
+            'status': response.status_code,
+            'total_ms': total_ms,
+        }
+        if profiler is None:
+            profile.update(
+                kind='sampled',
+                samples=sum(stacks.values()),
+                functions=memocha.profiling.sampled_functions(stacks, sampler.interval),
+                stacks=dict(stacks),
+            )
+        else:
+            profile.update(kind='cprofile', functions=memocha.profiling.profiled_functions(profiler))
+        memocha.profiling.save(settings.PROFILE_DIR, profile, settings.PROFILE_MAX_FILES)
+        return response
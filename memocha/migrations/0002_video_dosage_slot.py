@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def resolve_dosage_slots(apps, schema_editor):
+    """Backfills the dosage slot of the videos recorded so far.
+
+    This mirrors Prescription.dosage_slot, which can't be used here
+    because migrations only get the historical models.
+    """
+    Video = apps.get_model('memocha', 'Video')
+    videos = Video.objects.filter(dosage_date=None).select_related('prescription')
+    for video in videos.iterator():
+        localtime = timezone.localtime(video.record_date)
+        record_seconds = localtime.hour * 3600 + localtime.minute * 60 + localtime.second
+        video.dosage_date = localtime.date()
+        video.dosage_time = min(
+            video.prescription.dosage_times,
+            key=lambda time: abs(record_seconds - (time.hour * 3600 + time.minute * 60 + time.second))
+        )
+        video.save(update_fields=['dosage_date', 'dosage_time'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('memocha', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='dosage_date',
+            field=models.DateField(db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='dosage_time',
+            field=models.TimeField(null=True),
+        ),
+        migrations.RunPython(resolve_dosage_slots, migrations.RunPython.noop),
+    ]
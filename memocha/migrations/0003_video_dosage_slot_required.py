@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('memocha', '0002_video_dosage_slot'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='video',
+            name='dosage_date',
+            field=models.DateField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='dosage_time',
+            field=models.TimeField(),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['person', 'dosage_date', 'dosage_time'], name='memocha_vid_person__9ce5d9_idx'),
+        ),
+    ]
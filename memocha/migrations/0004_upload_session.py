@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:27
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('memocha', '0003_video_dosage_slot_required'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('record_date', models.DateTimeField()),
+                ('offset', models.BigIntegerField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True, db_index=True)),
+                ('person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='memocha.Patient')),
+                ('prescription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='memocha.Prescription')),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('memocha', '0005_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='poster',
+            field=models.FileField(blank=True, upload_to='posters/'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='rendition',
+            field=models.FileField(blank=True, upload_to='renditions/'),
+        ),
+    ]
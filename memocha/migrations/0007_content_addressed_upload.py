@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import memocha.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('memocha', '0006_video_rendition'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='video',
+            name='poster',
+            field=models.FileField(blank=True, db_index=True, upload_to='posters/'),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='rendition',
+            field=models.FileField(blank=True, db_index=True, upload_to='renditions/'),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='upload',
+            field=models.FileField(db_index=True, storage=memocha.storage.ContentAddressedStorage(), upload_to='videos/'),
+        ),
+    ]
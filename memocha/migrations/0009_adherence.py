@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:33
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('memocha', '0008_video_review_queue_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Adherence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('prescribed', models.PositiveSmallIntegerField()),
+                ('recorded', models.PositiveSmallIntegerField(default=0)),
+                ('approved', models.PositiveSmallIntegerField(default=0)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='memocha.Patient')),
+                ('prescription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='memocha.Prescription')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='adherence',
+            index=models.Index(fields=['patient', 'day'], name='memocha_adh_patient_b9652f_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='adherence',
+            unique_together=set([('patient', 'prescription', 'day')]),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('memocha', '0010_video_person_record_date_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='data_changed',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
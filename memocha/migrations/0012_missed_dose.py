@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:50
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('memocha', '0011_patient_data_changed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MissedDose',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('dosage_time', models.TimeField()),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='memocha.Patient')),
+                ('prescription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='memocha.Prescription')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='misseddose',
+            index=models.Index(fields=['patient', 'day'], name='memocha_mis_patient_bdd35d_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='misseddose',
+            unique_together=set([('patient', 'prescription', 'day', 'dosage_time')]),
+        ),
+    ]
@@ -1,16 +1,94 @@
-from datetime import datetime, timedelta
+import os
+import traceback
+import uuid
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
 
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files import File
 from django.utils import timezone
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models.functions import Coalesce
 from django.contrib.postgres.fields import ArrayField
 
+import memocha.cache
+from memocha.storage import ContentAddressedStorage
+
 
 # The window of time on either side of the prescribed
 # time a patient can record a dosage video.
 # Units: seconds
 DOSAGE_TIME_WIGGLE_ROOM = 1800
 
+# How long a patient's dosage schedule stays cached. The signal handlers
+# drop it when it changes, but with a per-process cache they can only
+# drop it from the process that made the change.
+# Units: seconds
+SCHEDULE_CACHE_TIMEOUT = 300
+
+# How long a user's role and profile stay cached, see memocha.middleware.
+# Like the schedules, a per-process cache only drops them from the
+# process that changed the user's groups.
+# Units: seconds
+ROLE_CACHE_TIMEOUT = 300
+
+# How long an upload session can go without receiving
+# a chunk before it is considered abandoned.
+# Units: seconds
+UPLOAD_SESSION_EXPIRY = 24 * 3600
+
+# The background jobs run for every uploaded video,
+# see memocha.jobs for what each of them does.
+VIDEO_JOB_KINDS = ['probe', 'rendition']
+
+# How long a worker has to finish a job it claimed before
+# the job is handed to another worker.
+# Units: seconds
+JOB_VISIBILITY_TIMEOUT = 600
+
+# How many times a job is tried before it is marked as failed,
+# and how long to wait before the first retry. The wait doubles
+# with every attempt.
+# Units: seconds
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_DELAY = 60
+
+
+def schedule_cache_key(patient_pk):
+    """The cache key holding a patient's sorted dosage schedule."""
+    return 'memocha:schedule:{0}'.format(patient_pk)
+
+
+def role_cache_key(user_pk):
+    """The cache key holding a user's role and profile, see memocha.middleware."""
+    return 'memocha:role:{0}'.format(user_pk)
+
+
+def patient_username(first_name, last_name, date_of_birth):
+    """The username a patient's account is created with, which the patient
+    gives again along with the secure code to activate the account."""
+    return '{0}_{1}_{2}'.format(first_name, last_name, date_of_birth)
+
+
+def touch_patients(patient_pks):
+    """Marks the videos or prescriptions of the given patients as changed.
+
+    This changes the ETags of their JSON data and drops everything cached
+    for them under their version (see memocha.cache).
+    """
+    patient_pks = list(patient_pks)
+    Patient.objects.filter(pk__in=patient_pks).update(data_changed=timezone.now())
+    # Bumping the version before the change is committed would let another
+    # request cache the old data under the new version
+    transaction.on_commit(lambda: memocha.cache.bump('patient', patient_pks))
+
+
+def invalidate_dashboards(doctor_pks):
+    """Drops the cached dashboards of the given doctors."""
+    memocha.cache.bump('doctor', doctor_pks)
+
 
 class Doctor(models.Model):
     user = models.OneToOneField(User)
@@ -18,12 +96,68 @@ class Doctor(models.Model):
     def __str__(self):
         return "{0} {1}".format(self.user.first_name, self.user.last_name)
 
+    def patient_summaries(self, days):
+        """Gets the doctor's patients along with how they are doing.
+
+        Everything is computed in a single query, each patient is annotated
+        with:
+        - pending: how many of their videos still need to be approved
+        - last_video: when they last recorded a video, or None
+        - recorded and prescribed: their doses over the last few days
+        - missed: their missed doses over the last few days, as found by
+          the detect_missed_doses command
+
+        :param days: How many days of doses to count, including today.
+        :return: The queryset of patients, ordered by name.
+        """
+        today = timezone.localtime().date()
+        pending = Video.objects.filter(
+            person=models.OuterRef('pk'), approved=None
+        ).order_by().values('person').annotate(count=models.Count('pk')).values('count')
+        last_video = Video.objects.filter(
+            person=models.OuterRef('pk')
+        ).order_by('-record_date').values('record_date')[:1]
+        adherence = Adherence.objects.filter(
+            patient=models.OuterRef('pk'),
+            day__gt=today - timedelta(days=days),
+            day__lte=today,
+        ).order_by().values('patient')
+        recorded = adherence.annotate(total=models.Sum('recorded')).values('total')
+        prescribed = adherence.annotate(total=models.Sum('prescribed')).values('total')
+        missed = MissedDose.objects.filter(
+            patient=models.OuterRef('pk'),
+            day__gt=today - timedelta(days=days),
+            day__lte=today,
+        ).order_by().values('patient').annotate(count=models.Count('pk')).values('count')
+        return self.patient_set.select_related('user').annotate(
+            pending=Coalesce(models.Subquery(pending, output_field=models.IntegerField()), 0),
+            last_video=models.Subquery(last_video, output_field=models.DateTimeField()),
+            recorded=Coalesce(models.Subquery(recorded, output_field=models.IntegerField()), 0),
+            prescribed=Coalesce(models.Subquery(prescribed, output_field=models.IntegerField()), 0),
+            missed=Coalesce(models.Subquery(missed, output_field=models.IntegerField()), 0),
+        ).order_by('user__last_name', 'user__first_name', 'pk')
+
 
 class Prescription(models.Model):
     medication = models.CharField(max_length=100)
     dosage = models.CharField(max_length=100)
     dosage_times = ArrayField(models.TimeField())
 
+    def dosage_slot(self, record_date):
+        """Resolves the dosage a video recorded at record_date was for.
+
+        :param record_date: When the video was recorded.
+        :return: The local date of the recording and the prescribed dosage
+            time closest to it.
+        """
+        localtime = timezone.localtime(record_date)
+        record_seconds = localtime.hour * 3600 + localtime.minute * 60 + localtime.second
+        dosage_time = min(
+            self.dosage_times,
+            key=lambda time: abs(record_seconds - (time.hour * 3600 + time.minute * 60 + time.second))
+        )
+        return localtime.date(), dosage_time
+
     def __str__(self):
         time_string = ', '.join((time.strftime('%H:%M') for time in self.dosage_times))
         return '{0}: Take {1} at {2}'.format(
@@ -38,74 +172,94 @@ class Patient(models.Model):
     doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE)
     date_of_birth = models.DateField()
     prescriptions = models.ManyToManyField(Prescription, blank=True)
+    # When the patient's videos or prescriptions last changed
+    data_changed = models.DateTimeField(default=timezone.now)
 
     def __str__(self):
         return "{0} {1}".format(self.user.first_name, self.user.last_name)
 
+    def dosage_schedule(self):
+        """Gets the patient's daily dosage schedule, sorted by time of day.
+
+        The schedule is cached per patient for SCHEDULE_CACHE_TIMEOUT and
+        invalidated by the signal handlers in memocha.signals whenever the
+        patient's prescriptions change.
+
+        :return: A tuple of two parallel lists. The first holds the dosage
+            times in ascending order so it can be bisected, the second holds
+            a (medication, prescription pk) pair for each of those times.
+        """
+        key = schedule_cache_key(self.pk)
+        schedule = cache.get(key)
+        if schedule is None:
+            entries = sorted(
+                (dosage_time, prescription.medication, prescription.pk)
+                for prescription in self.prescriptions.all()
+                for dosage_time in prescription.dosage_times
+            )
+            schedule = (
+                [entry[0] for entry in entries],
+                [entry[1:] for entry in entries],
+            )
+            cache.set(key, schedule, SCHEDULE_CACHE_TIMEOUT)
+        return schedule
+
     def recordable_medications(self):
         medications = []
         times = []
         now = timezone.localtime()
-        already_recorded = self.videos_for_date(now.date())
-        for prescription in self.prescriptions.all():
-            for dosage_time in prescription.dosage_times:
-                dosage_datetime = timezone.make_aware(datetime.combine(now.date(), dosage_time))
-                time_dif = dosage_datetime - now
-                if abs(time_dif.total_seconds()) <= DOSAGE_TIME_WIGGLE_ROOM:
-                    # Check to see if the video has already been recorded
-                    dosage_datetime = datetime.combine(now.date(), dosage_time)
-                    start_time = dosage_datetime - timedelta(seconds=DOSAGE_TIME_WIGGLE_ROOM)
-                    end_time = dosage_datetime + timedelta(seconds=DOSAGE_TIME_WIGGLE_ROOM)
-                    if already_recorded.filter(
-                        record_date__range=(start_time, end_time)
-                    ).filter(
-                        prescription=prescription
-                    ):
-                        continue
-                    medications.append(prescription.medication)
-                    times.append(dosage_time)
+        dosage_times, dosages = self.dosage_schedule()
+        wiggle_room = timedelta(seconds=DOSAGE_TIME_WIGGLE_ROOM)
+        # Only doses scheduled for today are recordable, so clamp the
+        # window to the current day before bisecting the schedule.
+        start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        end_of_day = now.replace(hour=23, minute=59, second=59, microsecond=999999)
+        start_time = max(now - wiggle_room, start_of_day)
+        end_time = min(now + wiggle_room, end_of_day)
+        lo = bisect_left(dosage_times, start_time.time())
+        hi = bisect_right(dosage_times, end_time.time())
+        if lo == hi:
+            return medications, times
+
+        # Check to see if the videos have already been recorded
+        already_recorded = set(self.videos_for_date(now.date()).filter(
+            dosage_time__range=(dosage_times[lo], dosage_times[hi - 1])
+        ).values_list('prescription_id', 'dosage_time'))
+        for dosage_time, (medication, prescription_pk) in zip(dosage_times[lo:hi], dosages[lo:hi]):
+            if (prescription_pk, dosage_time) in already_recorded:
+                continue
+            medications.append(medication)
+            times.append(dosage_time)
         return medications, times
 
     def next_medication(self):
-        time_to_next_medication = timedelta(microseconds=-1)
-        medications = []
         now = timezone.localtime()
-        for prescription in self.prescriptions.all():
-            for dosage_time in prescription.dosage_times:
-                time_dif = timezone.make_aware(datetime.combine(now.date(), dosage_time)) - now
-                time_dif_seconds = time_dif.total_seconds()
-
-                next_medication_seconds = time_to_next_medication.total_seconds()
-                if next_medication_seconds < 0:
-                    # Haven't found a medication to take today yet
-                    if time_dif_seconds >= 0:
-                        # Found a medication to take today
-                        time_to_next_medication = time_dif
-                        medications = [prescription.medication, ]
-                        break
-                    else:
-                        # Larger negative time_dif's means earlier in the day
-                        if time_dif_seconds <= next_medication_seconds:
-                            if time_dif_seconds == next_medication_seconds:
-                                medications.append(prescription.medication)
-                            else:
-                                time_to_next_medication = time_dif
-                                medications = [prescription.medication, ]
-                else:
-                    # There is at least one medication yet to be taken today
-                    if time_dif_seconds < 0:
-                        # Skip tomorrow's medications if we have one for today
-                        continue
-                    if time_dif_seconds <= next_medication_seconds:
-                        if time_dif_seconds == next_medication_seconds:
-                            medications.append(prescription.medication)
-                        else:
-                            time_to_next_medication = time_dif
-                            medications = [prescription.medication, ]
-                        break
-        time_of_next_medication = (now + time_to_next_medication).time()
+        dosage_times, dosages = self.dosage_schedule()
+        if not dosage_times:
+            return [], now.time()
+        index = bisect_left(dosage_times, now.time())
+        if index == len(dosage_times):
+            # Nothing left to take today, so the next medication
+            # is the first one tomorrow
+            index = 0
+        time_of_next_medication = dosage_times[index]
+        end = bisect_right(dosage_times, time_of_next_medication)
+        medications = [medication for medication, _ in dosages[index:end]]
         return medications, time_of_next_medication
 
+    def adherence(self, days):
+        """Counts the doses prescribed and recorded over the last few days.
+
+        :param days: How many days to count, including today.
+        :return: A (recorded, prescribed) tuple.
+        """
+        today = timezone.localtime().date()
+        totals = self.adherence_set.filter(
+            day__gt=today - timedelta(days=days),
+            day__lte=today,
+        ).aggregate(recorded=models.Sum('recorded'), prescribed=models.Sum('prescribed'))
+        return totals['recorded'] or 0, totals['prescribed'] or 0
+
     def videos_for_date(self, date):
         """For a given date, return the videos recorded for the patient's
         prescriptions.
@@ -113,39 +267,125 @@ class Patient(models.Model):
         :param date: The date to get videos for.
         :return: Not sure yet.
         """
-        return self.video_set.filter(record_date__date=date)
+        return self.video_set.filter(dosage_date=date)
 
     def videos_to_be_approved(self):
         """Gets the queryset of videos that still need to be approved."""
         return self.video_set.filter(approved=None)
 
+    def sync_prescriptions(self, entries):
+        """Makes the patient's prescriptions match the given entries.
+
+        The current prescriptions are fetched once and compared with the
+        entries in memory. Entries matching a current prescription keep it,
+        the others become new prescriptions, and current prescriptions that
+        match no entry are removed. Removed prescriptions that no other
+        patient shares are left for the collect_garbage command.
+
+        :param entries: Dicts with the medication, dosage and dosage_times
+            of each prescription, e.g. a formset's cleaned_data.
+        :return: The lists of added and removed prescriptions.
+        """
+        def identity(medication, dosage, dosage_times):
+            return medication, dosage, tuple(dosage_times)
+
+        current = {}
+        for prescription in self.prescriptions.all():
+            key = identity(prescription.medication, prescription.dosage, prescription.dosage_times)
+            current.setdefault(key, []).append(prescription)
+
+        seen = set()
+        added = []
+        for entry in entries:
+            key = identity(entry['medication'], entry['dosage'], entry['dosage_times'])
+            if key in seen:
+                continue
+            seen.add(key)
+            if current.pop(key, None) is None:
+                added.append(Prescription(
+                    medication=entry['medication'],
+                    dosage=entry['dosage'],
+                    dosage_times=entry['dosage_times'],
+                ))
+        removed = [prescription for prescriptions in current.values() for prescription in prescriptions]
+
+        with transaction.atomic():
+            if added:
+                Prescription.objects.bulk_create(added)
+                self.prescriptions.add(*added)
+            if removed:
+                self.prescriptions.remove(*removed)
+        return added, removed
+
+
+class VideoQuerySet(models.QuerySet):
+    def with_file(self, name):
+        """Filters the videos down to the ones stored in the file name,
+        either as the original upload or as one of its derived files."""
+        return self.filter(models.Q(upload=name) | models.Q(rendition=name) | models.Q(poster=name))
+
+    def dosages(self):
+        """Serializes the videos with Video.corresponding_dosage.
+
+        The prescriptions are fetched in the same query as the videos, so
+        the whole list costs a single query no matter how many videos
+        there are.
+        """
+        return [video.corresponding_dosage() for video in self.select_related('prescription')]
+
 
 class Video(models.Model):
     person = models.ForeignKey(Patient, on_delete=models.CASCADE)
     record_date = models.DateTimeField()
     prescription = models.ForeignKey(Prescription, on_delete=models.CASCADE)
-    upload = models.FileField(upload_to='videos/')
+    # Identical uploads share a file, which is deleted by the
+    # collect_garbage command once no Video refers to it
+    upload = models.FileField(upload_to='videos/', storage=ContentAddressedStorage(), db_index=True)
     approved = models.NullBooleanField()
+    # The dosage the video was recorded for, resolved once when the video
+    # is saved so later edits to the prescription's times don't move it.
+    dosage_date = models.DateField(db_index=True)
+    dosage_time = models.TimeField()
+    # Filled in by the background jobs in memocha.jobs
+    duration = models.FloatField(null=True, blank=True)
+    rendition = models.FileField(upload_to='renditions/', blank=True, db_index=True)
+    poster = models.FileField(upload_to='posters/', blank=True, db_index=True)
+
+    objects = VideoQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['person', 'dosage_date', 'dosage_time']),
+            models.Index(fields=['approved', 'record_date', 'id']),
+            models.Index(fields=['person', 'record_date']),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.dosage_date is None or self.dosage_time is None:
+            self.dosage_date, self.dosage_time = self.prescription.dosage_slot(self.record_date)
+        adding = self._state.adding
+        with transaction.atomic():
+            super(Video, self).save(*args, **kwargs)
+            if adding:
+                Job.objects.bulk_create([Job(kind=kind, video=self) for kind in VIDEO_JOB_KINDS])
+
+    def review_url(self):
+        """The URL to watch the video at, which is the small review
+        rendition once it has been made and the original until then."""
+        if self.rendition:
+            return self.rendition.url
+        return self.upload.url
 
     def corresponding_dosage(self):
-        localtime = timezone.localtime(self.record_date)
-        record_hour = localtime.hour
-        record_minute = localtime.minute
-        record_second = localtime.second
-        possible_times = self.prescription.dosage_times
-        timeslot = min(
-            possible_times,
-            key= lambda time: abs(
-                (record_hour - time.hour) * 3600
-                + (record_minute - time.minute) * 60
-                + (record_second - time.second)
-            )
-        )
         return {
+            'id': self.pk,
             'medication': self.prescription.medication,
-            'date': localtime.date().strftime('%d %b'),
-            'timeslot': timeslot.strftime('%H:%M'),
-            'url': self.upload.url,
+            'day': self.dosage_date.isoformat(),
+            'date': self.dosage_date.strftime('%d %b'),
+            'timeslot': self.dosage_time.strftime('%H:%M'),
+            'url': self.review_url(),
+            'original_url': self.upload.url,
+            'poster': self.poster.url if self.poster else None,
             'approved': self.approved,
         }
 
@@ -156,3 +396,438 @@ class Video(models.Model):
             self.record_date,
             self.prescription.medication
         )
+
+
+class Adherence(models.Model):
+    """How many of a prescription's doses a patient recorded on a day.
+
+    The rows are kept up to date as videos are saved, reviewed and deleted
+    and as prescriptions change (see memocha.signals), so dashboards and
+    reports can read the counts instead of working them out from the
+    videos. The rebuild_adherence command recomputes them from scratch and
+    also fills in the days on which nothing was recorded.
+    """
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
+    prescription = models.ForeignKey(Prescription, on_delete=models.CASCADE)
+    day = models.DateField()
+    # The number of doses prescribed for the day, the number
+    # of them with a video, and the number of those approved
+    prescribed = models.PositiveSmallIntegerField()
+    recorded = models.PositiveSmallIntegerField(default=0)
+    approved = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('patient', 'prescription', 'day')
+        indexes = [
+            models.Index(fields=['patient', 'day']),
+        ]
+
+    def __str__(self):
+        return '{0} {1} on {2}: {3}/{4}'.format(
+            self.patient_id,
+            self.prescription_id,
+            self.day,
+            self.recorded,
+            self.prescribed
+        )
+
+    @staticmethod
+    def video_counts(videos):
+        """Counts the recorded and approved doses in videos.
+
+        A dose recorded more than once is only counted once.
+
+        :return: A dict from (patient pk, prescription pk, day) to a
+            (recorded, approved) tuple.
+        """
+        counts = videos.values('person_id', 'prescription_id', 'dosage_date').annotate(
+            recorded=models.Count('dosage_time', distinct=True),
+            approved_doses=models.Count(
+                models.Case(models.When(approved=True, then='dosage_time')),
+                distinct=True
+            ),
+        )
+        return {
+            (row['person_id'], row['prescription_id'], row['dosage_date']): (row['recorded'], row['approved_doses'])
+            for row in counts
+        }
+
+    @classmethod
+    def refresh(cls, keys):
+        """Recomputes the rows for the given days.
+
+        :param keys: (patient pk, prescription pk, day) tuples.
+        """
+        keys = set(keys)
+        if not keys:
+            return
+        # The patient or prescription may have been deleted since the
+        # refresh was asked for
+        doctors = dict(Patient.objects.filter(
+            pk__in=set(key[0] for key in keys)
+        ).values_list('pk', 'doctor_id'))
+        prescriptions = dict(Prescription.objects.filter(
+            pk__in=set(key[1] for key in keys)
+        ).values_list('pk', 'dosage_times'))
+        keys = [key for key in keys if key[0] in doctors and key[1] in prescriptions]
+        if not keys:
+            return
+
+        query = models.Q()
+        for patient, prescription, day in keys:
+            query |= models.Q(person_id=patient, prescription_id=prescription, dosage_date=day)
+        counts = cls.video_counts(Video.objects.filter(query))
+        with transaction.atomic():
+            for key in keys:
+                recorded, approved = counts.get(key, (0, 0))
+                cls.objects.update_or_create(
+                    patient_id=key[0],
+                    prescription_id=key[1],
+                    day=key[2],
+                    defaults={
+                        'prescribed': len(prescriptions[key[1]]),
+                        'recorded': recorded,
+                        'approved': approved,
+                    }
+                )
+        invalidate_dashboards(doctors[key[0]] for key in keys)
+
+    @classmethod
+    def rebuild(cls, patients, since=None, batch_size=500):
+        """Recomputes the rows of the given patients from their videos.
+
+        Every day from when the prescription was added (or since, if later)
+        up to today gets a row for each of the patient's prescriptions,
+        along with any other prescription the patient recorded a video for.
+        The day a prescription was added is taken from its first existing
+        row, which the signal handlers write on that day, so a rebuild
+        agrees with the incremental updates. Prescriptions without any rows,
+        e.g. bulk inserted ones, are counted from when the patient joined.
+
+        :param patients: A queryset of the patients to rebuild.
+        :param since: The first day to rebuild.
+        :param batch_size: How many patients to rebuild at a time.
+        :return: The number of rows written.
+        """
+        today = timezone.localtime().date()
+        patients = patients.select_related('user').prefetch_related('prescriptions').order_by('pk')
+        written = 0
+        for offset in range(0, patients.count(), batch_size):
+            batch = list(patients[offset:offset + batch_size])
+            joined = {patient.pk: timezone.localtime(patient.user.date_joined).date() for patient in batch}
+            added = {
+                (row['patient_id'], row['prescription_id']): row['first_day']
+                for row in cls.objects.filter(patient__in=batch).values(
+                    'patient_id', 'prescription_id'
+                ).annotate(first_day=models.Min('day'))
+            }
+            videos = Video.objects.filter(person__in=batch, dosage_date__lte=today)
+            if since is not None:
+                videos = videos.filter(dosage_date__gte=since)
+            counts = cls.video_counts(videos)
+
+            prescriptions = dict(Prescription.objects.filter(
+                pk__in=set(key[1] for key in counts)
+            ).values_list('pk', 'dosage_times'))
+            keys = set(counts)
+            for patient in batch:
+                for prescription in patient.prescriptions.all():
+                    prescriptions[prescription.pk] = prescription.dosage_times
+                    day = max(added.get((patient.pk, prescription.pk), joined[patient.pk]), since or date.min)
+                    while day <= today:
+                        keys.add((patient.pk, prescription.pk, day))
+                        day += timedelta(days=1)
+
+            rows = []
+            for key in keys:
+                recorded, approved = counts.get(key, (0, 0))
+                rows.append(cls(
+                    patient_id=key[0],
+                    prescription_id=key[1],
+                    day=key[2],
+                    prescribed=len(prescriptions[key[1]]),
+                    recorded=recorded,
+                    approved=approved,
+                ))
+            with transaction.atomic():
+                stale = cls.objects.filter(patient__in=batch)
+                if since is not None:
+                    stale = stale.filter(day__gte=since)
+                stale.delete()
+                cls.objects.bulk_create(rows, batch_size=1000)
+            invalidate_dashboards(patient.doctor_id for patient in batch)
+            written += len(rows)
+        return written
+
+
+class MissedDose(models.Model):
+    """A prescribed dose whose window closed without a video recorded in it.
+
+    The rows are written by the detect_missed_doses command, see
+    MissedDose.detect, for the doctor views to read.
+    """
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
+    prescription = models.ForeignKey(Prescription, on_delete=models.CASCADE)
+    day = models.DateField()
+    dosage_time = models.TimeField()
+
+    class Meta:
+        unique_together = ('patient', 'prescription', 'day', 'dosage_time')
+        indexes = [
+            models.Index(fields=['patient', 'day']),
+        ]
+
+    def __str__(self):
+        return '{0} {1} on {2} at {3}'.format(
+            self.patient_id,
+            self.prescription_id,
+            self.day,
+            self.dosage_time.strftime('%H:%M')
+        )
+
+    # Every dose of the patients in a range of pks, from the later of since
+    # and the day the patient joined up to until. The window of a dose is
+    # DOSAGE_TIME_WIGGLE_ROOM either side of its time, clamped to its day
+    # like Patient.recordable_medications does.
+    SLOTS_SQL = """
+        SELECT link.patient_id, link.prescription_id, slot.day, slot.dosage_time,
+               GREATEST(slot.due - window_size, slot.day::timestamp AT TIME ZONE %(time_zone)s) AS opens,
+               LEAST(slot.due + window_size, (slot.day + 1)::timestamp AT TIME ZONE %(time_zone)s) AS closes
+        FROM {links} link
+        JOIN {patients} patient ON patient.id = link.patient_id
+        JOIN {users} u ON u.id = patient.user_id
+        JOIN {prescriptions} prescription ON prescription.id = link.prescription_id
+        CROSS JOIN make_interval(secs => %(wiggle_room)s) AS window_size
+        CROSS JOIN LATERAL (
+            SELECT day::date AS day, dosage_time,
+                   (day::date + dosage_time) AT TIME ZONE %(time_zone)s AS due
+            FROM generate_series(
+                GREATEST(%(since)s::date, (u.date_joined AT TIME ZONE %(time_zone)s)::date)::timestamp,
+                %(until)s::date::timestamp,
+                interval '1 day'
+            ) AS day
+            CROSS JOIN unnest(prescription.dosage_times) AS dosage_time
+        ) AS slot
+        WHERE link.patient_id BETWEEN %(first)s AND %(last)s
+    """
+
+    DETECT_SQL = """
+        INSERT INTO {missed} (patient_id, prescription_id, day, dosage_time)
+        SELECT slot.patient_id, slot.prescription_id, slot.day, slot.dosage_time
+        FROM ({slots}) AS slot
+        WHERE slot.closes < %(now)s
+          AND NOT EXISTS (
+              SELECT 1 FROM {videos} video
+              WHERE video.person_id = slot.patient_id
+                AND video.prescription_id = slot.prescription_id
+                AND video.record_date BETWEEN slot.opens AND slot.closes
+          )
+        ON CONFLICT DO NOTHING
+    """
+
+    @classmethod
+    def detect(cls, since, until, batch_size=10000):
+        """Recomputes the missed doses of every patient between two days.
+
+        The doses are worked out in the database, with two queries per batch
+        of patients: one deleting the batch's rows for the days and one
+        inserting the doses whose window has closed with no video of the
+        prescription recorded in it. Past days are checked against the
+        patients' current prescriptions.
+
+        :param since: The first day to check.
+        :param until: The last day to check.
+        :param batch_size: The size of the ranges of patient pks done at a time.
+        :return: The number of missed doses found.
+        """
+        bounds = Patient.objects.aggregate(first=models.Min('pk'), last=models.Max('pk'))
+        if bounds['first'] is None:
+            return 0
+        tables = {
+            'links': Patient.prescriptions.through._meta.db_table,
+            'patients': Patient._meta.db_table,
+            'users': User._meta.db_table,
+            'prescriptions': Prescription._meta.db_table,
+            'videos': Video._meta.db_table,
+            'missed': cls._meta.db_table,
+        }
+        sql = cls.DETECT_SQL.format(slots=cls.SLOTS_SQL.format(**tables), **tables)
+        found = 0
+        for first in range(bounds['first'], bounds['last'] + 1, batch_size):
+            last = first + batch_size - 1
+            with transaction.atomic():
+                cls.objects.filter(
+                    patient_id__gte=first, patient_id__lte=last, day__range=(since, until)
+                ).delete()
+                with connection.cursor() as cursor:
+                    cursor.execute(sql, {
+                        'time_zone': settings.TIME_ZONE,
+                        'wiggle_room': DOSAGE_TIME_WIGGLE_ROOM,
+                        'since': since,
+                        'until': until,
+                        'first': first,
+                        'last': last,
+                        'now': timezone.now(),
+                    })
+                    found += cursor.rowcount
+            invalidate_dashboards(Patient.objects.filter(
+                pk__range=(first, last)
+            ).values_list('doctor_id', flat=True).distinct())
+        return found
+
+
+class Job(models.Model):
+    """A piece of background work on a video, run by the process_jobs command.
+
+    Workers claim pending jobs with SELECT ... FOR UPDATE SKIP LOCKED, so
+    any number of them can share the table without handing out a job
+    twice. A claimed job is locked until its visibility timeout runs out,
+    after which it is handed to another worker in case the first one died.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    kind = models.CharField(max_length=50)
+    video = models.ForeignKey(Video, on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+
+    def __str__(self):
+        return '{0} job for video {1} ({2})'.format(self.kind, self.video_id, self.status)
+
+    @classmethod
+    def claim(cls, limit=1, visibility_timeout=JOB_VISIBILITY_TIMEOUT):
+        """Claims up to limit jobs that are ready to run.
+
+        A job is ready if it is pending and its retry delay is over, or if
+        the worker that claimed it didn't finish it in time.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            jobs = list(
+                cls.objects.select_for_update(skip_locked=True).filter(
+                    models.Q(status=cls.PENDING, run_after__lte=now)
+                    | models.Q(status=cls.RUNNING, locked_until__lt=now)
+                ).order_by('run_after')[:limit]
+            )
+            for job in jobs:
+                job.status = cls.RUNNING
+                job.attempts += 1
+                job.locked_until = now + timedelta(seconds=visibility_timeout)
+                job.save(update_fields=['status', 'attempts', 'locked_until'])
+        return jobs
+
+    def run(self):
+        """Runs a claimed job and records how it went.
+
+        :return: True if the job succeeded.
+        """
+        from memocha.jobs import HANDLERS
+
+        try:
+            if self.attempts > JOB_MAX_ATTEMPTS:
+                raise RuntimeError('Gave up after {0} attempts'.format(JOB_MAX_ATTEMPTS))
+            HANDLERS[self.kind](self.video)
+        except Exception:
+            self.last_error = traceback.format_exc()
+            if self.attempts >= JOB_MAX_ATTEMPTS:
+                self.status = self.FAILED
+            else:
+                self.status = self.PENDING
+                delay = JOB_RETRY_DELAY * 2 ** (self.attempts - 1)
+                self.run_after = timezone.now() + timedelta(seconds=delay)
+        else:
+            self.status = self.DONE
+        self.locked_until = None
+        self.save(update_fields=['status', 'run_after', 'locked_until', 'last_error'])
+        return self.status == self.DONE
+
+
+class UploadSession(models.Model):
+    """A video being uploaded in chunks.
+
+    Chunks are appended to a partial file under UPLOAD_SESSION_ROOT until
+    the session is finalized, at which point the file is moved into the
+    Video's upload storage. The offset is the number of bytes received so
+    far, which is where a client resumes after a disconnect.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    person = models.ForeignKey(Patient, on_delete=models.CASCADE)
+    prescription = models.ForeignKey(Prescription, on_delete=models.CASCADE)
+    record_date = models.DateTimeField()
+    offset = models.BigIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True, db_index=True)
+
+    @property
+    def path(self):
+        return os.path.join(settings.UPLOAD_SESSION_ROOT, '{0}.part'.format(self.pk))
+
+    def append(self, stream, chunk_size=64 * 1024):
+        """Appends the contents of stream to the partial file.
+
+        The caller is expected to hold a lock on the session row. Anything
+        past the recorded offset is left over from a chunk that was cut
+        off, so it is dropped before appending.
+
+        :param stream: A file-like object with the chunk's bytes.
+        :return: The new offset.
+        """
+        os.makedirs(settings.UPLOAD_SESSION_ROOT, exist_ok=True)
+        mode = 'r+b' if os.path.exists(self.path) else 'w+b'
+        with open(self.path, mode) as partial:
+            partial.truncate(self.offset)
+            partial.seek(self.offset)
+            for data in iter(lambda: stream.read(chunk_size), b''):
+                partial.write(data)
+            self.offset = partial.tell()
+        self.save(update_fields=['offset', 'updated'])
+        return self.offset
+
+    def has_data(self):
+        """Whether any of the video has been uploaded yet."""
+        return self.offset > 0 and os.path.exists(self.path)
+
+    def finalize(self):
+        """Turns the uploaded file into a Video and ends the session.
+
+        The caller is expected to check has_data first.
+        """
+        with open(self.path, 'rb') as partial:
+            video = Video(
+                person=self.person,
+                record_date=self.record_date,
+                prescription=self.prescription,
+                upload=File(partial, name='video.mp4'),
+            )
+            video.save()
+        self.discard()
+        return video
+
+    def discard(self):
+        """Deletes the session. Its partial file is removed by the
+        upload_session_deleted handler in memocha.signals, which also
+        covers sessions deleted along with their patient."""
+        self.delete()
+
+    @classmethod
+    def expired(cls):
+        """Gets the sessions that haven't received a chunk in a while."""
+        cutoff = timezone.now() - timedelta(seconds=UPLOAD_SESSION_EXPIRY)
+        return cls.objects.filter(updated__lt=cutoff)
@@ -0,0 +1,220 @@
+"""
+Per-view request statistics, recorded by memocha.middleware.PerfStatsMiddleware.
+
+For every request the middleware records how long the view took, how many
+queries it made and how long they took, how long its templates took to
+render and which queries it repeated. Repeated queries, e.g. one per video
+in a loop, are grouped by their fingerprint: the SQL with its literals
+replaced by placeholders.
+
+Each process keeps the statistics of the current window in memory and
+writes them to a JSON file in PERF_STATS_DIR every PERF_STATS_FLUSH_INTERVAL
+seconds. A new window starts every PERF_STATS_WINDOW seconds so old
+traffic rolls off. The perfstats command merges the files of all the
+processes.
+"""
+import json
+import os
+import re
+import socket
+import threading
+import time
+
+from django.conf import settings
+
+
+# The upper bounds of the latency histogram buckets
+# Units: milliseconds
+LATENCY_BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+# How many times a query has to be made in one request to count as repeated
+REPEATED_QUERY_THRESHOLD = 2
+
+# How many repeated query fingerprints are kept per view
+MAX_FINGERPRINTS = 20
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+LIST_RE = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+SPACE_RE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """Reduces sql to its shape, so queries that only differ in their
+    parameters, or in how many values are in an IN list, are equal."""
+    sql = STRING_RE.sub('?', sql)
+    sql = NUMBER_RE.sub('?', sql)
+    sql = LIST_RE.sub('IN (...)', sql)
+    return SPACE_RE.sub(' ', sql).strip()
+
+
+def bucket(milliseconds):
+    """The index of the latency histogram bucket milliseconds falls in."""
+    for index, bound in enumerate(LATENCY_BUCKETS):
+        if milliseconds <= bound:
+            return index
+    return len(LATENCY_BUCKETS)
+
+
+def empty_stats():
+    return {
+        'requests': 0,
+        'histogram': [0] * (len(LATENCY_BUCKETS) + 1),
+        'total_ms': 0.0,
+        'max_ms': 0.0,
+        'queries': 0,
+        'max_queries': 0,
+        'sql_ms': 0.0,
+        'render_ms': 0.0,
+        'repeated': {},
+    }
+
+
+def add(stats, record):
+    """Adds the record of one request to the statistics of its view."""
+    stats['requests'] += 1
+    stats['histogram'][bucket(record['total_ms'])] += 1
+    stats['total_ms'] += record['total_ms']
+    stats['max_ms'] = max(stats['max_ms'], record['total_ms'])
+    stats['queries'] += record['queries']
+    stats['max_queries'] = max(stats['max_queries'], record['queries'])
+    stats['sql_ms'] += record['sql_ms']
+    stats['render_ms'] += record['render_ms']
+    repeated = stats['repeated']
+    for sql, count in record['repeated'].items():
+        if sql in repeated or len(repeated) < MAX_FINGERPRINTS:
+            repeated[sql] = max(repeated.get(sql, 0), count)
+
+
+def merge(stats, other):
+    """Merges the statistics other of a view into stats."""
+    stats['requests'] += other['requests']
+    stats['histogram'] = [a + b for a, b in zip(stats['histogram'], other['histogram'])]
+    for key in ('total_ms', 'queries', 'sql_ms', 'render_ms'):
+        stats[key] += other[key]
+    for key in ('max_ms', 'max_queries'):
+        stats[key] = max(stats[key], other[key])
+    for sql, count in other['repeated'].items():
+        stats['repeated'][sql] = max(stats['repeated'].get(sql, 0), count)
+
+
+def percentile(histogram, percent):
+    """Estimates a latency percentile as the upper bound of its bucket.
+
+    :return: The bound in milliseconds, or None if the percentile falls in
+        the last, unbounded bucket.
+    """
+    target = sum(histogram) * percent / 100.0
+    seen = 0
+    for index, count in enumerate(histogram):
+        seen += count
+        if count and seen >= target:
+            return LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else None
+    return None
+
+
+class Recorder(object):
+    """Collects the statistics of this process and writes them to disk."""
+
+    def __init__(self, directory, window, flush_interval):
+        self.directory = directory
+        self.window = window
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.name = '{0}-{1}'.format(socket.gethostname(), os.getpid())
+        self.start_window(time.time())
+
+    def start_window(self, now):
+        self.window_start = int(now // self.window * self.window)
+        self.views = {}
+        self.last_flush = now
+
+    def path(self):
+        return os.path.join(self.directory, 'perf-{0}-{1}.json'.format(self.window_start, self.name))
+
+    def record(self, view, record):
+        now = time.time()
+        with self.lock:
+            if now >= self.window_start + self.window:
+                # Write out the finished window before starting the next one
+                self.flush()
+                self.start_window(now)
+            add(self.views.setdefault(view, empty_stats()), record)
+            if now - self.last_flush >= self.flush_interval:
+                self.flush()
+                self.last_flush = now
+
+    def flush(self):
+        if not self.views:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path()
+        temporary_path = path + '.part'
+        with open(temporary_path, 'w') as f:
+            json.dump({'window_start': self.window_start, 'window': self.window, 'views': self.views}, f)
+        # Readers never see a half written file
+        os.rename(temporary_path, path)
+
+
+def load(directory, since=None):
+    """Merges the statistics written to directory by all the processes.
+
+    :param since: Only merge windows that ended after this timestamp.
+    :return: The merged statistics, by view name.
+    """
+    views = {}
+    if not os.path.isdir(directory):
+        return views
+    for filename in sorted(os.listdir(directory)):
+        if not (filename.startswith('perf-') and filename.endswith('.json')):
+            continue
+        with open(os.path.join(directory, filename)) as f:
+            snapshot = json.load(f)
+        if since is not None and snapshot['window_start'] + snapshot['window'] < since:
+            continue
+        for view, stats in snapshot['views'].items():
+            merge(views.setdefault(view, empty_stats()), stats)
+    return views
+
+
+_render_time = threading.local()
+
+
+def template_render_time():
+    """The time spent rendering templates on this thread so far, in seconds."""
+    return getattr(_render_time, 'total', 0.0)
+
+
+def instrument_templates():
+    """Times the rendering of the Django templates, see template_render_time."""
+    from django.template.backends.django import Template
+
+    if getattr(Template.render, 'instrumented', False):
+        return
+    render = Template.render
+
+    def timed_render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return render(self, context, request)
+        finally:
+            _render_time.total = template_render_time() + time.perf_counter() - start
+    timed_render.instrumented = True
+    Template.render = timed_render
+
+
+_recorder = None
+
+
+def get_recorder():
+    """The Recorder of this process, writing to PERF_STATS_DIR."""
+    global _recorder
+    name = '{0}-{1}'.format(socket.gethostname(), os.getpid())
+    # A forked worker starts a recorder of its own
+    if _recorder is None or _recorder.name != name or _recorder.directory != settings.PERF_STATS_DIR:
+        _recorder = Recorder(
+            settings.PERF_STATS_DIR,
+            getattr(settings, 'PERF_STATS_WINDOW', 3600),
+            getattr(settings, 'PERF_STATS_FLUSH_INTERVAL', 60),
+        )
+    return _recorder
@@ -0,0 +1,175 @@
+"""
+Profiles of slow requests, captured by memocha.middleware.ProfilingMiddleware.
+
+Two kinds of profile are captured:
+
+- A PROFILE_STACK_SAMPLE_RATE fraction of the requests is watched by a
+  StackSampler, a thread that records the request thread's stack every
+  PROFILE_SAMPLE_INTERVAL seconds. Only the watched requests taking longer
+  than PROFILE_THRESHOLD have their samples saved. Walking the stacks is
+  what sampling costs, so it is kept to a few requests at a coarse
+  interval, and nothing at all is done while no request is watched. That
+  way it can stay on in production.
+- A PROFILE_SAMPLE_RATE fraction of the requests run under cProfile, which
+  times every call exactly but slows the request down, and are saved
+  whatever their latency.
+
+Each profile is a JSON file in PROFILE_DIR holding the request's URL, view,
+user role and timing, and the time spent in each function: 'self' in the
+function itself and 'inclusive' including the functions it called. The
+sampled profiles also keep their stacks in the collapsed format flame graph
+tools read. The profiles command summarizes them.
+"""
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+
+
+# How deep into a stack the sampler looks
+MAX_STACK_DEPTH = 100
+
+
+def function_label(code):
+    return '{0}:{1}({2})'.format(code.co_filename, code.co_firstlineno, code.co_name)
+
+
+def collapse(frame):
+    """The stack of frame from the outermost function in, joined by ';'."""
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(function_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class StackSampler(object):
+    """Samples the stacks of the threads it has been told to watch."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.watched = {}
+        self.busy = threading.Event()
+        self.pid = None
+
+    def start(self, ident):
+        with self.lock:
+            if self.pid != os.getpid():
+                # The thread of a parent process does not survive a fork
+                self.pid = os.getpid()
+                thread = threading.Thread(target=self.run, name='memocha-stack-sampler', daemon=True)
+                thread.start()
+            self.watched[ident] = Counter()
+            self.busy.set()
+
+    def stop(self, ident):
+        """Stops watching the thread ident.
+
+        :return: A Counter of the collapsed stacks seen.
+        """
+        with self.lock:
+            stacks = self.watched.pop(ident, Counter())
+            if not self.watched:
+                self.busy.clear()
+        return stacks
+
+    def run(self):
+        while True:
+            self.busy.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self.lock:
+                for ident, stacks in self.watched.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks[collapse(frame)] += 1
+
+
+def sampled_functions(stacks, interval):
+    """Estimates the time spent in each function from the sampled stacks.
+
+    :return: A dict of {'self': seconds, 'inclusive': seconds}, by function.
+    """
+    functions = {}
+    for stack, count in stacks.items():
+        labels = stack.split(';')
+        for label in set(labels):
+            functions.setdefault(label, {'self': 0.0, 'inclusive': 0.0})['inclusive'] += count * interval
+        functions[labels[-1]]['self'] += count * interval
+    return functions
+
+
+def profiled_functions(profiler):
+    """The time spent in each function called under profiler, a cProfile.Profile.
+
+    :return: A dict of {'self': seconds, 'inclusive': seconds, 'calls': count}, by function.
+    """
+    functions = {}
+    for (filename, line, name), (_, calls, self_time, inclusive_time, _) in pstats.Stats(profiler).stats.items():
+        functions['{0}:{1}({2})'.format(filename, line, name)] = {
+            'self': self_time,
+            'inclusive': inclusive_time,
+            'calls': calls,
+        }
+    return functions
+
+
+def save(directory, profile, max_files):
+    """Writes profile to directory, deleting the oldest profiles beyond max_files."""
+    os.makedirs(directory, exist_ok=True)
+    filename = 'profile-{0}-{1}.json'.format(int(profile['time'] * 1000), uuid.uuid4().hex[:8])
+    temporary_path = os.path.join(directory, filename + '.part')
+    with open(temporary_path, 'w') as f:
+        json.dump(profile, f)
+    os.rename(temporary_path, os.path.join(directory, filename))
+
+    filenames = list_profiles(directory)
+    for old in filenames[:max(len(filenames) - max_files, 0)]:
+        try:
+            os.remove(os.path.join(directory, old))
+        except FileNotFoundError:
+            # Another process got to it first
+            pass
+
+
+def list_profiles(directory):
+    """The names of the profile files in directory, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        filename for filename in os.listdir(directory)
+        if filename.startswith('profile-') and filename.endswith('.json')
+    )
+
+
+def load(directory, since=None):
+    """The profiles saved in directory, oldest first.
+
+    :param since: Only load profiles captured after this timestamp.
+    """
+    profiles = []
+    for filename in list_profiles(directory):
+        with open(os.path.join(directory, filename)) as f:
+            profile = json.load(f)
+        if since is None or profile['time'] >= since:
+            profile['file'] = filename
+            profiles.append(profile)
+    return profiles
+
+
+_sampler = None
+
+
+def get_sampler():
+    """The StackSampler of this process."""
+    global _sampler
+    if _sampler is None:
+        _sampler = StackSampler(settings.PROFILE_SAMPLE_INTERVAL)
+    return _sampler
@@ -0,0 +1,188 @@
+"""
+Reminders sent as the patients' dose windows open, by the dispatch_doses command.
+
+The dispatcher keeps every prescribed dose in a ScheduleWheel: a slot per
+minute of the day holding the doses whose window, DOSAGE_TIME_WIGGLE_ROOM
+before the dosage time, opens in that minute. Every minute it only looks
+at the slots it has passed, so the work per tick is the number of doses
+due rather than the number of patients.
+
+The signal handlers in memocha.signals call notify_schedules_changed when
+a patient's prescriptions change, which the dispatcher listens for to
+reload just those patients. Bulk inserts bypass the signals, so the
+dispatcher also reloads everything every so often.
+
+The reminders are delivered by the backend named by REMINDER_BACKEND.
+"""
+import json
+import logging
+import math
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from memocha.models import DOSAGE_TIME_WIGGLE_ROOM, Patient
+
+
+# The Postgres channel schedule changes are announced on
+SCHEDULE_CHANNEL = 'memocha_schedules'
+
+# Postgres drops notifications with longer payloads, so larger changes
+# are announced without one, which reloads every patient
+MAX_NOTIFY_PAYLOAD = 7000
+
+MINUTES_PER_DAY = 24 * 60
+
+Dose = namedtuple('Dose', ['patient_id', 'user_id', 'prescription_id', 'medication', 'dosage', 'dosage_time'])
+
+logger = logging.getLogger(__name__)
+
+
+def notify_schedules_changed(patient_pks):
+    """Tells the dispatcher to reload the given patients' doses.
+
+    The notification is only delivered if the current transaction commits.
+    """
+    payload = ','.join(str(pk) for pk in sorted(set(patient_pks)))
+    if not payload:
+        return
+    if len(payload) > MAX_NOTIFY_PAYLOAD:
+        payload = ''
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_notify(%s, %s)', [SCHEDULE_CHANNEL, payload])
+
+
+def opening_minute(dosage_time):
+    """The minute of the day the window of a dose at dosage_time opens in.
+
+    The windows are clamped to the day of the dose, like
+    Patient.recordable_medications does, and rounded up so no reminder is
+    sent before its dose can be recorded.
+    """
+    seconds = dosage_time.hour * 3600 + dosage_time.minute * 60 + dosage_time.second
+    return min(int(math.ceil(max(seconds - DOSAGE_TIME_WIGGLE_ROOM, 0) / 60.0)), MINUTES_PER_DAY - 1)
+
+
+class ScheduleWheel(object):
+    """The prescribed doses, by the minute of the day their window opens."""
+
+    def __init__(self):
+        self.slots = [{} for _ in range(MINUTES_PER_DAY)]
+        # Where each patient's doses are, so they can be replaced
+        self.patients = {}
+        self.position = None
+
+    def __len__(self):
+        return sum(len(slot) for slot in self.slots)
+
+    def add(self, dose):
+        minute = opening_minute(dose.dosage_time)
+        key = (dose.patient_id, dose.prescription_id, dose.dosage_time)
+        self.slots[minute][key] = dose
+        self.patients.setdefault(dose.patient_id, set()).add((minute, key))
+
+    def remove_patient(self, patient_pk):
+        for minute, key in self.patients.pop(patient_pk, ()):
+            self.slots[minute].pop(key, None)
+
+    def load(self, patient_pks=None):
+        """Loads the doses of the given patients from the database,
+        replacing any they had in the wheel.
+
+        :param patient_pks: The patients to load, or None for all of them,
+            which starts the wheel over.
+        """
+        rows = Patient.prescriptions.through.objects.values_list(
+            'patient_id', 'patient__user_id', 'prescription_id',
+            'prescription__medication', 'prescription__dosage', 'prescription__dosage_times'
+        )
+        if patient_pks is None:
+            self.slots = [{} for _ in range(MINUTES_PER_DAY)]
+            self.patients = {}
+        else:
+            patient_pks = list(patient_pks)
+            for pk in patient_pks:
+                self.remove_patient(pk)
+            rows = rows.filter(patient_id__in=patient_pks)
+        for patient_pk, user_pk, prescription_pk, medication, dosage, dosage_times in rows.iterator():
+            for dosage_time in dosage_times:
+                self.add(Dose(patient_pk, user_pk, prescription_pk, medication, dosage, dosage_time))
+
+    def due(self, minute):
+        """The doses whose window opens in minute of the day."""
+        return list(self.slots[minute].values())
+
+    def advance(self, now):
+        """Moves the wheel on to now.
+
+        The first call only sets where the wheel is, so a restarted
+        dispatcher does not send the reminders it may have sent already.
+        After a stall, the windows that opened more than twice
+        DOSAGE_TIME_WIGGLE_ROOM ago are skipped, since they have closed.
+
+        :param now: An aware datetime.
+        :return: (date, doses) tuples of the windows opened since the last
+            call, up to and including the minute of now, oldest first.
+        """
+        def position_of(moment):
+            moment = timezone.localtime(moment)
+            return moment.date(), moment.hour * 60 + moment.minute
+
+        position = position_of(now)
+        if self.position is None or position <= self.position:
+            self.position = max(position, self.position or position)
+            return []
+        day, minute = max(self.position, position_of(now - timedelta(seconds=2 * DOSAGE_TIME_WIGGLE_ROOM)))
+        opened = []
+        while (day, minute) < position:
+            minute += 1
+            if minute == MINUTES_PER_DAY:
+                day, minute = day + timedelta(days=1), 0
+            doses = self.due(minute)
+            if doses:
+                opened.append((day, doses))
+        self.position = position
+        return opened
+
+
+class BaseBackend(object):
+    """Delivers reminders. Subclasses implement send."""
+
+    def send(self, day, doses):
+        """Reminds the patients to take their doses.
+
+        :param day: The date the doses are due on.
+        :param doses: A list of Dose.
+        """
+        raise NotImplementedError
+
+
+class LogBackend(BaseBackend):
+    """Logs every reminder to the memocha.reminders logger, for development."""
+
+    def send(self, day, doses):
+        for dose in doses:
+            logger.info('Remind patient %s to take %s of %s at %s on %s',
+                        dose.patient_id, dose.dosage, dose.medication, dose.dosage_time.strftime('%H:%M'), day)
+
+
+class FileBackend(BaseBackend):
+    """Appends every reminder to REMINDER_FILE_PATH as a JSON line, for testing."""
+
+    def send(self, day, doses):
+        with open(settings.REMINDER_FILE_PATH, 'a') as f:
+            for dose in doses:
+                f.write(json.dumps(dict(
+                    dose._asdict(),
+                    dosage_time=dose.dosage_time.strftime('%H:%M:%S'),
+                    day=day.isoformat(),
+                )) + '\n')
+
+
+def get_backend():
+    """An instance of the backend named by REMINDER_BACKEND."""
+    return import_string(settings.REMINDER_BACKEND)()
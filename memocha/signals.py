@@ -0,0 +1,154 @@
+import os
+import threading
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from memocha.models import (
+    Adherence, Doctor, Patient, Prescription, UploadSession, Video, invalidate_dashboards, role_cache_key,
+    schedule_cache_key, touch_patients
+)
+from memocha.reminders import notify_schedules_changed
+
+
+def invalidate_schedules(patient_pks):
+    """Drops the cached dosage schedules of the given patients and has the
+    dose dispatcher reload them."""
+    patient_pks = list(patient_pks)
+    cache.delete_many([schedule_cache_key(pk) for pk in patient_pks])
+    notify_schedules_changed(patient_pks)
+
+
+def invalidate_roles(user_pks):
+    """Drops the cached roles and profiles of the given users."""
+    cache.delete_many([role_cache_key(pk) for pk in user_pks])
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear', 'pre_clear'):
+        return
+    if not reverse:
+        invalidate_roles([instance.pk])
+    elif pk_set:
+        invalidate_roles(pk_set)
+    else:
+        # A group's users are being cleared, so they have
+        # to be looked up before the relation is gone
+        invalidate_roles(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Doctor)
+@receiver(post_delete, sender=Doctor)
+def doctor_changed(sender, instance, **kwargs):
+    invalidate_roles([instance.user_id])
+
+
+@receiver(m2m_changed, sender=Patient.prescriptions.through)
+def prescriptions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear', 'pre_clear'):
+        return
+    if action == 'post_add':
+        # Start counting the new prescriptions from today
+        today = timezone.localtime().date()
+        if reverse:
+            Adherence.refresh((pk, instance.pk, today) for pk in pk_set)
+        else:
+            Adherence.refresh((instance.pk, pk, today) for pk in pk_set)
+    if not reverse:
+        patients = [instance.pk]
+    elif pk_set:
+        patients = pk_set
+    else:
+        # A prescription's patients are being cleared, so they
+        # have to be looked up before the relation is gone
+        patients = list(instance.patient_set.values_list('pk', flat=True))
+    invalidate_schedules(patients)
+    touch_patients(patients)
+
+
+@receiver(post_save, sender=Prescription)
+@receiver(pre_delete, sender=Prescription)
+def prescription_changed(sender, instance, **kwargs):
+    patients = list(instance.patient_set.values_list('pk', flat=True))
+    invalidate_schedules(patients)
+    touch_patients(patients)
+
+
+@receiver(post_save, sender=Prescription)
+def prescription_saved(sender, instance, created, **kwargs):
+    if not created:
+        # The new times apply from today on, earlier days keep theirs
+        Adherence.objects.filter(
+            prescription=instance,
+            day__gte=timezone.localtime().date()
+        ).update(prescribed=len(instance.dosage_times))
+        invalidate_dashboards(instance.patient_set.values_list('doctor_id', flat=True))
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def patient_changed(sender, instance, **kwargs):
+    invalidate_dashboards([instance.doctor_id])
+    invalidate_roles([instance.user_id])
+    if kwargs['signal'] is post_delete:
+        # Their prescriptions went with them without an m2m_changed signal
+        notify_schedules_changed([instance.pk])
+
+
+class VideoChanges(object):
+    """The videos changed in a transaction, handled together once it commits.
+
+    Deleting a patient or a prescription deletes its videos one signal at a
+    time, which would otherwise cost queries per video.
+    """
+
+    def __init__(self):
+        self.patients = set()
+        self.keys = set()
+
+    def flush(self):
+        if getattr(_pending, 'video_changes', None) is self:
+            _pending.video_changes = None
+        # Adherence.refresh skips the patients and prescriptions deleted since
+        touch_patients(self.patients)
+        Adherence.refresh(self.keys)
+
+
+_pending = threading.local()
+
+
+@receiver(post_save, sender=Video)
+@receiver(post_delete, sender=Video)
+def video_changed(sender, instance, **kwargs):
+    changes = getattr(_pending, 'video_changes', None)
+    # A rolled back transaction drops its callback along with the changes
+    registered = changes is not None and any(
+        function == changes.flush for _, function in connection.run_on_commit
+    )
+    if not registered:
+        changes = VideoChanges()
+        _pending.video_changes = changes
+    changes.patients.add(instance.person_id)
+    changes.keys.add((instance.person_id, instance.prescription_id, instance.dosage_date))
+    if not registered:
+        # Outside a transaction this runs straight away
+        transaction.on_commit(changes.flush)
+
+
+@receiver(post_delete, sender=UploadSession)
+def upload_session_deleted(sender, instance, **kwargs):
+    # The deletion clears the instance's pk, which the path is made from
+    path = instance.path
+
+    def remove_partial_file():
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    # Keep the file if the deletion is rolled back
+    transaction.on_commit(remove_partial_file)
@@ -1,8 +1,14 @@
 // Code adapted from: https://github.com/webrtc/samples/blob/gh-pages/src/content/getusermedia/record/js/main.js
 
 var recordedBlobs;
+var recordedBytes;
 var mediaRecorder;
 
+// A copy of the recording is kept for the preview and in case streaming
+// fails, unless it grows past this, so long recordings don't run low-end
+// phones out of memory.
+var MAX_LOCAL_BYTES = 32 * 1024 * 1024;
+
 var form = document.querySelector('form');
 
 var recordVideo = document.querySelector('video#recordVideo');
@@ -10,6 +16,7 @@ var playVideo = document.querySelector('video#playVideo');
 
 var recordButton = document.querySelector('button#record');
 var uploadButton = document.querySelector('button#upload');
+var recordMessage = document.querySelector('p#recordMessage');
 recordButton.onclick = toggleRecording;
 
 var constraints = {
@@ -39,12 +46,33 @@ navigator.mediaDevices.getUserMedia(constraints).
 
 function handleDataAvailable(event) {
     if (event.data && event.data.size > 0) {
-        recordedBlobs.push(event.data);
+        if (recordedBlobs !== null) {
+            recordedBytes += event.data.size;
+            if (recordedBytes > MAX_LOCAL_BYTES) {
+                // Too long to keep, the upload session has the only copy
+                recordedBlobs = null;
+            } else {
+                recordedBlobs.push(event.data);
+            }
+        }
+        queueStreamData(event.data);
     }
 }
 
 function handleStop(event) {
     console.log('Recorder stopped: ', event);
+    // The last data has arrived, so the upload can be finished once
+    // the final batch has been sent
+    stopStreaming();
+    if (recordedBlobs !== null) {
+        var superBuffer = new Blob(recordedBlobs, {type: 'video/mp4'});
+        playVideo.src = window.URL.createObjectURL(superBuffer);
+        playVideo.controls = true;
+        playVideo.style.display = '';
+    } else {
+        recordMessage.textContent = 'This recording is too long to preview.';
+    }
+    uploadButton.disabled = false;
 }
 
 function toggleRecording() {
@@ -58,6 +86,8 @@ function toggleRecording() {
             tracks[i].enabled = true;
         }
         recordVideo.style.display = '';
+        recordMessage.textContent = '';
+        uploadButton.disabled = true;
         startRecording();
     } else {
         stopRecording();
@@ -67,16 +97,13 @@ function toggleRecording() {
         for (i = 0; i < tracks.length; i++) {
             tracks[i].enabled = false;
         }
-        playVideo.controls = true;
-        playVideo.style.display = '';
-        var superBuffer = new Blob(recordedBlobs, {type: 'video/mp4'});
-        playVideo.src = window.URL.createObjectURL(superBuffer);
-        uploadButton.disabled = false;
+        // The preview is shown and the upload enabled by handleStop
     }
 }
 
 function startRecording() {
     recordedBlobs = [];
+    recordedBytes = 0;
     try {
         options = {mimeType: 'video/webm;codecs=h264'};
         mediaRecorder = new MediaRecorder(window.stream, options);
@@ -88,29 +115,180 @@ function startRecording() {
     recordButton.textContent = 'Stop Recording';
     mediaRecorder.onstop = handleStop;
     mediaRecorder.ondataavailable = handleDataAvailable;
+    startStreaming();
     mediaRecorder.start(10); // 10ms blobs of data
     console.log('MediaRecorder started', mediaRecorder);
 }
 
 function stopRecording() {
     mediaRecorder.stop();
-    console.log('Recorded Blobs: ', recordedBlobs);
 }
 
-$("form#video_upload").submit(function() {
-    var formData = new FormData(this);
-    var my_blob = new Blob(recordedBlobs, {type: 'video/mp4'});
-    var my_file = new File([my_blob], 'video.mp4');
-    formData.append('data', my_file);
-    $.ajax({
+// Videos are uploaded in chunks so a dropped connection only costs the
+// chunk in flight. After a failure the upload asks the server how much it
+// has received and resumes from there.
+var CHUNK_SIZE = 1024 * 1024;
+var MAX_RETRIES = 5;
+var RETRY_DELAY = 2000; // ms
+
+function csrfToken() {
+    return $('form#video_upload input[name=csrfmiddlewaretoken]').val();
+}
+
+function startUpload() {
+    return $.ajax({
+        type: 'POST',
+        url: '/memocha/patient/upload/',
+        data: new FormData($('form#video_upload')[0]),
+        processData: false,
+        contentType: false
+    });
+}
+
+function finishUpload(session) {
+    return $.ajax({
+        type: 'POST',
+        url: '/memocha/patient/upload/' + session.id + '/finish/',
+        headers: {'X-CSRFToken': csrfToken()}
+    });
+}
+
+function discardUpload(session) {
+    return $.ajax({
+        type: 'DELETE',
+        url: '/memocha/patient/upload/' + session.id + '/',
+        headers: {'X-CSRFToken': csrfToken()}
+    });
+}
+
+// Sends blob to the session, where the blob's first byte belongs at
+// offset start of the uploaded file.
+function appendBlob(session, blob, start, retries) {
+    var position = session.offset - start;
+    if (position >= blob.size) {
+        return $.Deferred().resolve(session).promise();
+    }
+    var chunk = blob.slice(position, position + CHUNK_SIZE);
+    return $.ajax({
         type: 'POST',
-        url: '/memocha/patient/record',
-        data: formData,
+        url: '/memocha/patient/upload/' + session.id + '/?offset=' + session.offset,
+        data: chunk,
         processData: false,
-        contentType: false,
-        success: function() {
-            window.location.href = '/memocha/patient';
+        contentType: 'application/octet-stream',
+        headers: {'X-CSRFToken': csrfToken()}
+    }).then(function(data) {
+        session.offset = data.offset;
+        return appendBlob(session, blob, start, MAX_RETRIES);
+    }, function(xhr) {
+        if (retries <= 0) {
+            return $.Deferred().reject(xhr);
+        }
+        return resumeBlob(session, blob, start, retries - 1);
+    });
+}
+
+function resumeBlob(session, blob, start, retries) {
+    var deferred = $.Deferred();
+    setTimeout(function() {
+        $.getJSON('/memocha/patient/upload/' + session.id + '/').then(function(data) {
+            session.offset = data.offset;
+            return appendBlob(session, blob, start, retries);
+        }, function() {
+            if (retries <= 0) {
+                return $.Deferred().reject();
+            }
+            return resumeBlob(session, blob, start, retries - 1);
+        }).then(deferred.resolve, deferred.reject);
+    }, RETRY_DELAY);
+    return deferred.promise();
+}
+
+// While recording, the data is streamed to an upload session in batches
+// so that submitting only has to finish the session. The batches are
+// chained so they are sent one at a time and in order, and a batch is let
+// go of as soon as it has been handed to the chain. If streaming fails the
+// whole recording is uploaded again on submit, as long as it was short
+// enough to keep a copy of, see MAX_LOCAL_BYTES.
+var STREAM_BATCH_SIZE = 256 * 1024;
+var STREAM_INTERVAL = 1000; // ms
+
+var streamChain = null;
+var streamQueue = [];
+var streamQueuedBytes = 0;
+var streamSentBytes = 0;
+var streamTimer = null;
+
+function startStreaming() {
+    if (streamChain !== null) {
+        // The previous recording is being thrown away
+        streamChain.then(discardUpload);
+    }
+    streamQueue = [];
+    streamQueuedBytes = 0;
+    streamSentBytes = 0;
+    streamChain = startUpload();
+    streamTimer = setInterval(flushStream, STREAM_INTERVAL);
+}
+
+function queueStreamData(data) {
+    streamQueue.push(data);
+    streamQueuedBytes += data.size;
+    if (streamQueuedBytes >= STREAM_BATCH_SIZE) {
+        flushStream();
+    }
+}
+
+function flushStream() {
+    if (streamQueue.length === 0) {
+        return;
+    }
+    var batch = new Blob(streamQueue);
+    var start = streamSentBytes;
+    streamSentBytes += batch.size;
+    streamQueue = [];
+    streamQueuedBytes = 0;
+    streamChain = streamChain.then(function(session) {
+        return appendBlob(session, batch, start, MAX_RETRIES).then(function() {
+            return session;
+        });
+    });
+}
+
+function stopStreaming() {
+    clearInterval(streamTimer);
+    flushStream();
+}
+
+$("form#video_upload").submit(function() {
+    uploadButton.disabled = true;
+    recordButton.disabled = true;
+    var streamed = streamChain;
+    streamChain = null;
+    var recordAgain = false;
+    streamed.then(finishUpload, function() {
+        if (recordedBlobs === null) {
+            recordAgain = true;
+            return $.Deferred().reject().promise();
+        }
+        // Streaming failed part way, so send the whole recording instead
+        var my_blob = new Blob(recordedBlobs, {type: 'video/mp4'});
+        return startUpload().then(function(session) {
+            return appendBlob(session, my_blob, 0, MAX_RETRIES).then(function() {
+                return finishUpload(session);
+            });
+        });
+    }).then(function() {
+        window.location.href = '/memocha/patient';
+    }, function() {
+        console.error('Video upload failed');
+        streamChain = $.Deferred().reject().promise();
+        recordButton.disabled = false;
+        if (recordAgain) {
+            recordMessage.textContent = 'The upload failed and this recording was too long to keep. ' +
+                'Please record the video again.';
+        } else {
+            uploadButton.disabled = false;
         }
     });
     return false;
-});
\ No newline at end of file
+});
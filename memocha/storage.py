@@ -0,0 +1,65 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage that names files after a hash of their contents.
+
+    A file saved as ``videos/video.mp4`` is stored as
+    ``videos/ab/cd/abcd....mp4``, where ``abcd...`` is the SHA-256 of the
+    contents. The nested directories keep any one directory from growing
+    too large, and saving the same contents twice returns the name of the
+    file that is already there instead of storing a second copy. Since
+    files can be shared, they are not deleted along with their videos but
+    by the collect_garbage command once nothing refers to them any more.
+    """
+    # How many levels of directories files are sharded into, and how many
+    # characters of the hash name each level
+    depth = 2
+    width = 2
+
+    def get_available_name(self, name, max_length=None):
+        # The name is only decided once the contents have been hashed
+        return name
+
+    def _save(self, name, content):
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1]
+        staging = self.path(directory)
+        os.makedirs(staging, exist_ok=True)
+
+        # Hash the contents while writing them to a temporary file next to
+        # their final location, so the upload is only read once
+        digest = hashlib.sha256()
+        fd, temporary_path = tempfile.mkstemp(dir=staging, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as temporary_file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temporary_file.write(chunk)
+            digest = digest.hexdigest()
+            shards = [digest[i * self.width:(i + 1) * self.width] for i in range(self.depth)]
+            name = '/'.join([directory] + shards + [digest + extension]).lstrip('/')
+
+            full_path = self.path(name)
+            if os.path.exists(full_path):
+                # Identical contents are already stored. Touch the file so
+                # the collect_garbage command leaves it alone until the new
+                # video referring to it has been saved.
+                os.remove(temporary_path)
+                os.utime(full_path)
+            else:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                # mkstemp makes the file readable by its owner only
+                os.chmod(temporary_path, self.file_permissions_mode or 0o644)
+                os.rename(temporary_path, full_path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        return name
@@ -2,15 +2,31 @@
 In the interest of my own time, this is a subset
 of the tests I would write for production code.
 """
-from datetime import time, datetime
+import hashlib
+import json
+import os
+from datetime import time, datetime, timedelta
+from io import StringIO
+from unittest.mock import patch
 from freezegun import freeze_time
 
-from django.test import TransactionTestCase, Client
+from django.db import connection
+from django.conf import settings
+from django.test import SimpleTestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from django.contrib.auth.models import User, Group
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth.hashers import make_password
-from memocha.models import Doctor, Prescription, Patient, Video
+from django.core.management import call_command
+from memocha.benchmark import BENCHMARKS, compare
+from memocha.jobs import HANDLERS
+from memocha.middleware import get_role
+from memocha.perf import fingerprint
+from memocha.reminders import Dose, ScheduleWheel
+from memocha.models import (
+    Adherence, Doctor, Job, MissedDose, Prescription, Patient, UploadSession, Video, VIDEO_JOB_KINDS
+)
 
 
 class VideoTestCase(TransactionTestCase):
@@ -55,7 +71,7 @@ class VideoTestCase(TransactionTestCase):
 
         # Make a video
         self.my_file = SimpleUploadedFile('test.txt', b'test contents')
-        video = Video.objects.create(
+        self.video = Video.objects.create(
             person=patient,
             record_date=current_datetime,
             prescription=prescription,
@@ -63,7 +79,8 @@ class VideoTestCase(TransactionTestCase):
         )
 
     def tearDown(self):
-        Video.objects.get(pk=1).upload.delete()
+        for video in Video.objects.all():
+            video.upload.delete()
 
     def test_date_and_time_details(self):
         """
@@ -72,7 +89,7 @@ class VideoTestCase(TransactionTestCase):
         prescription = Prescription.objects.get(medication='test')
         current_datetime = timezone.localtime()
 
-        video = Video.objects.get(pk=1)
+        video = self.video
 
         expected_date = current_datetime.date().strftime('%d %b')
         expected_time = prescription.dosage_times[0].strftime('%H:%M')
@@ -81,9 +98,1020 @@ class VideoTestCase(TransactionTestCase):
         self.assertEqual(dosage['medication'], 'test')
         self.assertEqual(dosage['date'], expected_date)
         self.assertEqual(dosage['timeslot'], expected_time)
-        self.assertEqual(dosage['url'], '/media/videos/test.txt')
+        digest = hashlib.sha256(b'test contents').hexdigest()
+        expected_url = '/media/videos/{0}/{1}/{2}.txt'.format(digest[:2], digest[2:4], digest)
+        self.assertEqual(dosage['url'], expected_url)
         self.assertEqual(dosage['approved'], None)
 
+    def test_identical_uploads_share_a_file(self):
+        """
+        Tests that identical uploads are stored once and that the file is
+        only collected once the last video using it is gone.
+        """
+        video = self.video
+        duplicate = Video.objects.create(
+            person=video.person,
+            record_date=video.record_date,
+            prescription=video.prescription,
+            upload=SimpleUploadedFile('other.txt', b'test contents'),
+        )
+        self.assertEqual(duplicate.upload.name, video.upload.name)
+
+        duplicate.delete()
+        call_command('collect_garbage', grace=0, stdout=StringIO())
+        self.assertTrue(video.upload.storage.exists(video.upload.name))
+
+        video.delete()
+        call_command('collect_garbage', grace=0, stdout=StringIO())
+        self.assertFalse(video.upload.storage.exists(video.upload.name))
+
+    def test_timeslot_kept_after_prescription_edit(self):
+        """
+        Tests that editing the prescription's times does not move a video
+        recorded before the edit to a different timeslot.
+        """
+        prescription = Prescription.objects.get(medication='test')
+        expected_time = prescription.dosage_times[0].strftime('%H:%M')
+
+        prescription.dosage_times = [time(hour=0), time(hour=12)]
+        prescription.save()
+
+        dosage = Video.objects.get(pk=self.video.pk).corresponding_dosage()
+        self.assertEqual(dosage['timeslot'], expected_time)
+
+
+class VideoQueryCountTestCase(TransactionTestCase):
+    """Tests that serializing videos does not cost a query per video."""
+
+    def setUp(self):
+        self.client = Client()
+        current_datetime = timezone.localtime()
+
+        # Make the doctor and patient groups
+        doctor_group = Group.objects.create(name='Doctors')
+        patient_group = Group.objects.create(name='Patients')
+
+        # Make a doctor
+        doctor_user = User.objects.create_user(
+            'Doctor',
+            'doctor@example.com',
+            'doctorpassword'
+        )
+        doctor_user.groups.add(doctor_group)
+        doctor = Doctor.objects.create(
+            user=doctor_user
+        )
+
+        # Make a patient
+        patient_user = User.objects.create_user(
+            'Patient',
+            'patient@example.com',
+            'patientpassword'
+        )
+        patient_user.groups.add(patient_group)
+        self.patient = Patient.objects.create(
+            user=patient_user,
+            doctor=doctor,
+            date_of_birth=current_datetime.date(),
+        )
+
+        # Make a prescription
+        self.prescription = Prescription.objects.create(
+            medication='test',
+            dosage=1,
+            dosage_times=[time(hour=9), time(hour=21)]
+        )
+        self.patient.prescriptions.add(self.prescription)
+
+        self.make_videos(2)
+
+    def tearDown(self):
+        for video in Video.objects.all():
+            video.upload.delete()
+
+    def make_videos(self, count):
+        for _ in range(count):
+            Video.objects.create(
+                person=self.patient,
+                record_date=timezone.localtime(),
+                prescription=self.prescription,
+                upload=SimpleUploadedFile('test.txt', b'test contents'),
+            )
+
+    def count_queries(self, path):
+        # Warm up the per-patient caches so both counts are comparable
+        self.client.get(path)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def test_dosages_single_query(self):
+        """All of a patient's videos should be serialized with one query."""
+        self.make_videos(10)
+        with self.assertNumQueries(1):
+            dosages = self.patient.video_set.dosages()
+        self.assertEqual(len(dosages), 12)
+
+    def test_patient_dashboard_query_count(self):
+        """The patient dashboard should not issue a query per video."""
+        self.client.login(username='Patient', password='patientpassword')
+        expected = self.count_queries('/memocha/patient/')
+        self.make_videos(10)
+        self.assertEqual(self.count_queries('/memocha/patient/'), expected)
+
+    def test_patient_details_query_count(self):
+        """The patient details page should not issue a query per video."""
+        self.client.login(username='Doctor', password='doctorpassword')
+        path = '/memocha/doctor/{0}/'.format(self.patient.pk)
+        expected = self.count_queries(path)
+        self.make_videos(10)
+        self.assertEqual(self.count_queries(path), expected)
+
+    def test_delete_query_count(self):
+        """Deleting a prescription should not issue queries per video."""
+        def delete_queries(videos):
+            self.prescription = Prescription.objects.create(
+                medication='other', dosage=1, dosage_times=[time(hour=9)]
+            )
+            self.patient.prescriptions.add(self.prescription)
+            self.make_videos(videos)
+            with CaptureQueriesContext(connection) as context:
+                self.prescription.delete()
+            return len(context)
+        self.assertEqual(delete_queries(12), delete_queries(2))
+
+
+class PatientDataApiTestCase(TransactionTestCase):
+    """Tests the conditional GETs of the patients' JSON datasets."""
+
+    def setUp(self):
+        self.client = Client()
+        current_datetime = timezone.localtime()
+
+        # Make the doctor and patient groups
+        doctor_group = Group.objects.create(name='Doctors')
+        patient_group = Group.objects.create(name='Patients')
+
+        # Make a doctor
+        doctor_user = User.objects.create_user(
+            'Doctor',
+            'doctor@example.com',
+            'doctorpassword'
+        )
+        doctor_user.groups.add(doctor_group)
+        doctor = Doctor.objects.create(
+            user=doctor_user
+        )
+
+        # Make a patient
+        patient_user = User.objects.create_user(
+            'Patient',
+            'patient@example.com',
+            'patientpassword'
+        )
+        patient_user.groups.add(patient_group)
+        self.patient = Patient.objects.create(
+            user=patient_user,
+            doctor=doctor,
+            date_of_birth=current_datetime.date(),
+        )
+
+        # Make a prescription
+        self.prescription = Prescription.objects.create(
+            medication='test',
+            dosage=1,
+            dosage_times=[time(hour=9), time(hour=21)]
+        )
+        self.patient.prescriptions.add(self.prescription)
+        self.path = '/memocha/api/v1/patients/{0}/pending/'.format(self.patient.pk)
+
+    def tearDown(self):
+        for video in Video.objects.all():
+            video.upload.delete()
+
+    def make_video(self):
+        return Video.objects.create(
+            person=self.patient,
+            record_date=timezone.localtime(),
+            prescription=self.prescription,
+            upload=SimpleUploadedFile('test.txt', b'test contents'),
+        )
+
+    def test_not_modified_until_videos_change(self):
+        """Unchanged data should be answered with a 304, changed data with the new data."""
+        self.client.login(username='Doctor', password='doctorpassword')
+        response = self.client.get(self.path)
+        self.assertEqual(response.json(), {'videos': []})
+        etag = response['ETag']
+
+        response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        video = self.make_video()
+        response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json()['videos']], [video.pk])
+        etag = response['ETag']
+
+        # Reviews are applied with update(), which sends no signals
+        self.client.post(
+            '/memocha/doctor/review/',
+            data=json.dumps({'approve': [video.pk]}),
+            content_type='application/json'
+        )
+        response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.json(), {'videos': []})
+
+    def test_prescriptions_fragment_invalidated(self):
+        """The cached prescriptions on the patient dashboard should follow edits."""
+        self.client.login(username='Patient', password='patientpassword')
+        self.assertContains(self.client.get('/memocha/patient/'), 'test: Take 1 at 09:00, 21:00')
+
+        self.prescription.dosage_times = [time(hour=8)]
+        self.prescription.save()
+        self.assertContains(self.client.get('/memocha/patient/'), 'test: Take 1 at 08:00')
+
+    def test_other_patients_data(self):
+        """Patients should only get their own data."""
+        other_user = User.objects.create_user(
+            'Other',
+            'other@example.com',
+            'otherpassword'
+        )
+        other_user.groups.add(Group.objects.get(name='Patients'))
+        Patient.objects.create(
+            user=other_user,
+            doctor=self.patient.doctor,
+            date_of_birth=self.patient.date_of_birth,
+        )
+        self.client.login(username='Other', password='otherpassword')
+        response = self.client.get('/memocha/api/v1/patients/{0}/prescriptions/'.format(self.patient.pk))
+        self.assertEqual(response.status_code, 404)
+
+        self.client.login(username='Patient', password='patientpassword')
+        response = self.client.get('/memocha/api/v1/patients/{0}/prescriptions/'.format(self.patient.pk))
+        self.assertEqual(response.json()['prescriptions'], [
+            [self.prescription.pk, 'test', '1', ['09:00:00', '21:00:00']]
+        ])
+
+
+class PatientCalendarTestCase(TransactionTestCase):
+    """Tests the windowed video calendar served to doctors."""
+
+    def setUp(self):
+        self.client = Client()
+        current_datetime = timezone.localtime()
+
+        # Make the doctor and patient groups
+        doctor_group = Group.objects.create(name='Doctors')
+        patient_group = Group.objects.create(name='Patients')
+
+        # Make a doctor
+        doctor_user = User.objects.create_user(
+            'Doctor',
+            'doctor@example.com',
+            'doctorpassword'
+        )
+        doctor_user.groups.add(doctor_group)
+        doctor = Doctor.objects.create(
+            user=doctor_user
+        )
+
+        # Make a patient who joined 60 days ago
+        patient_user = User.objects.create_user(
+            'Patient',
+            'patient@example.com',
+            'patientpassword'
+        )
+        patient_user.date_joined = current_datetime - timedelta(days=60)
+        patient_user.save()
+        patient_user.groups.add(patient_group)
+        self.patient = Patient.objects.create(
+            user=patient_user,
+            doctor=doctor,
+            date_of_birth=current_datetime.date(),
+        )
+
+        # Make a prescription
+        prescription = Prescription.objects.create(
+            medication='test',
+            dosage=1,
+            dosage_times=[current_datetime,]
+        )
+        self.patient.prescriptions.add(prescription)
+
+        # Make a video for today and one for 40 days ago
+        for days_ago in [0, 40]:
+            Video.objects.create(
+                person=self.patient,
+                record_date=current_datetime - timedelta(days=days_ago),
+                prescription=prescription,
+                upload=SimpleUploadedFile('test.txt', b'test contents'),
+            )
+
+        self.client.login(username='Doctor', password='doctorpassword')
+        self.path = '/memocha/doctor/{0}/calendar/'.format(self.patient.pk)
+
+    def tearDown(self):
+        for video in Video.objects.all():
+            video.upload.delete()
+
+    def test_windows_cover_history(self):
+        """Each window should pick up where the previous one stopped."""
+        today = timezone.localtime().date()
+
+        response = self.client.get(self.path)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data['dates']), 28)
+        self.assertEqual(data['dates'][0]['day'], today.isoformat())
+        self.assertEqual(len(data['videos']), 1)
+        self.assertEqual(data['before'], (today - timedelta(days=27)).isoformat())
+
+        data = self.client.get(self.path, {'before': data['before']}).json()
+        self.assertEqual(len(data['dates']), 28)
+        self.assertEqual(len(data['videos']), 1)
+        self.assertEqual(data['videos'][0]['day'], (today - timedelta(days=40)).isoformat())
+
+        data = self.client.get(self.path, {'before': data['before']}).json()
+        self.assertEqual(data['dates'][-1]['day'], (today - timedelta(days=60)).isoformat())
+        self.assertEqual(data['videos'], [])
+        self.assertIsNone(data['before'])
+
+    def test_window_cached_until_videos_change(self):
+        """A window should be served from the cache until the patient's videos change."""
+        self.client.get(self.path)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(self.path)
+        self.assertFalse(any('memocha_video' in query['sql'] for query in context.captured_queries))
+
+        Video.objects.create(
+            person=self.patient,
+            record_date=timezone.localtime(),
+            prescription=Prescription.objects.get(medication='test'),
+            upload=SimpleUploadedFile('other.txt', b'other contents'),
+        )
+        self.assertEqual(len(self.client.get(self.path).json()['videos']), 2)
+
+    def test_other_doctors_patient(self):
+        """Doctors should not see the calendars of other doctors' patients."""
+        other_user = User.objects.create_user(
+            'Other',
+            'other@example.com',
+            'otherpassword'
+        )
+        other_user.groups.add(Group.objects.get(name='Doctors'))
+        Doctor.objects.create(user=other_user)
+        self.client.login(username='Other', password='otherpassword')
+        response = self.client.get(self.path)
+        self.assertEqual(response.status_code, 404)
+
+
+class ChunkedUploadTestCase(TransactionTestCase):
+    """Tests uploading a video in chunks."""
+
+    def setUp(self):
+        self.client = Client()
+        current_datetime = timezone.localtime()
+
+        # Make the doctor and patient groups
+        doctor_group = Group.objects.create(name='Doctors')
+        patient_group = Group.objects.create(name='Patients')
+
+        # Make a doctor
+        doctor_user = User.objects.create_user(
+            'Doctor',
+            'doctor@example.com',
+            'doctorpassword'
+        )
+        doctor_user.groups.add(doctor_group)
+        doctor = Doctor.objects.create(
+            user=doctor_user
+        )
+
+        # Make a patient
+        patient_user = User.objects.create_user(
+            'Patient',
+            'patient@example.com',
+            'patientpassword'
+        )
+        patient_user.groups.add(patient_group)
+        patient = Patient.objects.create(
+            user=patient_user,
+            doctor=doctor,
+            date_of_birth=current_datetime.date(),
+        )
+
+        # Make a prescription
+        prescription = Prescription.objects.create(
+            medication='test',
+            dosage=1,
+            dosage_times=[current_datetime,]
+        )
+        patient.prescriptions.add(prescription)
+
+        self.client.login(username='Patient', password='patientpassword')
+
+    def tearDown(self):
+        for video in Video.objects.all():
+            video.upload.delete()
+        for session in UploadSession.objects.all():
+            session.discard()
+
+    def send_chunk(self, session_id, offset, data):
+        return self.client.post(
+            '/memocha/patient/upload/{0}/?offset={1}'.format(session_id, offset),
+            data=data,
+            content_type='application/octet-stream'
+        )
+
+    def test_resumed_upload(self):
+        """
+        A chunk that doesn't start at the received offset should be refused,
+        and the upload should resume from the offset the server reports.
+        """
+        response = self.client.post('/memocha/patient/upload/', {'medication': 'test'})
+        self.assertEqual(response.status_code, 201)
+        session_id = response.json()['id']
+
+        response = self.send_chunk(session_id, 0, b'test ')
+        self.assertEqual(response.json()['offset'], 5)
+
+        # The client lost track of the last chunk and sent it from the wrong place
+        response = self.send_chunk(session_id, 10, b'contents')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 5)
+
+        response = self.client.get('/memocha/patient/upload/{0}/'.format(session_id))
+        offset = response.json()['offset']
+        response = self.send_chunk(session_id, offset, b'contents')
+        self.assertEqual(response.json()['offset'], 13)
+
+        response = self.client.post('/memocha/patient/upload/{0}/finish/'.format(session_id))
+        self.assertEqual(response.status_code, 201)
+        video = Video.objects.get(pk=response.json()['video'])
+        self.assertEqual(video.prescription.medication, 'test')
+        video.upload.open('rb')
+        self.assertEqual(video.upload.read(), b'test contents')
+        video.upload.close()
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_cut_off_chunk_dropped(self):
+        """
+        The bytes of a chunk that was cut off before its offset was recorded
+        should be overwritten by the resumed upload.
+        """
+        response = self.client.post('/memocha/patient/upload/', {'medication': 'test'})
+        session_id = response.json()['id']
+        self.send_chunk(session_id, 0, b'test ')
+
+        # Part of the next chunk reached the file but not the session
+        session = UploadSession.objects.get(pk=session_id)
+        with open(session.path, 'ab') as partial:
+            partial.write(b'conten')
+
+        response = self.send_chunk(session_id, 5, b'contents')
+        self.assertEqual(response.json()['offset'], 13)
+        self.assertEqual(os.path.getsize(session.path), 13)
+
+        response = self.client.post('/memocha/patient/upload/{0}/finish/'.format(session_id))
+        video = Video.objects.get(pk=response.json()['video'])
+        video.upload.open('rb')
+        self.assertEqual(video.upload.read(), b'test contents')
+        video.upload.close()
+
+    def test_discarded_session(self):
+        """A discarded session should be gone along with its partial file."""
+        response = self.client.post('/memocha/patient/upload/', {'medication': 'test'})
+        session_id = response.json()['id']
+        self.send_chunk(session_id, 0, b'test contents')
+        session = UploadSession.objects.get(pk=session_id)
+
+        response = self.client.delete('/memocha/patient/upload/{0}/'.format(session_id))
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(session.path))
+
+    def test_empty_session_not_finished(self):
+        """Finishing a session nothing has been uploaded to should be refused."""
+        response = self.client.post('/memocha/patient/upload/', {'medication': 'test'})
+        session_id = response.json()['id']
+        response = self.client.post('/memocha/patient/upload/{0}/finish/'.format(session_id))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Video.objects.exists())
+
+    def test_partial_file_deleted_with_patient(self):
+        """Deleting a patient should remove their sessions' partial files."""
+        response = self.client.post('/memocha/patient/upload/', {'medication': 'test'})
+        self.send_chunk(response.json()['id'], 0, b'test contents')
+        session = UploadSession.objects.get()
+        Patient.objects.all().delete()
+        self.assertFalse(os.path.exists(session.path))
+
+    def test_expired_sessions(self):
+        """Sessions that stopped receiving chunks should be discarded."""
+        response = self.client.post('/memocha/patient/upload/', {'medication': 'test'})
+        session_id = response.json()['id']
+        self.send_chunk(session_id, 0, b'test contents')
+        session = UploadSession.objects.get(pk=session_id)
+        self.assertTrue(os.path.exists(session.path))
+
+        UploadSession.objects.update(updated=timezone.now() - timedelta(days=2))
+        call_command('expire_uploads', stdout=StringIO())
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(session.path))
+
+
+class MediaServingTestCase(TransactionTestCase):
+    """Tests serving uploaded videos."""
+
+    def setUp(self):
+        self.client = Client()
+        current_datetime = timezone.localtime()
+
+        # Make the doctor and patient groups
+        doctor_group = Group.objects.create(name='Doctors')
+        patient_group = Group.objects.create(name='Patients')
+
+        # Make two doctors
+        for name in ['Doctor', 'Other']:
+            doctor_user = User.objects.create_user(
+                name,
+                '{0}@example.com'.format(name),
+                'doctorpassword'
+            )
+            doctor_user.groups.add(doctor_group)
+            Doctor.objects.create(
+                user=doctor_user
+            )
+
+        # Make a patient
+        patient_user = User.objects.create_user(
+            'Patient',
+            'patient@example.com',
+            'patientpassword'
+        )
+        patient_user.groups.add(patient_group)
+        patient = Patient.objects.create(
+            user=patient_user,
+            doctor=Doctor.objects.get(user__username='Doctor'),
+            date_of_birth=current_datetime.date(),
+        )
+
+        # Make a prescription
+        prescription = Prescription.objects.create(
+            medication='test',
+            dosage=1,
+            dosage_times=[current_datetime,]
+        )
+        patient.prescriptions.add(prescription)
+
+        # Make a video
+        self.video = Video.objects.create(
+            person=patient,
+            record_date=current_datetime,
+            prescription=prescription,
+            upload=SimpleUploadedFile('test.txt', b'test contents'),
+        )
+
+    def tearDown(self):
+        self.video.upload.delete()
+
+    def test_range_request(self):
+        """A byte range should be answered with just those bytes."""
+        self.client.login(username='Patient', password='patientpassword')
+        response = self.client.get(self.video.upload.url, HTTP_RANGE='bytes=5-12')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 5-12/13')
+        self.assertEqual(b''.join(response.streaming_content), b'contents')
+
+        response = self.client.get(self.video.upload.url, HTTP_RANGE='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_not_modified(self):
+        """A request with a matching ETag should get a 304."""
+        self.client.login(username='Doctor', password='doctorpassword')
+        response = self.client.get(self.video.upload.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'test contents')
+
+        response = self.client.get(self.video.upload.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_other_doctor(self):
+        """Doctors should not be able to watch other doctors' patients."""
+        self.client.login(username='Other', password='doctorpassword')
+        response = self.client.get(self.video.upload.url)
+        self.assertEqual(response.status_code, 404)
+
+
+class JobTestCase(TransactionTestCase):
+    """Tests claiming and retrying background jobs."""
+
+    def setUp(self):
+        current_datetime = timezone.localtime()
+
+        # Make a doctor
+        doctor_user = User.objects.create_user(
+            'Doctor',
+            'doctor@example.com',
+            'doctorpassword'
+        )
+        doctor = Doctor.objects.create(
+            user=doctor_user
+        )
+
+        # Make a patient
+        patient_user = User.objects.create_user(
+            'Patient',
+            'patient@example.com',
+            'patientpassword'
+        )
+        patient = Patient.objects.create(
+            user=patient_user,
+            doctor=doctor,
+            date_of_birth=current_datetime.date(),
+        )
+
+        # Make a prescription
+        prescription = Prescription.objects.create(
+            medication='test',
+            dosage=1,
+            dosage_times=[current_datetime,]
+        )
+        patient.prescriptions.add(prescription)
+
+        # Make a video, which queues its jobs
+        self.video = Video.objects.create(
+            person=patient,
+            record_date=current_datetime,
+            prescription=prescription,
+            upload=SimpleUploadedFile('test.txt', b'test contents'),
+        )
+
+    def tearDown(self):
+        self.video.upload.delete()
+
+    def test_jobs_queued_for_new_videos(self):
+        """Saving a new video should queue one job of each kind."""
+        self.assertEqual(
+            sorted(self.video.job_set.values_list('kind', flat=True)),
+            sorted(VIDEO_JOB_KINDS)
+        )
+        self.video.approved = True
+        self.video.save()
+        self.assertEqual(self.video.job_set.count(), len(VIDEO_JOB_KINDS))
+
+    def test_failed_job_retried(self):
+        """A failed job should be retried once its retry delay is over."""
+        calls = []
+
+        def flaky(video):
+            calls.append(video.pk)
+            if len(calls) == 1:
+                raise ValueError('first attempt fails')
+
+        with patch.dict(HANDLERS, {kind: flaky for kind in VIDEO_JOB_KINDS}):
+            jobs = Job.claim(limit=len(VIDEO_JOB_KINDS))
+            self.assertEqual(len(jobs), len(VIDEO_JOB_KINDS))
+            self.assertEqual(Job.claim(), [])
+
+            job = jobs[0]
+            self.assertFalse(job.run())
+            job.refresh_from_db()
+            self.assertEqual(job.status, Job.PENDING)
+            self.assertIn('first attempt fails', job.last_error)
+            self.assertEqual(Job.claim(), [])
+
+            Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+            retried, = Job.claim()
+            self.assertEqual(retried.pk, job.pk)
+            self.assertEqual(retried.attempts, 2)
+            self.assertTrue(retried.run())
+            retried.refresh_from_db()
+            self.assertEqual(retried.status, Job.DONE)
+
+    def test_visibility_timeout(self):
+        """A job whose worker didn't finish in time should be claimable again."""
+        jobs = Job.claim(limit=len(VIDEO_JOB_KINDS))
+        self.assertEqual(Job.claim(), [])
+        Job.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(len(Job.claim(limit=len(VIDEO_JOB_KINDS))), len(jobs))
+
+
+class BulkReviewTestCase(TransactionTestCase):
+    """Tests approving and disapproving videos in batches."""
+
+    def setUp(self):
+        self.client = Client()
+        current_datetime = timezone.localtime()
+
+        # Make the doctor and patient groups
+        doctor_group = Group.objects.create(name='Doctors')
+        patient_group = Group.objects.create(name='Patients')
+
+        # Make two doctors
+        for name in ['Doctor', 'Other']:
+            doctor_user = User.objects.create_user(
+                name,
+                '{0}@example.com'.format(name),
+                'doctorpassword'
+            )
+            doctor_user.groups.add(doctor_group)
+            Doctor.objects.create(
+                user=doctor_user
+            )
+
+        # Make a patient
+        patient_user = User.objects.create_user(
+            'Patient',
+            'patient@example.com',
+            'patientpassword'
+        )
+        patient_user.groups.add(patient_group)
+        patient = Patient.objects.create(
+            user=patient_user,
+            doctor=Doctor.objects.get(user__username='Doctor'),
+            date_of_birth=current_datetime.date(),
+        )
+
+        # Make a prescription
+        prescription = Prescription.objects.create(
+            medication='test',
+            dosage=1,
+            dosage_times=[current_datetime,]
+        )
+        patient.prescriptions.add(prescription)
+
+        # Make some videos
+        self.videos = [
+            Video.objects.create(
+                person=patient,
+                record_date=current_datetime,
+                prescription=prescription,
+                upload=SimpleUploadedFile('test.txt', b'test contents'),
+            )
+            for _ in range(3)
+        ]
+
+    def tearDown(self):
+        for video in Video.objects.all():
+            video.upload.delete()
+
+    def review(self, approve, disapprove):
+        return self.client.post(
+            '/memocha/doctor/review/',
+            data=json.dumps({'approve': approve, 'disapprove': disapprove}),
+            content_type='application/json'
+        )
+
+    def test_batch_review(self):
+        """All the decisions in a batch should be applied."""
+        self.client.login(username='Doctor', password='doctorpassword')
+        response = self.review(
+            [self.videos[0].pk, self.videos[1].pk],
+            [self.videos[2].pk]
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'approved': 2, 'disapproved': 1})
+        self.assertEqual(
+            [video.approved for video in Video.objects.order_by('pk')],
+            [True, True, False]
+        )
+
+    def test_other_doctors_patients_untouched(self):
+        """Doctors should not be able to review other doctors' patients."""
+        self.client.login(username='Other', password='doctorpassword')
+        response = self.review([self.videos[0].pk], [self.videos[1].pk])
+        self.assertEqual(response.json(), {'approved': 0, 'disapproved': 0})
+        self.assertFalse(Video.objects.exclude(approved=None).exists())
+
+    def test_review_queue_pages(self):
+        """
+        The review queue should page through the pending videos oldest
+        first, sending the ones after each page along for preloading.
+        """
+        self.client.login(username='Doctor', password='doctorpassword')
+        Video.objects.filter(pk=self.videos[1].pk).update(approved=True)
+
+        data = self.client.get('/memocha/doctor/queue/items/', {'limit': 1}).json()
+        self.assertEqual([item['id'] for item in data['items']], [self.videos[0].pk])
+        self.assertEqual([item['id'] for item in data['preload']], [self.videos[2].pk])
+        self.assertEqual(data['items'][0]['patient'], str(self.videos[0].person))
+
+        data = self.client.get('/memocha/doctor/queue/items/', {'limit': 1, 'after': data['next']}).json()
+        self.assertEqual([item['id'] for item in data['items']], [self.videos[2].pk])
+        self.assertEqual(data['preload'], [])
+        self.assertIsNone(data['next'])
+
+    def test_conflicting_decisions(self):
+        """A video can't be both approved and disapproved."""
+        self.client.login(username='Doctor', password='doctorpassword')
+        response = self.review([self.videos[0].pk], [self.videos[0].pk])
+        self.assertEqual(response.status_code, 400)
+
+
+class AdherenceTestCase(TransactionTestCase):
+    """Tests that the daily adherence counts follow the videos."""
+
+    def setUp(self):
+        self.client = Client()
+        current_datetime = timezone.localtime()
+
+        # Make a doctor
+        doctor_user = User.objects.create_user(
+            'Doctor',
+            'doctor@example.com',
+            'doctorpassword'
+        )
+        doctor_user.groups.add(Group.objects.create(name='Doctors'))
+        doctor = Doctor.objects.create(
+            user=doctor_user
+        )
+
+        # Make a patient who joined two days ago
+        patient_user = User.objects.create_user(
+            'Patient',
+            'patient@example.com',
+            'patientpassword'
+        )
+        patient_user.date_joined = current_datetime - timedelta(days=2)
+        patient_user.save()
+        self.patient = Patient.objects.create(
+            user=patient_user,
+            doctor=doctor,
+            date_of_birth=current_datetime.date(),
+        )
+
+        # Make a prescription with two doses a day
+        self.prescription = Prescription.objects.create(
+            medication='test',
+            dosage=1,
+            dosage_times=[time(hour=9), time(hour=21)]
+        )
+        self.patient.prescriptions.add(self.prescription)
+        self.today = current_datetime.date()
+
+    def tearDown(self):
+        for video in Video.objects.all():
+            video.upload.delete()
+
+    def counts(self, day):
+        adherence = Adherence.objects.get(patient=self.patient, prescription=self.prescription, day=day)
+        return adherence.prescribed, adherence.recorded, adherence.approved
+
+    def make_video(self, day):
+        return Video.objects.create(
+            person=self.patient,
+            record_date=timezone.make_aware(datetime.combine(day, time(hour=9))),
+            prescription=self.prescription,
+            upload=SimpleUploadedFile('test.txt', b'test contents'),
+        )
+
+    def test_incremental_updates(self):
+        """Saving, reviewing and deleting videos should update the counts."""
+        self.assertEqual(self.counts(self.today), (2, 0, 0))
+
+        video = self.make_video(self.today)
+        self.assertEqual(self.counts(self.today), (2, 1, 0))
+
+        self.client.login(username='Doctor', password='doctorpassword')
+        self.client.post(
+            '/memocha/doctor/review/',
+            data=json.dumps({'approve': [video.pk]}),
+            content_type='application/json'
+        )
+        self.assertEqual(self.counts(self.today), (2, 1, 1))
+
+        self.prescription.dosage_times = [time(hour=9)]
+        self.prescription.save()
+        self.assertEqual(self.counts(self.today), (1, 1, 1))
+
+        video.delete()
+        self.assertEqual(self.counts(self.today), (1, 0, 0))
+
+    def test_rebuild(self):
+        """Rebuilding should add rows for the days nothing was recorded on."""
+        yesterday = self.today - timedelta(days=1)
+        self.make_video(yesterday)
+        Adherence.objects.all().delete()
+
+        call_command('rebuild_adherence', stdout=StringIO())
+        self.assertEqual(Adherence.objects.filter(patient=self.patient).count(), 3)
+        self.assertEqual(self.counts(yesterday), (2, 1, 0))
+        self.assertEqual(self.counts(self.today), (2, 0, 0))
+        self.assertEqual(self.patient.adherence(3), (1, 6))
+
+    def test_rebuild_from_prescription_added(self):
+        """
+        Rebuilding should not count the days before a prescription was added,
+        like the incremental updates.
+        """
+        self.assertEqual(Adherence.objects.filter(patient=self.patient).count(), 1)
+
+        call_command('rebuild_adherence', stdout=StringIO())
+        self.assertEqual(Adherence.objects.filter(patient=self.patient).count(), 1)
+        self.assertEqual(self.counts(self.today), (2, 0, 0))
+        self.assertEqual(self.patient.adherence(3), (0, 2))
+
+
+class DoctorDashboardTestCase(TransactionTestCase):
+    """Tests the per-patient summaries on the doctor dashboard."""
+
+    def setUp(self):
+        self.client = Client()
+        current_datetime = timezone.localtime()
+
+        # Make a doctor
+        doctor_group = Group.objects.create(name='Doctors')
+        doctor_user = User.objects.create_user(
+            'Doctor',
+            'doctor@example.com',
+            'doctorpassword'
+        )
+        doctor_user.groups.add(doctor_group)
+        self.doctor = Doctor.objects.create(
+            user=doctor_user
+        )
+
+        # Make a prescription with two doses a day
+        self.prescription = Prescription.objects.create(
+            medication='test',
+            dosage=1,
+            dosage_times=[time(hour=9), time(hour=21)]
+        )
+        self.patients = [self.make_patient(i, current_datetime.date()) for i in range(3)]
+
+    def tearDown(self):
+        for video in Video.objects.all():
+            video.upload.delete()
+
+    def make_patient(self, number, date_of_birth):
+        patient_user = User.objects.create_user(
+            'Patient{0}'.format(number),
+            'patient{0}@example.com'.format(number),
+            'patientpassword',
+            last_name=str(number)
+        )
+        patient = Patient.objects.create(
+            user=patient_user,
+            doctor=self.doctor,
+            date_of_birth=date_of_birth,
+        )
+        patient.prescriptions.add(self.prescription)
+        return patient
+
+    def make_video(self, patient, hour=9):
+        return Video.objects.create(
+            person=patient,
+            record_date=timezone.make_aware(datetime.combine(timezone.localtime().date(), time(hour=hour))),
+            prescription=self.prescription,
+            upload=SimpleUploadedFile('test.txt', b'test contents'),
+        )
+
+    def test_summaries_single_query(self):
+        """All of the summaries should come from one query."""
+        self.make_video(self.patients[0])
+        with self.assertNumQueries(1):
+            summaries = [
+                (str(patient), patient.pending, patient.last_video is not None, patient.recorded, patient.prescribed)
+                for patient in self.doctor.patient_summaries(7)
+            ]
+        self.assertEqual(summaries, [
+            (' 0', 1, True, 1, 2),
+            (' 1', 0, False, 0, 2),
+            (' 2', 0, False, 0, 2),
+        ])
+
+    def test_dashboard_cache_invalidated(self):
+        """The cached dashboard should be dropped when a patient records a video."""
+        self.client.login(username='Doctor', password='doctorpassword')
+        response = self.client.get('/memocha/doctor/')
+        self.assertEqual([patient['pending'] for patient in response.context['patients']], [0, 0, 0])
+
+        self.make_video(self.patients[1], 9)
+        self.make_video(self.patients[1], 21)
+        response = self.client.get('/memocha/doctor/')
+        self.assertEqual([patient['pending'] for patient in response.context['patients']], [0, 2, 0])
+        self.assertEqual([patient['behind'] for patient in response.context['patients']], [True, False, True])
+
+    def test_missed_doses(self):
+        """Doses whose window closed without a video should be counted as missed until one turns up."""
+        video = self.make_video(self.patients[0], 9)
+        today = timezone.localtime().date()
+        with freeze_time(timezone.now() + timedelta(days=1)):
+            self.assertEqual(MissedDose.detect(today, today), 5)
+            self.assertEqual([patient.missed for patient in self.doctor.patient_summaries(7)], [1, 2, 2])
+            self.assertEqual(
+                MissedDose.objects.get(patient=self.patients[0]).dosage_time, time(hour=21)
+            )
+
+            # Running it again replaces the rows rather than adding to them
+            video.delete()
+            self.assertEqual(MissedDose.detect(today, today), 6)
+            self.assertEqual(MissedDose.objects.count(), 6)
+
 
 class PatientTestCase(TransactionTestCase):
     def setUp(self):
@@ -176,6 +1204,163 @@ class PatientTestCase(TransactionTestCase):
             self.assertEqual(medications, expected_name)
             self.assertEqual(times, expected_time)
 
+    def test_recordable_medications_skips_recorded_doses(self):
+        """
+        Tests that only doses inside the recording window are recordable and
+        that a dose drops out once a video has been recorded for it.
+        """
+        patient = Patient.objects.get(user__username='Patient')
+        prescription = Prescription.objects.get(medication='other_test')
+
+        current_time = timezone.localtime()
+        current_time = current_time.replace(hour=11, minute=20, second=0, microsecond=0)
+        with freeze_time(current_time):
+            medications, times = patient.recordable_medications()
+            self.assertEqual(medications, ['other_test'])
+            self.assertEqual(times, [time(hour=11)])
+
+            video = Video.objects.create(
+                person=patient,
+                record_date=current_time,
+                prescription=prescription,
+                upload=SimpleUploadedFile('test.txt', b'test contents'),
+            )
+            medications, times = patient.recordable_medications()
+            self.assertEqual(medications, [])
+            self.assertEqual(times, [])
+            video.upload.delete()
+
+    def test_schedule_invalidated_by_prescription_changes(self):
+        """
+        Tests that the cached dosage schedule picks up prescriptions
+        added to and edited for the patient.
+        """
+        patient = Patient.objects.get(user__username='Patient')
+
+        current_time = timezone.localtime()
+        current_time = current_time.replace(hour=11, minute=30, second=0, microsecond=0)
+        with freeze_time(current_time):
+            medications, times = patient.next_medication()
+            self.assertEqual(medications, ['test'])
+
+            prescription = Prescription.objects.create(
+                medication='new_test',
+                dosage=1,
+                dosage_times=[time(hour=11, minute=45)]
+            )
+            patient.prescriptions.add(prescription)
+            medications, times = patient.next_medication()
+            self.assertEqual(medications, ['new_test'])
+            self.assertEqual(times, time(hour=11, minute=45))
+
+            prescription.dosage_times = [time(hour=12)]
+            prescription.save()
+            medications, times = patient.next_medication()
+            self.assertEqual(sorted(medications), ['new_test', 'test'])
+            self.assertEqual(times, time(hour=12))
+
+    def test_sync_prescriptions(self):
+        """
+        Tests that syncing keeps matching prescriptions, adds new ones and
+        leaves the removed prescriptions for the garbage collector.
+        """
+        patient = Patient.objects.get(user__username='Patient')
+        kept = patient.prescriptions.get(medication='test')
+        removed = patient.prescriptions.get(medication='other_test')
+        entries = [
+            {'medication': 'test', 'dosage': '1', 'dosage_times': [time(hour=9), time(hour=12), time(hour=22)]},
+            {'medication': 'new_test', 'dosage': '2', 'dosage_times': [time(hour=8)]},
+        ]
+        # Submitting the current prescriptions unchanged only reads them
+        unchanged = [
+            {'medication': prescription.medication, 'dosage': prescription.dosage,
+             'dosage_times': prescription.dosage_times}
+            for prescription in patient.prescriptions.all()
+        ]
+        with self.assertNumQueries(1):
+            self.assertEqual(patient.sync_prescriptions(unchanged), ([], []))
+
+        added, removed_prescriptions = patient.sync_prescriptions(entries)
+        self.assertEqual([prescription.medication for prescription in added], ['new_test'])
+        self.assertEqual(removed_prescriptions, [removed])
+        self.assertEqual(
+            sorted(patient.prescriptions.values_list('medication', flat=True)),
+            ['new_test', 'test']
+        )
+        self.assertTrue(Prescription.objects.filter(pk=removed.pk).exists())
+
+        call_command('collect_garbage', stdout=StringIO())
+        self.assertTrue(Prescription.objects.filter(pk=kept.pk).exists())
+        self.assertFalse(Prescription.objects.filter(pk=removed.pk).exists())
+
+
+class RoleTestCase(TransactionTestCase):
+    """Tests resolving the logged in user's role and profile."""
+
+    def setUp(self):
+        self.client = Client()
+
+        # Make the doctor and patient groups
+        self.doctor_group = Group.objects.create(name='Doctors')
+        patient_group = Group.objects.create(name='Patients')
+
+        # Make a doctor
+        doctor_user = User.objects.create_user(
+            'Doctor',
+            'doctor@example.com',
+            'doctorpassword'
+        )
+        doctor_user.groups.add(self.doctor_group)
+        self.doctor = Doctor.objects.create(
+            user=doctor_user
+        )
+
+        # Make a patient
+        self.patient_user = User.objects.create_user(
+            'Patient',
+            'patient@example.com',
+            'patientpassword'
+        )
+        self.patient_user.groups.add(patient_group)
+        self.patient = Patient.objects.create(
+            user=self.patient_user,
+            doctor=self.doctor,
+            date_of_birth=timezone.localtime().date(),
+        )
+
+    def test_role_cached(self):
+        """The role and profile should be resolved with one query and then cached."""
+        with self.assertNumQueries(1):
+            role, patient = get_role(self.patient_user)
+        self.assertEqual(role, 'patient')
+        self.assertEqual(patient.pk, self.patient.pk)
+        self.assertEqual(patient.doctor_id, self.doctor.pk)
+        self.assertEqual(patient.date_of_birth, self.patient.date_of_birth)
+
+        with self.assertNumQueries(0):
+            role, patient = get_role(self.patient_user)
+        self.assertEqual(patient.user, self.patient_user)
+
+    def test_group_change_invalidates(self):
+        """Changing the user's groups should change their role."""
+        self.client.login(username='Patient', password='patientpassword')
+        self.assertEqual(self.client.get('/memocha/doctor/').status_code, 302)
+
+        self.patient_user.groups.clear()
+        self.patient_user.groups.add(self.doctor_group)
+        self.assertEqual(get_role(self.patient_user), (None, None))
+        self.assertEqual(self.client.get('/memocha/doctor/queue/items/').status_code, 404)
+
+        self.patient.delete()
+        Doctor.objects.create(user=self.patient_user)
+        self.assertEqual(self.client.get('/memocha/doctor/queue/items/').status_code, 200)
+
+    def test_anonymous_users(self):
+        """Pages should send anonymous users to the login page, JSON endpoints should 404."""
+        response = self.client.get('/memocha/doctor/queue/')
+        self.assertRedirects(response, '/accounts/login/?next=/memocha/doctor/queue/', fetch_redirect_response=False)
+        self.assertEqual(self.client.get('/memocha/doctor/queue/items/').status_code, 404)
+
 
 class HomeButtonTestCase(TransactionTestCase):
     """Tests the behavior of the home button"""
@@ -452,3 +1637,249 @@ class PatientCreationTestCase(TransactionTestCase):
         expected_error = ('The secure code entered do not match that provided '
                           'by your doctor. Please try again.')
         self.assertFormError(response, 'form', None, expected_error)
+
+
+class ImportPatientsTestCase(TransactionTestCase):
+    """Tests importing patients with the import_patients command."""
+
+    def setUp(self):
+        # Make the doctor and patient groups
+        doctor_group = Group.objects.create(name='Doctors')
+        Group.objects.create(name='Patients')
+
+        # Make a doctor
+        doctor_user = User.objects.create_user(
+            'Doctor',
+            'doctor@example.com',
+            'doctorpassword'
+        )
+        doctor_user.groups.add(doctor_group)
+        self.doctor = Doctor.objects.create(
+            user=doctor_user
+        )
+
+        # Two patients, the first with two prescriptions, and an invalid row
+        self.path = os.path.join(os.path.dirname(__file__), 'test_import.csv')
+        with open(self.path, 'w') as f:
+            f.write(
+                'first_name,last_name,email,date_of_birth,secure_code,medication,dosage,dosage_times\n'
+                'Jane,Doe,jane@example.com,1950-01-02,code1,test,1,"09:00,21:00"\n'
+                'Jane,Doe,jane@example.com,1950-01-02,code1,other_test,2,08:00\n'
+                'John,Doe,john@example.com,1960-03-04,code2,test,1,12:00\n'
+                'Bad,Row,not an email,1970-01-01,code3,,,\n'
+            )
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def import_patients(self):
+        stdout = StringIO()
+        call_command('import_patients', self.path, doctor='Doctor', workers=1, stdout=stdout, stderr=StringIO())
+        return stdout.getvalue()
+
+    def test_import(self):
+        """The patients should be able to activate their accounts with their secure codes."""
+        self.assertIn('Imported 2 patient(s), skipped 1.', self.import_patients())
+
+        patient = Patient.objects.get(user__username='Jane_Doe_1950-01-02')
+        self.assertEqual(patient.doctor, self.doctor)
+        self.assertTrue(patient.user.groups.filter(name='Patients').exists())
+        self.assertTrue(patient.user.check_password('code1'))
+        self.assertEqual(
+            sorted((prescription.medication, len(prescription.dosage_times))
+                   for prescription in patient.prescriptions.all()),
+            [('other_test', 1), ('test', 2)]
+        )
+        self.assertEqual(patient.adherence(1), (0, 3))
+
+        # Importing the same file again should not duplicate anyone
+        self.assertIn('Imported 0 patient(s), skipped 3.', self.import_patients())
+        self.assertEqual(Patient.objects.count(), 2)
+
+
+class BenchmarkTestCase(TransactionTestCase):
+    """Tests the load data generator and the benchmark runner."""
+
+    def setUp(self):
+        call_command(
+            'generate_load_data', doctors=1, patients=2, prescriptions=1, days=5, stdout=StringIO()
+        )
+        self.output = os.path.join(os.path.dirname(__file__), 'test_benchmark.json')
+
+    def tearDown(self):
+        if os.path.exists(self.output):
+            os.remove(self.output)
+        for video in Video.objects.all():
+            video.upload.delete()
+
+    def test_generated_data(self):
+        """Every patient should have a prescription and an adherence row for each generated day."""
+        self.assertEqual(Patient.objects.count(), 2)
+        for patient in Patient.objects.all():
+            self.assertEqual(patient.prescriptions.count(), 1)
+            self.assertEqual(patient.adherence_set.filter(day__lt=timezone.localtime().date()).count(), 5)
+
+    def test_clear(self):
+        """Clearing should delete the generated users along with their prescriptions and videos."""
+        upload = Video.objects.first().upload
+        call_command('generate_load_data', doctors=0, clear=True, stdout=StringIO())
+        # The file is left to collect_garbage
+        upload.delete(save=False)
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(Prescription.objects.exists())
+        self.assertFalse(Video.objects.exists())
+        self.assertFalse(Adherence.objects.exists())
+
+    def test_results_saved_and_compared(self):
+        """The results should be saved as JSON and an extra query should count as a regression."""
+        videos = Video.objects.count()
+        call_command('benchmark', iterations=2, warmup=0, output=self.output, stdout=StringIO())
+        with open(self.output) as f:
+            results = json.load(f)['results']
+        self.assertEqual(sorted(results), sorted(BENCHMARKS))
+        # The recorded videos are rolled back
+        self.assertEqual(Video.objects.count(), videos)
+
+        baseline = {name: dict(result) for name, result in results.items()}
+        self.assertEqual(compare(baseline, results, 0.2), [])
+        baseline['doctor_dashboard']['queries'] -= 1
+        self.assertEqual(
+            [(name, measure) for name, measure, _, _ in compare(baseline, results, 0.2)],
+            [('doctor_dashboard', 'queries')]
+        )
+
+
+class PerfStatsTestCase(TransactionTestCase):
+    """Tests the per-view statistics of PerfStatsMiddleware and the perfstats command."""
+
+    def setUp(self):
+        call_command(
+            'generate_load_data', doctors=1, patients=1, prescriptions=1, days=3, stdout=StringIO()
+        )
+        self.directory = os.path.join(os.path.dirname(__file__), 'test_perfstats')
+
+    def tearDown(self):
+        call_command('perfstats', dir=self.directory, reset=True, stdout=StringIO())
+        if os.path.isdir(self.directory):
+            os.rmdir(self.directory)
+        for video in Video.objects.all():
+            video.upload.delete()
+
+    def test_fingerprint(self):
+        """Queries differing only in their parameters should have the same fingerprint."""
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id IN (1, 2, 3) AND name = 'it''s'"),
+            fingerprint("SELECT  * FROM t WHERE id IN (4) AND name = 'other'"),
+        )
+
+    def test_stats_recorded(self):
+        """Each request should be counted for its view along with its queries and render time."""
+        patient = Patient.objects.select_related('doctor__user').get()
+        c = Client()
+        c.force_login(patient.doctor.user)
+        with override_settings(
+                MIDDLEWARE=['memocha.middleware.PerfStatsMiddleware'] + settings.MIDDLEWARE,
+                PERF_STATS_DIR=self.directory,
+                PERF_STATS_FLUSH_INTERVAL=0):
+            for _ in range(2):
+                self.assertEqual(c.get('/memocha/doctor/{0}/'.format(patient.pk)).status_code, 200)
+
+        out = StringIO()
+        call_command('perfstats', dir=self.directory, json=True, stdout=out)
+        stats = json.loads(out.getvalue())['memocha:patient_details']
+        self.assertEqual(stats['requests'], 2)
+        self.assertEqual(sum(stats['histogram']), 2)
+        self.assertGreater(stats['queries'], 0)
+        self.assertGreater(stats['render_ms'], 0)
+
+
+class ProfilingTestCase(TransactionTestCase):
+    """Tests the saving of request profiles and the profiles command."""
+
+    def setUp(self):
+        call_command(
+            'generate_load_data', doctors=1, patients=1, prescriptions=1, days=3, stdout=StringIO()
+        )
+        self.directory = os.path.join(os.path.dirname(__file__), 'test_profiles')
+
+    def tearDown(self):
+        call_command('profiles', dir=self.directory, delete=True, stdout=StringIO())
+        if os.path.isdir(self.directory):
+            os.rmdir(self.directory)
+        for video in Video.objects.all():
+            video.upload.delete()
+
+    def get_details(self, **profile_settings):
+        patient = Patient.objects.select_related('doctor__user').get()
+        c = Client()
+        c.force_login(patient.doctor.user)
+        with override_settings(
+                MIDDLEWARE=['memocha.middleware.ProfilingMiddleware'] + settings.MIDDLEWARE,
+                PROFILE_DIR=self.directory,
+                **profile_settings):
+            self.assertEqual(c.get('/memocha/doctor/{0}/'.format(patient.pk)).status_code, 200)
+
+    def test_fast_requests_not_saved(self):
+        """Requests under the threshold should not be profiled unless sampled."""
+        self.get_details(PROFILE_THRESHOLD=60000, PROFILE_SAMPLE_RATE=0, PROFILE_STACK_SAMPLE_RATE=1)
+        out = StringIO()
+        call_command('profiles', dir=self.directory, stdout=out)
+        self.assertIn('No matching profiles', out.getvalue())
+
+    def test_unwatched_requests_not_saved(self):
+        """Slow requests should only be saved if their stacks were sampled."""
+        self.get_details(PROFILE_THRESHOLD=0, PROFILE_SAMPLE_RATE=0, PROFILE_STACK_SAMPLE_RATE=0)
+        out = StringIO()
+        call_command('profiles', dir=self.directory, stdout=out)
+        self.assertIn('No matching profiles', out.getvalue())
+
+    def test_profiles_saved(self):
+        """Slow and sampled requests should be saved with their view, role and hot functions."""
+        self.get_details(PROFILE_THRESHOLD=0, PROFILE_SAMPLE_RATE=0, PROFILE_STACK_SAMPLE_RATE=1)
+        self.get_details(PROFILE_THRESHOLD=60000, PROFILE_SAMPLE_RATE=1)
+        out = StringIO()
+        call_command('profiles', dir=self.directory, list=True, stdout=out)
+        output = out.getvalue()
+        self.assertIn('2 profile(s)', output)
+        self.assertIn('sampled', output)
+        self.assertIn('cprofile', output)
+        self.assertIn('doctor', output)
+
+        # The view itself should show up among the functions run under cProfile
+        out = StringIO()
+        call_command('profiles', dir=self.directory, kind='cprofile', sort='inclusive', top=1000, stdout=out)
+        self.assertIn('(patient_details)', out.getvalue())
+
+
+class ScheduleWheelTestCase(SimpleTestCase):
+    """Tests the timing wheel the dose dispatcher finds the due doses with."""
+
+    def setUp(self):
+        self.wheel = ScheduleWheel()
+        self.morning = Dose(1, 10, 100, 'test', '1', time(hour=8))
+        self.midnight = Dose(2, 20, 200, 'test', '1', time(minute=10))
+        self.wheel.add(self.morning)
+        self.wheel.add(self.midnight)
+
+    def at(self, day, hour, minute):
+        return timezone.make_aware(datetime(2017, 1, day, hour, minute))
+
+    def test_windows_opening(self):
+        """A dose should be due once, as its window opens, and not before the wheel has started."""
+        self.assertEqual(self.wheel.advance(self.at(1, 7, 28)), [])
+        self.assertEqual(self.wheel.advance(self.at(1, 7, 29)), [])
+        self.assertEqual(self.wheel.advance(self.at(1, 7, 30)), [(datetime(2017, 1, 1).date(), [self.morning])])
+        self.assertEqual(self.wheel.advance(self.at(1, 7, 31)), [])
+        # The window of a dose just after midnight opens at midnight, not the day before
+        self.assertEqual(self.wheel.advance(self.at(2, 0, 0)), [(datetime(2017, 1, 2).date(), [self.midnight])])
+
+    def test_patients_replaced(self):
+        """A patient's doses should be removable, and stale windows skipped after a stall."""
+        self.wheel.remove_patient(2)
+        self.assertEqual(len(self.wheel), 1)
+        self.wheel.advance(self.at(1, 6, 0))
+        # A dose whose window is still open is caught up on after a stall
+        self.assertEqual(self.wheel.advance(self.at(1, 8, 1)), [(datetime(2017, 1, 1).date(), [self.morning])])
+        # Stalling past the whole window, which closes at 8:30, skips the dose
+        self.wheel.advance(self.at(2, 6, 0))
+        self.assertEqual(self.wheel.advance(self.at(2, 8, 31)), [])
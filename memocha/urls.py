@@ -2,6 +2,9 @@ from django.conf.urls import url
 
 from . import views
 
+UUID = '[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'
+
+API = r'^api/v{0}/'.format(views.API_VERSION)
 
 app_name = 'memocha'
 urlpatterns = [
@@ -9,8 +12,18 @@ urlpatterns = [
     url(r'^dashboard/$', views.dashboard, name='dashboard'),
     url(r'^patient/$', views.patient_dashboard, name='patient_dashboard'),
     url(r'^patient/record', views.record_video, name='record_video'),
+    url(r'^patient/upload/$', views.upload_start, name='upload_start'),
+    url(r'^patient/upload/(?P<session_id>{0})/$'.format(UUID), views.upload_chunk, name='upload_chunk'),
+    url(r'^patient/upload/(?P<session_id>{0})/finish/$'.format(UUID), views.upload_finish, name='upload_finish'),
     url(r'^doctor/$', views.doctor_dashboard, name='doctor_dashboard'),
+    url(r'^doctor/review/$', views.review_videos, name='review_videos'),
+    url(r'^doctor/queue/$', views.review_queue, name='review_queue'),
+    url(r'^doctor/queue/items/$', views.review_queue_items, name='review_queue_items'),
     url(r'^doctor/(?P<patient_id>[0-9]+)/$', views.patient_details, name='patient_details'),
+    url(r'^doctor/(?P<patient_id>[0-9]+)/calendar/$', views.patient_calendar, name='patient_calendar'),
+    url(API + r'patients/(?P<patient_id>[0-9]+)/prescriptions/$', views.api_prescriptions, name='api_prescriptions'),
+    url(API + r'patients/(?P<patient_id>[0-9]+)/videos/$', views.api_videos, name='api_videos'),
+    url(API + r'patients/(?P<patient_id>[0-9]+)/pending/$', views.api_pending_videos, name='api_pending_videos'),
     url(r'^new_patient/', views.patient_creation, name='patient_creation'),
     url(r'^new_doctor/', views.doctor_creation, name='doctor_creation'),
     url(r'^add_patient/', views.add_patient, name='add_patient')
@@ -1,18 +1,72 @@
+import hashlib
 import json
 from datetime import datetime, timedelta
 
-from django.db.models import Count
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.models import User, Group
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect, get_object_or_404
 from django.forms import formset_factory, modelformset_factory
-from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed, JsonResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
+import memocha.cache
+import memocha.media
+from memocha.decorators import role_required
 from memocha.forms import MyUserCreationForm, PatientCreationForm, PrescriptionForm, PatientAccountForm, UploadFileForm
-from memocha.models import Doctor, Patient, Prescription, Video
+from memocha.models import (
+    Adherence, Doctor, Patient, Prescription, UploadSession, Video, patient_username, touch_patients
+)
+
+
+# How many days of adherence the dashboards summarize
+ADHERENCE_DAYS = 30
+
+# How many weeks of the video calendar patient_calendar serves at once
+CALENDAR_WINDOW_WEEKS = 4
+MAX_CALENDAR_WINDOW_WEEKS = 26
+
+# How many videos review_queue_items serves at once, and how many
+# of the videos after those it sends along for preloading
+REVIEW_QUEUE_PAGE_SIZE = 10
+MAX_REVIEW_QUEUE_PAGE_SIZE = 50
+REVIEW_QUEUE_PRELOAD = 3
+
+# The version of the JSON API, which is part of its URLs and ETags
+API_VERSION = 1
+
+# How many days of adherence the doctor dashboard shows for each patient,
+# and the share of doses below which a patient is flagged as falling behind
+DASHBOARD_ADHERENCE_DAYS = 7
+DASHBOARD_ADHERENCE_WARNING = 0.8
+
+# How long the fragments of a patient's pages and the calendar windows are
+# cached for. They are keyed on the patient's version, which changes along
+# with their videos and prescriptions, so with a shared cache this only
+# bounds stale entries. With a per-process cache the other processes don't
+# see the version change, so the entries are kept for the short timeout.
+# Units: seconds
+PATIENT_CACHE_TIMEOUT = 7 * 24 * 3600
+PER_PROCESS_PATIENT_CACHE_TIMEOUT = 300
+
+# How long a doctor's dashboard is cached for. Changes to the patients and
+# their videos invalidate it sooner (see memocha.cache).
+# Units: seconds
+DASHBOARD_CACHE_TIMEOUT = 300
+
+
+def patient_cache_timeout():
+    """The timeout of the patient's cached fragments and calendar windows."""
+    if memocha.cache.is_shared():
+        return PATIENT_CACHE_TIMEOUT
+    return PER_PROCESS_PATIENT_CACHE_TIMEOUT
 
 
 def index(request):
@@ -21,17 +75,15 @@ def index(request):
 
 @login_required
 def dashboard(request):
-    if request.user.groups.filter(name='Patients').exists():
+    if request.role == 'patient':
         return redirect('/memocha/patient')
     else:
         return redirect('/memocha/doctor')
 
 
-@login_required
+@role_required('patient')
 def patient_dashboard(request):
-    if not request.user.groups.filter(name='Patients').exists():
-        return redirect('/accounts/login?next={0}'.format(request.path))
-    patient = Patient.objects.get(user=request.user)
+    patient = request.patient
 
     recordable_meds, recordable_med_times = patient.recordable_medications()
     recordable_med_times = [time.strftime('%H:%M') for time in recordable_med_times]
@@ -41,17 +93,6 @@ def patient_dashboard(request):
 
     dates_of_interest = [datetime.today() - timedelta(days=i)
                          for i in [4, 3, 2, 1, 0]]
-
-    video_list = []
-    videos = patient.video_set.filter(record_date__range=(
-        dates_of_interest[0].date(), dates_of_interest[-1]
-    ))
-    for video in videos:
-        video_list.append(video.corresponding_dosage())
-    video_list_json = json.dumps(video_list)
-
-    prescriptions = list(patient.prescriptions.all().values_list())
-    prescriptions_json = json.dumps(prescriptions, cls=DjangoJSONEncoder)
     return render(
         request,
         'memocha/patient_dashboard.html',
@@ -62,19 +103,42 @@ def patient_dashboard(request):
             'recordable_meds': recordable_meds,
             'recordable_med_times': recordable_med_times,
             'dates_of_interest': [date.strftime('%d %b') for date in dates_of_interest],
-            'prescriptions': prescriptions_json,
-            'video_list': video_list_json,
+            'video_start': dates_of_interest[0].date(),
+            'video_end': dates_of_interest[-1].date(),
+            'adherence_days': ADHERENCE_DAYS,
+            'adherence': patient.adherence(ADHERENCE_DAYS),
+            'cache_version': memocha.cache.get_version('patient', patient.pk),
+            'cache_timeout': patient_cache_timeout(),
         }
     )
 
 
-@login_required
+@role_required('doctor')
 def doctor_dashboard(request):
-    if not request.user.groups.filter(name='Doctors').exists():
-        return redirect('/accounts/login?next={0}'.format(request.path))
-    doctor = Doctor.objects.get(user=request.user)
-    patients = doctor.patient_set.all()
-    return render(request, 'memocha/doctor_dashboard.html', {'patients': patients})
+    doctor = request.doctor
+    # The adherence window moves with the day, so the day is part of the key
+    key = memocha.cache.make_key('doctor', doctor.pk, 'dashboard:{0}'.format(timezone.localtime().date()))
+    patients = cache.get(key)
+    if patients is None:
+        patients = []
+        for patient in doctor.patient_summaries(DASHBOARD_ADHERENCE_DAYS):
+            adherence = patient.recorded / patient.prescribed if patient.prescribed else None
+            patients.append({
+                'id': patient.id,
+                'name': str(patient),
+                'pending': patient.pending,
+                'last_video': patient.last_video,
+                'recorded': patient.recorded,
+                'prescribed': patient.prescribed,
+                'missed': patient.missed,
+                'adherence': adherence,
+                'behind': adherence is not None and adherence < DASHBOARD_ADHERENCE_WARNING,
+            })
+        cache.set(key, patients, DASHBOARD_CACHE_TIMEOUT)
+    return render(request, 'memocha/doctor_dashboard.html', {
+        'patients': patients,
+        'adherence_days': DASHBOARD_ADHERENCE_DAYS,
+    })
 
 
 def patient_creation(request):
@@ -84,7 +148,7 @@ def patient_creation(request):
             first_name = form.cleaned_data.get('first_name')
             last_name = form.cleaned_data.get('last_name')
             date_of_birth = form.cleaned_data.get('date_of_birth')
-            username = '{0}_{1}_{2}'.format(first_name, last_name, date_of_birth)
+            username = patient_username(first_name, last_name, date_of_birth)
             secure_code = form.cleaned_data.get('secure_code')
 
             implied_user = User.objects.filter(username=username)
@@ -147,7 +211,7 @@ def doctor_creation(request):
     return render(request, 'memocha/doctor_creation.html', {'form': form})
 
 
-@login_required
+@role_required('doctor')
 def add_patient(request):
     if request.method == 'POST':
         form = PatientCreationForm(request.POST)
@@ -156,7 +220,7 @@ def add_patient(request):
             first_name = form.cleaned_data.get('first_name')
             last_name = form.cleaned_data.get('last_name')
             date_of_birth = form.cleaned_data.get('date_of_birth')
-            username = '{0}_{1}_{2}'.format(first_name, last_name, date_of_birth)
+            username = patient_username(first_name, last_name, date_of_birth)
             password = make_password(form.cleaned_data.get('secure_code'))
             email = form.cleaned_data.get('email')
             user = User.objects.create(
@@ -170,7 +234,7 @@ def add_patient(request):
             user.groups.add(group)
             patient = Patient.objects.create(
                 user=user,
-                doctor=request.user.doctor,
+                doctor=request.doctor,
                 date_of_birth=date_of_birth,
             )
             for sub_form in formset:
@@ -183,88 +247,258 @@ def add_patient(request):
     return render(request, 'memocha/add_patient.html', {'form': form, 'formset': formset})
 
 
-@login_required
+@role_required('doctor')
 def patient_details(request, patient_id):
-    patient = get_object_or_404(Patient, pk=patient_id)
+    patient = get_object_or_404(Patient.objects.select_related('user'), pk=patient_id)
     # If the doctor tries to access the patient page of not
     # their patient, redirect to the doctor's dashboard
-    if not request.user.doctor.patient_set.filter(pk=patient.pk):
+    if patient.doctor_id != request.doctor.pk:
         return redirect('/memocha/doctor')
-    approval_videos = patient.videos_to_be_approved()
-    approval_needed = [video.corresponding_dosage() for video in approval_videos]
-    approval_needed_json = json.dumps(approval_needed, cls=DjangoJSONEncoder)
     if request.method == 'POST':
         # Remove the patient
         if request.POST.get('action', ) == 'remove':
-            # Deleting the user will delete the patient
+            # Deleting the user will delete the patient. The prescriptions
+            # and files left without an owner are deleted by the
+            # collect_garbage command.
             patient.user.delete()
-            # But we also need to delete any prescriptions
-            # that are no longer related to anyone
-            Prescription.objects.annotate(patients=Count('patient')).filter(patients=0).delete()
             return redirect('/memocha/doctor')
-        elif 'approve' in request.POST:
-            video = approval_videos[int(request.POST['approve'])]
-            video.approved = True
-            video.save()
-        elif 'disapprove' in request.POST:
-            video = approval_videos[int(request.POST['disapprove'])]
-            video.approved = False
-            video.save()
         else:  # Update Patient was clicked to update prescriptions
-            # A set to keep track of which previously existing prescriptions
-            # are in the new formset
-            existing_prescriptions = set([prescription.pk for prescription in patient.prescriptions.all()])
             formset = formset_factory(PrescriptionForm)(request.POST, prefix='p_form')
             if formset.is_valid():
-                for form in formset:
-                    # Check to see if the form matches an existing prescription
-                    matching_prescriptions = patient.prescriptions.filter(
-                        medication=form.cleaned_data['medication'],
-                        dosage=form.cleaned_data['dosage'],
-                        dosage_times=form.cleaned_data['dosage_times']
-                    )
-                    if matching_prescriptions:
-                        # Remove the matching prescription from the tracker
-                        for prescription in matching_prescriptions:
-                            existing_prescriptions.remove(prescription.pk)
-                        # Don't need to add this one because it already exists
-                        continue
-                    # Add the new prescription.
-                    prescription = form.save()
-                    patient.prescriptions.add(prescription)
-                # Any keys left in the existing_prescriptions set were not
-                # present in the formset and we can assume they have been
-                # removed
-                for prescription in existing_prescriptions:
-                    patient.prescriptions.remove(Prescription.objects.get(pk=prescription))
-                # Delete any prescriptions that are no longer related to anyone
-                Prescription.objects.annotate(patients=Count('patient')).filter(patients=0).delete()
+                # Forms left blank have no cleaned_data
+                patient.sync_prescriptions(form.cleaned_data for form in formset if form.cleaned_data)
                 return redirect('/memocha/doctor')
     if patient.prescriptions.all():
         formset = modelformset_factory(Prescription, fields='__all__', extra=0)(prefix='p_form', queryset=patient.prescriptions.all())
     else:
         formset = modelformset_factory(Prescription, fields='__all__')(prefix='p_form')
-    dates_of_interest = [(patient.user.date_joined + timedelta(days=i)).date()
-                         for i in range(int((timezone.localtime() - patient.user.date_joined).days)+1)]
-    video_list = []
-    videos = patient.video_set.all()
-    for video in videos:
-        video_list.append(video.corresponding_dosage())
-    video_list_json = json.dumps(video_list)
-    prescriptions = list(patient.prescriptions.all().values_list())
-    prescriptions_json = json.dumps(prescriptions, cls=DjangoJSONEncoder)
     return render(request, 'memocha/patient_details.html',
                   {
                       'patient': patient,
                       'formset': formset,
-                      'dates_of_interest': [date.strftime('%d %b') for date in dates_of_interest],
-                      'video_list': video_list_json,
-                      'prescriptions': prescriptions_json,
-                      'approval_needed': approval_needed_json,
+                      'adherence_days': ADHERENCE_DAYS,
+                      'adherence': patient.adherence(ADHERENCE_DAYS),
+                      'missed_doses': patient.misseddose_set.filter(
+                          day__gt=timezone.localtime().date() - timedelta(days=ADHERENCE_DAYS)
+                      ).select_related('prescription').order_by('-day', '-dosage_time'),
                   })
 
 
+@role_required('doctor', redirect_to_login=False)
+def patient_calendar(request, patient_id):
+    """Serves one window of a patient's video calendar as JSON.
+
+    The window covers CALENDAR_WINDOW_WEEKS weeks (or the ``weeks`` query
+    parameter) of days before the ``before`` date, newest first. The
+    response's ``before`` value is the cursor for the next, older window
+    and is null once the window reaches the day the patient joined.
+    """
+    patient = get_object_or_404(request.doctor.patient_set.select_related('user'), pk=patient_id)
+    try:
+        before = parse_date(request.GET.get('before') or '')
+        weeks = int(request.GET.get('weeks', CALENDAR_WINDOW_WEEKS))
+    except ValueError:
+        return HttpResponseBadRequest()
+    if before is None:
+        before = timezone.localtime().date() + timedelta(days=1)
+    weeks = min(max(weeks, 1), MAX_CALENDAR_WINDOW_WEEKS)
+
+    key = memocha.cache.make_key('patient', patient.pk, 'calendar:{0}:{1}'.format(before, weeks))
+    calendar = cache.get(key)
+    if calendar is None:
+        calendar = calendar_window(patient, before, weeks)
+        cache.set(key, calendar, patient_cache_timeout())
+    return JsonResponse(calendar)
+
+
+def calendar_window(patient, before, weeks):
+    """Builds the data patient_calendar serves for one window."""
+    date_joined = timezone.localtime(patient.user.date_joined).date()
+    start = max(before - timedelta(weeks=weeks), date_joined)
+    dates = [before - timedelta(days=i) for i in range(1, (before - start).days + 1)]
+    videos = patient.video_set.filter(
+        dosage_date__gte=start,
+        dosage_date__lt=before,
+    ).order_by('-dosage_date', '-dosage_time')
+    return {
+        'dates': [{'day': date.isoformat(), 'date': date.strftime('%d %b')} for date in dates],
+        'videos': videos.dosages(),
+        'before': start.isoformat() if start > date_joined else None,
+    }
+
+
+def viewable_patients(request):
+    """The patients whose data the user may see: themselves, or a doctor's patients."""
+    if request.patient is not None:
+        return Patient.objects.filter(pk=request.patient.pk)
+    if request.doctor is not None:
+        return Patient.objects.filter(doctor=request.doctor)
+    return Patient.objects.none()
+
+
+def patient_data_etag(request, patient_id):
+    """Computes the ETag of one of the JSON datasets of a patient.
+
+    The ETag changes whenever the patient's videos or prescriptions do (see
+    Patient.data_changed), so checking it costs a single primary key lookup.
+    The URL is part of it since the datasets share the timestamp.
+    """
+    data_changed = viewable_patients(request).filter(
+        pk=patient_id
+    ).values_list('data_changed', flat=True).first()
+    if data_changed is None:
+        return None
+    url = hashlib.sha1(request.get_full_path().encode('utf-8')).hexdigest()[:16]
+    return 'v{0}-{1}-{2:x}-{3}'.format(
+        API_VERSION, patient_id, int(data_changed.timestamp() * 1000000), url
+    )
+
+
+def patient_data(view):
+    """Decorates the views serving a patient's JSON datasets.
+
+    Clients have to revalidate their copy every time, and get a 304 without
+    the dataset being built when it is still current.
+    """
+    return login_required(cache_control(private=True, no_cache=True)(condition(etag_func=patient_data_etag)(view)))
+
+
+@patient_data
+def api_prescriptions(request, patient_id):
+    """Serves the patient's prescriptions as JSON."""
+    patient = get_object_or_404(viewable_patients(request), pk=patient_id)
+    return JsonResponse({'prescriptions': list(patient.prescriptions.order_by('pk').values_list())})
+
+
+@patient_data
+def api_videos(request, patient_id):
+    """Serves the patient's videos for the days from ``start`` to ``end`` as JSON."""
+    patient = get_object_or_404(viewable_patients(request), pk=patient_id)
+    try:
+        start = parse_date(request.GET.get('start') or '')
+        end = parse_date(request.GET.get('end') or '')
+    except ValueError:
+        return HttpResponseBadRequest()
+    if start is None or end is None:
+        return HttpResponseBadRequest()
+    return JsonResponse({'videos': patient.video_set.filter(dosage_date__range=(start, end)).dosages()})
+
+
+@patient_data
+def api_pending_videos(request, patient_id):
+    """Serves the patient's videos that still need to be approved as JSON."""
+    patient = get_object_or_404(viewable_patients(request), pk=patient_id)
+    return JsonResponse({'videos': patient.videos_to_be_approved().dosages()})
+
+
+@role_required('doctor')
+def review_queue(request):
+    """The page doctors work through their patients' unreviewed videos on."""
+    return render(request, 'memocha/review_queue.html')
+
+
+@role_required('doctor', redirect_to_login=False)
+def review_queue_items(request):
+    """Serves the next unreviewed videos of all the doctor's patients as JSON.
+
+    Videos are ordered by when they were recorded and paged with a keyset
+    cursor (the record date and id of the last video seen, passed as
+    ``after``) instead of an offset, so a page costs the same however deep
+    into the queue it is. Besides the page itself, the response holds the
+    few videos after it under ``preload`` so the player can start fetching
+    them ahead of time.
+    """
+    doctor = request.doctor
+    try:
+        limit = min(max(int(request.GET.get('limit', REVIEW_QUEUE_PAGE_SIZE)), 1), MAX_REVIEW_QUEUE_PAGE_SIZE)
+    except ValueError:
+        return HttpResponseBadRequest()
+    videos = Video.objects.filter(
+        person__doctor=doctor,
+        approved=None,
+    ).select_related('prescription', 'person__user').order_by('record_date', 'pk')
+
+    after = request.GET.get('after')
+    if after:
+        try:
+            record_date, pk = after.rsplit(',', 1)
+            record_date = parse_datetime(record_date)
+            pk = int(pk)
+        except ValueError:
+            return HttpResponseBadRequest()
+        if record_date is None:
+            return HttpResponseBadRequest()
+        videos = videos.filter(
+            Q(record_date__gt=record_date) | Q(record_date=record_date, pk__gt=pk)
+        )
+
+    items = []
+    for video in videos[:limit + REVIEW_QUEUE_PRELOAD]:
+        item = video.corresponding_dosage()
+        item['patient'] = str(video.person)
+        item['patient_id'] = video.person_id
+        item['cursor'] = '{0},{1}'.format(video.record_date.isoformat(), video.pk)
+        items.append(item)
+    return JsonResponse({
+        'items': items[:limit],
+        'preload': items[limit:],
+        'next': items[limit - 1]['cursor'] if len(items) > limit else None,
+    })
+
+
+@role_required('doctor', redirect_to_login=False)
+@require_POST
+def review_videos(request):
+    """Approves and disapproves a batch of the doctor's patients' videos.
+
+    The request body is JSON with lists of video ids under ``approve`` and
+    ``disapprove``. Each list is applied with a single UPDATE, and the
+    response holds how many videos each decision was applied to. Videos
+    that don't belong to the doctor's patients are left alone.
+    """
+    doctor = request.doctor
+    try:
+        decisions = json.loads(request.body.decode('utf-8'))
+        approve = set(int(pk) for pk in decisions.get('approve', []))
+        disapprove = set(int(pk) for pk in decisions.get('disapprove', []))
+    except (ValueError, TypeError, AttributeError):
+        return HttpResponseBadRequest()
+    if approve & disapprove:
+        return HttpResponseBadRequest()
+
+    videos = Video.objects.filter(person__doctor=doctor)
+    with transaction.atomic():
+        approved = videos.filter(pk__in=approve).update(approved=True) if approve else 0
+        disapproved = videos.filter(pk__in=disapprove).update(approved=False) if disapprove else 0
+        # update() doesn't send the signals that keep the adherence counts
+        # and ETags up to date, so refresh the days that were reviewed here
+        keys = list(videos.filter(pk__in=approve | disapprove).values_list(
+            'person_id', 'prescription_id', 'dosage_date'
+        ).distinct())
+        Adherence.refresh(keys)
+        touch_patients(set(key[0] for key in keys))
+    return JsonResponse({'approved': approved, 'disapproved': disapproved})
+
+
 @login_required
+def media(request, path):
+    """Serves an uploaded video to the patient it belongs to or their doctor.
+
+    Staff can watch every video.
+    """
+    videos = Video.objects.with_file(path)
+    if request.patient is not None:
+        videos = videos.filter(person=request.patient)
+    elif request.doctor is not None:
+        videos = videos.filter(person__doctor=request.doctor)
+    elif not request.user.is_staff:
+        raise Http404
+    if not videos.exists():
+        raise Http404
+    return memocha.media.serve(request, path)
+
+
+@role_required('patient')
 def record_video(request):
 
     if request.method == 'GET':
@@ -272,14 +506,99 @@ def record_video(request):
     medication = request.POST['medication']
     form = UploadFileForm(request.POST, request.FILES, initial={'medication': medication})
     if form.is_valid() and request.FILES:
-        patient = Patient.objects.get(user=request.user)
+        patient = request.patient
+        record_date = timezone.localtime()
+        prescription = patient.prescriptions.get(medication=medication)
+        dosage_date, dosage_time = prescription.dosage_slot(record_date)
         video = Video(
             person=patient,
-            record_date=timezone.localtime(),
-            prescription=patient.prescriptions.get(medication=medication),
-            upload=request.FILES['data']
+            record_date=record_date,
+            prescription=prescription,
+            upload=request.FILES['data'],
+            dosage_date=dosage_date,
+            dosage_time=dosage_time,
         )
         video.save()
         # No need to redirect here since the AJAX request in video.js does it
         # for us. The AJAX request will redirect to the patient dashboard.
     return render(request, 'memocha/record_video.html', {'form': form})
+
+
+@role_required('patient', redirect_to_login=False)
+@require_POST
+def upload_start(request):
+    """Starts a chunked upload of a video for one of the patient's medications.
+
+    The video is then sent with upload_chunk and turned into a Video by
+    upload_finish.
+    """
+    patient = request.patient
+    prescription = get_object_or_404(patient.prescriptions, medication=request.POST.get('medication'))
+    session = UploadSession.objects.create(
+        person=patient,
+        prescription=prescription,
+        record_date=timezone.localtime(),
+    )
+    return JsonResponse({'id': session.pk, 'offset': session.offset}, status=201)
+
+
+@role_required('patient', redirect_to_login=False)
+def upload_chunk(request, session_id):
+    """Appends the request body to an upload session.
+
+    GET returns the number of bytes received so far, which is where a
+    client resumes after a disconnect. POST appends the raw request body,
+    which has to start at the ``offset`` query parameter. Chunks that
+    don't start where the last one ended are refused with a 409 and the
+    current offset. DELETE discards the session, e.g. when the patient
+    records the video again while the first take is still streaming.
+    """
+    if request.method == 'GET':
+        session = get_object_or_404(UploadSession, pk=session_id, person=request.patient)
+        return JsonResponse({'id': session.pk, 'offset': session.offset})
+    if request.method == 'DELETE':
+        with transaction.atomic():
+            session = get_object_or_404(
+                UploadSession.objects.select_for_update(),
+                pk=session_id,
+                person=request.patient
+            )
+            session.discard()
+        return HttpResponse(status=204)
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['GET', 'POST', 'DELETE'])
+    try:
+        offset = int(request.GET['offset'])
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest()
+    with transaction.atomic():
+        session = get_object_or_404(
+            UploadSession.objects.select_for_update(),
+            pk=session_id,
+            person=request.patient
+        )
+        if offset != session.offset:
+            return JsonResponse({'id': session.pk, 'offset': session.offset}, status=409)
+        # Stream the body straight to disk rather than through request.body
+        session.append(request)
+    return JsonResponse({'id': session.pk, 'offset': session.offset})
+
+
+@role_required('patient', redirect_to_login=False)
+@require_POST
+def upload_finish(request, session_id):
+    """Turns a completed upload session into a Video."""
+    with transaction.atomic():
+        session = get_object_or_404(
+            UploadSession.objects.select_for_update(),
+            pk=session_id,
+            person=request.patient
+        )
+        if not session.has_data():
+            return JsonResponse({
+                'id': session.pk,
+                'offset': session.offset,
+                'error': 'Nothing has been uploaded to this session.',
+            }, status=400)
+        video = session.finalize()
+    return JsonResponse({'video': video.pk}, status=201)
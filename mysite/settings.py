@@ -49,10 +49,38 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'memocha.middleware.RoleMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Per-view query counts, SQL and render times, see memocha.perf. Each web
+# server process writes its statistics to PERF_STATS_DIR every
+# PERF_STATS_FLUSH_INTERVAL seconds, and starts over every
+# PERF_STATS_WINDOW seconds. The perfstats command reports them.
+# Units: seconds
+PERF_STATS_DIR = os.environ.get('PERF_STATS_DIR')
+PERF_STATS_FLUSH_INTERVAL = 60
+PERF_STATS_WINDOW = 3600
+if PERF_STATS_DIR:
+    MIDDLEWARE.insert(0, 'memocha.middleware.PerfStatsMiddleware')
+
+# Profiles of slow requests, see memocha.profiling. A
+# PROFILE_STACK_SAMPLE_RATE fraction of the requests have their stacks
+# sampled every PROFILE_SAMPLE_INTERVAL seconds, and are saved to
+# PROFILE_DIR if they take longer than PROFILE_THRESHOLD milliseconds. A
+# PROFILE_SAMPLE_RATE fraction of all requests is run under cProfile
+# instead. Only the newest PROFILE_MAX_FILES profiles are kept. The
+# profiles command summarizes them.
+PROFILE_DIR = os.environ.get('PROFILE_DIR')
+PROFILE_THRESHOLD = float(os.environ.get('PROFILE_THRESHOLD', 1000))
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.05))
+PROFILE_STACK_SAMPLE_RATE = float(os.environ.get('PROFILE_STACK_SAMPLE_RATE', 0.1))
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.001))
+PROFILE_MAX_FILES = 1000
+if PROFILE_DIR:
+    MIDDLEWARE.insert(0, 'memocha.middleware.ProfilingMiddleware')
+
 ROOT_URLCONF = 'mysite.urls'
 
 TEMPLATES = [
@@ -102,6 +130,27 @@ else:
     }
 
 
+# Cache
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+# Cached data is shared between the web server's processes through
+# memcached when MEMCACHED_LOCATION is set, e.g. to an ElastiCache
+# endpoint. Otherwise every process has a cache of its own, which is
+# only suitable for development.
+
+if 'MEMCACHED_LOCATION' in os.environ:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': os.environ['MEMCACHED_LOCATION'].split(','),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
@@ -143,9 +192,46 @@ STATIC_ROOT = os.path.join(BASE_DIR, "www", "static")
 STATIC_URL = '/static/'
 MEDIA_ROOT = os.path.join(BASE_DIR, "www", "media")
 MEDIA_URL = '/media/'
+# Where partially uploaded videos are kept until they are finalized
+UPLOAD_SESSION_ROOT = os.path.join(BASE_DIR, "www", "uploads")
+
+# Media files are served by memocha.views.media, which checks that the user
+# may see the file. Setting MEDIA_SENDFILE_HEADER to 'X-Sendfile' (Apache
+# with mod_xsendfile, see wsgi.conf) or 'X-Accel-Redirect' (nginx) hands the
+# transfer off to the web server once the check has passed.
+MEDIA_SENDFILE_HEADER = os.environ.get('MEDIA_SENDFILE_HEADER')
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# The tools the background jobs in memocha.jobs use to process videos
+FFMPEG_BINARY = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+FFPROBE_BINARY = os.environ.get('FFPROBE_BINARY', 'ffprobe')
+
+# How the dispatch_doses command delivers the reminders of the doses that
+# can be recorded, see memocha.reminders. FileBackend writes them to
+# REMINDER_FILE_PATH.
+REMINDER_BACKEND = os.environ.get('REMINDER_BACKEND', 'memocha.reminders.LogBackend')
+REMINDER_FILE_PATH = os.path.join(BASE_DIR, "www", "reminders.jsonl")
 
 LOGOUT_REDIRECT_URL = '/memocha/'
 
+# The memocha.perf logger gets a JSON line per request when
+# PerfStatsMiddleware is enabled
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'memocha': {
+            'handlers': ['console'],
+            'level': os.environ.get('MEMOCHA_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
+
 SECURE_CONTENT_TYPE_NOSNIFF = True
 SECURE_BROWSER_XSS_FILTER = True
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARD_PROTO', 'https')
@@ -15,13 +15,15 @@ Including another URLconf
 """
 from django.conf import settings
 from django.conf.urls import url, include
-from django.conf.urls.static import static
 from django.contrib.auth import views as auth_views
 from django.contrib import admin
 
+from memocha import views as memocha_views
+
 urlpatterns = [
     url(r'^memocha/', include('memocha.urls')),
     url(r'^accounts/login/$', auth_views.LoginView.as_view(template_name='accounts/login.html')),
     url(r'^accounts/logout/$', auth_views.LogoutView.as_view(), {'next_page': settings.LOGOUT_REDIRECT_URL}),
     url(r'^admin/', admin.site.urls),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    url(r'^{0}(?P<path>.+)$'.format(settings.MEDIA_URL.lstrip('/')), memocha_views.media, name='media'),
+]